@@ -1,13 +1,71 @@
 """
 Class to configure Cisco ISE via the ERS API
 """
+import asyncio
+import base64
+import csv
+import gzip
+import http
+import io
+import ipaddress
 import json
+import logging
 import os
+import random
 import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import msgspec
+    from typing import List, Optional, TypedDict, Union
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
 
 base_dir = os.path.dirname(__file__)
+log = logging.getLogger(__name__)
+
+# Colon or dash separated pairs, Cisco dotted quads or bare hex, matched against the whole string
+MAC_RE = re.compile(r'[0-9A-Fa-f]{2}([:-])[0-9A-Fa-f]{2}(?:\1[0-9A-Fa-f]{2}){4}'
+                    r'|[0-9A-Fa-f]{4}\.[0-9A-Fa-f]{4}\.[0-9A-Fa-f]{4}'
+                    r'|[0-9A-Fa-f]{12}')
+MAC_SEPARATORS = str.maketrans('', '', ':-.')
+
+# Column layout of the ISE endpoint import template
+ENDPOINT_CSV_FIELDS = ('MACAddress', 'EndPointPolicy', 'IdentityGroup', 'Description')
+
+# Network device inventory columns, the add_device arguments, and the onboarding report layout
+DEVICE_INVENTORY_FIELDS = ('name', 'ip_address', 'radius_key', 'snmp_ro', 'dev_group', 'dev_location', 'dev_type',
+                           'description', 'snmp_v', 'dev_profile')
+DEVICE_REPORT_FIELDS = ('name', 'ip_address', 'success', 'response', 'error')
+
+# add_endpoint arguments, as bulk_add_endpoints takes them
+ENDPOINT_FIELDS = ('name', 'mac', 'group_id', 'static_profile_assigment', 'static_group_assignment', 'profile_id',
+                   'description')
+
+# add_user arguments, as bulk_add_users takes them
+USER_FIELDS = ('user_id', 'password', 'user_group_oid', 'enable', 'first_name', 'last_name', 'email', 'description')
 
 
 class InvalidMacAddress(Exception):
@@ -18,50 +76,2133 @@ class InvalidMacAddress(Exception):
         return repr(self.value)
 
 
+class ERSError(Exception):
+    def __init__(self, value, status_code=None):
+        self.value = value
+        self.status_code = status_code
+
+    def __str__(self):
+        return repr(self.value)
+
+
+# One HTTP call made by ERS, as passed to instrumentation hooks. latency covers all attempts
+# and retry backoff, page is the SearchResult page number for listings.
+RequestRecord = namedtuple('RequestRecord', ['method', 'resource', 'url', 'status_code', 'latency', 'bytes_sent',
+                                             'bytes_received', 'retries', 'page', 'error'])
+
+# Changes bringing endpoint group membership in line with a desired state. add and move are lists
+# of (mac, group name) tuples, delete a list of MACs and rejects the desired MACs that were invalid
+# plus the endpoints of managed groups whose name is not a MAC, which are left alone.
+MembershipPlan = namedtuple('MembershipPlan', ['add', 'move', 'delete', 'unchanged', 'rejects'])
+
+# A detail served from the DetailCache, standing in for the requests response
+CachedResponse = namedtuple('CachedResponse', ['status_code', 'content', 'headers'])
+
+
+class MetricsAggregator(object):
+    def __init__(self, max_samples=10000):
+        """
+        Instrumentation hook aggregating RequestRecords per method and resource type
+        :param max_samples: Latency samples kept per method and resource for the percentiles
+        """
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything recorded so far
+        """
+        with self._lock:
+            self.latencies = defaultdict(lambda: deque(maxlen=self.max_samples))
+            self.latency_sum = defaultdict(float)
+            self.counts = defaultdict(int)
+            self.statuses = defaultdict(int)
+            self.bytes_sent = defaultdict(int)
+            self.bytes_received = defaultdict(int)
+            self.retries = defaultdict(int)
+            self.max_page = defaultdict(int)
+
+    def __call__(self, record):
+        key = (record.method, record.resource)
+        with self._lock:
+            self.latencies[key].append(record.latency)
+            self.latency_sum[key] += record.latency
+            self.counts[key] += 1
+            self.statuses[key + (record.status_code or record.error,)] += 1
+            self.bytes_sent[key] += record.bytes_sent
+            self.bytes_received[key] += record.bytes_received
+            self.retries[key] += record.retries
+            if record.page:
+                self.max_page[key] = max(self.max_page[key], record.page)
+
+    @staticmethod
+    def _percentile(ordered, percentile):
+        # Nearest-rank percentile of a sorted list
+        return ordered[max(0, -(-len(ordered) * percentile // 100) - 1)]
+
+    def summary(self, percentiles=(50, 95, 99)):
+        """
+        Summarise the recorded requests
+        :param percentiles: Latency percentiles to report
+        :return: Dictionary keyed by (method, resource) of count, retries, bytes, deepest page and latency percentiles
+        """
+        with self._lock:
+            result = {}
+            for key, samples in self.latencies.items():
+                ordered = sorted(samples)
+                stats = {'count': self.counts[key], 'retries': self.retries[key], 'bytes_sent': self.bytes_sent[key],
+                         'bytes_received': self.bytes_received[key], 'max_page': self.max_page[key]}
+                for percentile in percentiles:
+                    stats['p{0}'.format(percentile)] = MetricsAggregator._percentile(ordered, percentile)
+                result[key] = stats
+            return result
+
+    def report(self):
+        """
+        Plain text table of the summary
+        :return: Report string
+        """
+        lines = ['{0:<7} {1:<20} {2:>8} {3:>8} {4:>8} {5:>8} {6:>8}'.format(
+                'method', 'resource', 'count', 'retries', 'p50', 'p95', 'p99')]
+        for (method, resource), stats in sorted(self.summary().items()):
+            lines.append('{0:<7} {1:<20} {2:>8} {3:>8} {4:>8.3f} {5:>8.3f} {6:>8.3f}'.format(
+                    method, resource, stats['count'], stats['retries'], stats['p50'], stats['p95'], stats['p99']))
+        return '\n'.join(lines)
+
+    def prometheus(self, prefix='ers'):
+        """
+        Export the metrics in the Prometheus text exposition format
+        :param prefix: Metric name prefix
+        :return: Exposition text
+        """
+        summary = self.summary()
+        labels = '{{method="{0}",resource="{1}"'.format
+        lines = ['# HELP {0}_requests_total ERS requests by method, resource and status'.format(prefix),
+                 '# TYPE {0}_requests_total counter'.format(prefix)]
+        with self._lock:
+            for (method, resource, status), count in sorted(self.statuses.items(), key=str):
+                lines.append('{0}_requests_total{1},status="{2}"}} {3}'.format(
+                        prefix, labels(method, resource), status, count))
+
+        lines += ['# HELP {0}_request_latency_seconds ERS request latency including retries'.format(prefix),
+                  '# TYPE {0}_request_latency_seconds summary'.format(prefix)]
+        for (method, resource), stats in sorted(summary.items()):
+            for quantile in ('0.5', '0.95', '0.99'):
+                lines.append('{0}_request_latency_seconds{1},quantile="{2}"}} {3}'.format(
+                        prefix, labels(method, resource), quantile, stats['p{0:g}'.format(float(quantile) * 100)]))
+            lines.append('{0}_request_latency_seconds_sum{1}}} {2}'.format(
+                    prefix, labels(method, resource), self.latency_sum[(method, resource)]))
+            lines.append('{0}_request_latency_seconds_count{1}}} {2}'.format(
+                    prefix, labels(method, resource), stats['count']))
+
+        for name, field, help_text in (('request_retries_total', 'retries', 'ERS request retries'),
+                                       ('request_bytes_sent_total', 'bytes_sent', 'ERS request body bytes sent'),
+                                       ('response_bytes_received_total', 'bytes_received', 'ERS response body bytes received'),
+                                       ('pagination_max_page', 'max_page', 'Deepest SearchResult page fetched')):
+            kind = 'gauge' if field == 'max_page' else 'counter'
+            lines += ['# HELP {0}_{1} {2}'.format(prefix, name, help_text), '# TYPE {0}_{1} {2}'.format(prefix, name, kind)]
+            for (method, resource), stats in sorted(summary.items()):
+                lines.append('{0}_{1}{2}}} {3}'.format(prefix, name, labels(method, resource), stats[field]))
+        return '\n'.join(lines) + '\n'
+
+
+class ResolutionCache(object):
+    def __init__(self, ttl=300, max_size=4096):
+        """
+        Name to OID cache, keyed per resource type, with a TTL and LRU eviction
+        :param ttl: Seconds an entry stays valid
+        :param max_size: Maximum number of entries kept, 0 disables the cache
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, resource, name):
+        """
+        Get a cached OID
+        :param resource: ERS resource type, e.g. endpointgroup
+        :param name: Name of the resource
+        :return: OID or None if not cached or expired
+        """
+        key = (resource, name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, resource, name, oid):
+        """
+        Cache an OID
+        :param resource: ERS resource type, e.g. endpointgroup
+        :param name: Name of the resource
+        :param oid: OID of the resource
+        """
+        if self.max_size <= 0:
+            return
+
+        key = (resource, name)
+        with self._lock:
+            self._entries[key] = (oid, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, resource=None, name=None):
+        """
+        Drop cached entries
+        :param resource: Only drop entries of this resource type, all types if None
+        :param name: Only drop the entry with this name
+        """
+        with self._lock:
+            if resource is not None and name is not None:
+                self._entries.pop((resource, name), None)
+            else:
+                for key in [k for k in self._entries if resource is None or k[0] == resource]:
+                    del self._entries[key]
+
+
+class DetailCache(object):
+    def __init__(self, ttl=0, max_size=1024, path=None, max_disk_size=100000):
+        """
+        Cache of detail GET responses keyed by resource type and OID, with an LRU memory tier and
+        an optional SQLite disk tier that survives restarts. Entries younger than ttl are served
+        without asking ISE, older ones are revalidated with If-None-Match when ISE sent an ETag.
+        :param ttl: Seconds an entry is served without revalidation, 0 always revalidates
+        :param max_size: Entries kept in memory
+        :param path: SQLite file of the disk tier, None for memory only
+        :param max_disk_size: Entries kept on disk
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_disk_size = max_disk_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            with self.db:
+                self.db.execute('CREATE TABLE IF NOT EXISTS details (resource TEXT, id TEXT, etag TEXT, body BLOB, '
+                                'stored REAL, used REAL, PRIMARY KEY (resource, id))')
+                self.db.execute('CREATE INDEX IF NOT EXISTS details_used ON details (used)')
+            # Counted once here and kept up to date, a count(*) per write would scan the table every time
+            self._disk_rows = self.db.execute('SELECT count(*) FROM details').fetchone()[0]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, resource, oid):
+        """
+        Get a cached detail
+        :param resource: ERS resource type, e.g. networkdevice
+        :param oid: OID of the resource
+        :return: Tuple of ETag, body and whether it is still fresh, None if not cached
+        """
+        key = (resource, oid)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            elif self.db is not None:
+                row = self.db.execute('SELECT etag, body, stored FROM details WHERE resource = ? AND id = ?',
+                                      key).fetchone()
+                if row is not None:
+                    entry = (row[0], bytes(row[1]), row[2])
+                    with self.db:
+                        self.db.execute('UPDATE details SET used = ? WHERE resource = ? AND id = ?', (now,) + key)
+                    self._remember(key, entry)
+        if entry is None:
+            return None
+        return entry[0], entry[1], now - entry[2] < self.ttl
+
+    def _remember(self, key, entry):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def set(self, resource, oid, etag, body):
+        """
+        Cache a detail, as long as it can be served fresh or revalidated
+        :param resource: ERS resource type, e.g. networkdevice
+        :param oid: OID of the resource
+        :param etag: ETag ISE sent with it, None if there was none
+        :param body: Raw response body
+        """
+        if not etag and self.ttl <= 0:
+            return
+
+        key = (resource, oid)
+        now = time.time()
+        with self._lock:
+            self._remember(key, (etag, body, now))
+            if self.db is not None:
+                with self.db:
+                    updated = self.db.execute('UPDATE details SET etag = ?, body = ?, stored = ?, used = ? '
+                                              'WHERE resource = ? AND id = ?', (etag, body, now, now) + key).rowcount
+                    if not updated:
+                        self.db.execute('INSERT INTO details VALUES (?, ?, ?, ?, ?, ?)', key + (etag, body, now, now))
+                        self._disk_rows += 1
+                    if self._disk_rows > self.max_disk_size:
+                        # Evict a tenth at a time so the delete runs once per many inserts, not on every one
+                        self._disk_rows -= self.db.execute(
+                                'DELETE FROM details WHERE rowid IN (SELECT rowid FROM details ORDER BY used LIMIT ?)',
+                                (self._disk_rows - self.max_disk_size * 9 // 10,)).rowcount
+
+    def touch(self, resource, oid):
+        """
+        Restart the TTL of an entry ISE confirmed is unchanged
+        """
+        key = (resource, oid)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], entry[1], now)
+            if self.db is not None:
+                with self.db:
+                    self.db.execute('UPDATE details SET stored = ?, used = ? WHERE resource = ? AND id = ?',
+                                    (now, now) + key)
+
+    def invalidate(self, resource=None, oid=None):
+        """
+        Drop cached entries
+        :param resource: Only drop entries of this resource type, all types if None
+        :param oid: Only drop the entry with this OID
+        """
+        with self._lock:
+            if resource is not None and oid is not None:
+                self._entries.pop((resource, oid), None)
+            else:
+                for key in [k for k in self._entries if resource is None or k[0] == resource]:
+                    del self._entries[key]
+
+            if self.db is not None:
+                with self.db:
+                    if resource is not None and oid is not None:
+                        cursor = self.db.execute('DELETE FROM details WHERE resource = ? AND id = ?', (resource, oid))
+                    elif resource is not None:
+                        cursor = self.db.execute('DELETE FROM details WHERE resource = ?', (resource,))
+                    else:
+                        cursor = self.db.execute('DELETE FROM details')
+                    self._disk_rows -= cursor.rowcount
+
+
+class RequestGovernor(object):
+    def __init__(self, rate_limit=None, max_concurrency=None):
+        """
+        Keeps requests under a rate and concurrency ceiling
+        :param rate_limit: Maximum requests per second, None for no limit
+        :param max_concurrency: Maximum requests in flight at once, None for no limit
+        """
+        self.rate_limit = rate_limit
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def __enter__(self):
+        if self._slots is not None:
+            self._slots.acquire()
+        if self.rate_limit:
+            # Hand out evenly spaced send times, sleeping until ours comes up
+            with self._lock:
+                now = time.monotonic()
+                send_at = max(now, self._next_slot)
+                self._next_slot = send_at + 1.0 / self.rate_limit
+            if send_at > now:
+                time.sleep(send_at - now)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._slots is not None:
+            self._slots.release()
+
+
+class ResourceList(object):
+    """
+    Compact (name, id) listing stored as columns instead of one tuple per row
+
+    OIDs are packed into a single bytearray, 16 bytes each, while they are all canonical UUIDs. Rows are only
+    built into tuples when they are read and slices are views sharing the same columns.
+    """
+    __slots__ = ('_names', '_ids', '_packed', '_start', '_stop')
+
+    def __init__(self):
+        self._names = []
+        self._ids = bytearray()
+        self._packed = True
+        self._start = 0
+        self._stop = None
+
+    @staticmethod
+    def _unpack_id(raw):
+        h = raw.hex()
+        return '{0}-{1}-{2}-{3}-{4}'.format(h[:8], h[8:12], h[12:16], h[16:20], h[20:])
+
+    def _id(self, i):
+        if self._packed:
+            return ResourceList._unpack_id(self._ids[i * 16:i * 16 + 16])
+        return self._ids[i]
+
+    def append(self, name, oid):
+        """
+        Add a row, only valid on a list that is not a slice of another
+        """
+        if self._packed:
+            try:
+                raw = bytes.fromhex(oid.replace('-', ''))
+            except ValueError:
+                raw = b''
+            if len(raw) == 16 and ResourceList._unpack_id(raw) == oid:
+                self._ids += raw
+                self._names.append(name)
+                return
+            # Not a canonical UUID, fall back to a plain list of strings
+            self._ids = [self._id(i) for i in range(len(self._names))]
+            self._packed = False
+
+        self._ids.append(oid)
+        self._names.append(name)
+
+    def extend(self, resources):
+        """
+        Add the rows of a SearchResult page
+        :param resources: List of resource dictionaries with name and id
+        """
+        for i in resources:
+            self.append(i['name'], i['id'])
+
+    @property
+    def names(self):
+        """
+        List of names
+        """
+        return self._names[self._start:self._stop]
+
+    @property
+    def ids(self):
+        """
+        List of OIDs
+        """
+        return [self._id(i) for i in range(*slice(self._start, self._stop).indices(len(self._names)))]
+
+    def __len__(self):
+        return len(range(*slice(self._start, self._stop).indices(len(self._names))))
+
+    def __iter__(self):
+        for i in range(*slice(self._start, self._stop).indices(len(self._names))):
+            yield self._names[i], self._id(i)
+
+    def __getitem__(self, index):
+        rows = range(*slice(self._start, self._stop).indices(len(self._names)))
+        if isinstance(index, slice):
+            rows = rows[index]
+            if rows.step != 1:
+                return [(self._names[i], self._id(i)) for i in rows]
+            view = ResourceList.__new__(ResourceList)
+            view._names, view._ids, view._packed = self._names, self._ids, self._packed
+            view._start, view._stop = rows.start, max(rows.start, rows.stop)
+            return view
+
+        i = rows[index]
+        return self._names[i], self._id(i)
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == tuple(b) for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return 'ResourceList({0} rows)'.format(len(self))
+
+
+class NodePool(object):
+    strategies = ('round_robin', 'least_latency')
+
+    def __init__(self, url_bases, strategy='round_robin', cooldown=30):
+        """
+        Spreads reads over several ISE nodes, steering around the ones that fail
+        :param url_bases: ERS base URLs of the nodes serving reads
+        :param strategy: round_robin, or least_latency to favour the node answering fastest
+        :param cooldown: Seconds a failed node is left alone before it gets another try
+        """
+        if strategy not in self.strategies:
+            raise ValueError('Unknown strategy {0}, use one of {1}'.format(strategy, ', '.join(self.strategies)))
+
+        self.url_bases = list(url_bases)
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self._latency = dict.fromkeys(self.url_bases)
+        self._down_until = dict.fromkeys(self.url_bases, 0.0)
+        self._failures = dict.fromkeys(self.url_bases, 0)
+        self._throttled = set()
+        self._turn = 0
+        self._lock = threading.Lock()
+
+    def healthy(self):
+        """
+        :return: List of the nodes not cooling down after a failure
+        """
+        now = time.monotonic()
+        return [i for i in self.url_bases if self._down_until[i] <= now]
+
+    def pick(self):
+        """
+        Choose the node for the next read
+        :return: ERS base URL, None if every node is down
+        """
+        with self._lock:
+            nodes = self.healthy()
+            if not nodes:
+                return None
+            if self.strategy == 'least_latency':
+                # Nodes without a measurement yet go first so they get one
+                return min(nodes, key=lambda i: self._latency[i] or 0.0)
+            self._turn += 1
+            return nodes[self._turn % len(nodes)]
+
+    def succeeded(self, url_base, latency):
+        """
+        Record a good response, folding its latency into the node's moving average
+        """
+        with self._lock:
+            previous = self._latency[url_base]
+            self._latency[url_base] = latency if previous is None else previous * 0.8 + latency * 0.2
+            self._down_until[url_base] = 0.0
+            self._throttled.discard(url_base)
+
+    def failed(self, url_base, throttled_for=None):
+        """
+        Take a node out of rotation for the cooldown
+        :param throttled_for: The node is up but shedding load (429), leave it alone this many seconds instead
+        """
+        with self._lock:
+            self._failures[url_base] += 1
+            if throttled_for is None:
+                self._down_until[url_base] = time.monotonic() + self.cooldown
+                self._throttled.discard(url_base)
+            else:
+                self._down_until[url_base] = time.monotonic() + throttled_for
+                self._throttled.add(url_base)
+
+    def throttled_for(self):
+        """
+        :return: Seconds until the first throttled node takes reads again, None if no node is only throttled
+        """
+        with self._lock:
+            now = time.monotonic()
+            waits = [self._down_until[i] - now for i in self._throttled]
+        return max(0.0, min(waits)) if waits else None
+
+    def route(self, url, url_base, default):
+        """
+        Point a URL at another node
+        :param url: URL on the default node or on any pooled node
+        :param url_base: ERS base URL of the node to send it to
+        :param default: ERS base URL of the primary node
+        :return: Rewritten URL, unchanged if it is on none of the known nodes
+        """
+        for base in [default] + self.url_bases:
+            if url.startswith(base + '/'):
+                return url_base + url[len(base):]
+        return url
+
+    def stats(self):
+        """
+        :return: Dictionary of healthy, latency (moving average in seconds) and failures, keyed by node
+        """
+        healthy = self.healthy()
+        return {i: {'healthy': i in healthy, 'throttled': i in self._throttled and i not in healthy,
+                    'latency': self._latency[i], 'failures': self._failures[i]}
+                for i in self.url_bases}
+
+
+class Batch(object):
+    def __init__(self, ers, workers=4, min_workers=1, max_workers=32, progress=None, latency_factor=2.0):
+        """
+        Runs many ERS method calls over a bounded thread pool sharing the ERS session, streaming
+        results back as they finish. The number of calls in flight starts at workers and adapts:
+        it grows by one after each run of clean calls and halves when calls come back throttled,
+        failing with 5xx or connection errors, or when latency climbs past latency_factor times the
+        fastest seen.
+        :param ers: ERS instance the calls go through
+        :param workers: Calls in flight to start with
+        :param min_workers: Fewest calls in flight
+        :param max_workers: Most calls in flight
+        :param progress: Callable passed (done, total, failed) after every call
+        :param latency_factor: Slowdown over the best latency that counts as overload
+        """
+        self.ers = ers
+        self.limit = max(min_workers, min(workers, max_workers))
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.progress = progress
+        self.latency_factor = latency_factor
+
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self._calls = deque()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._best_latency = None
+        self._latency = None
+        self._clean = 0
+        self._since_cut = 0
+        self._window = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def submit(self, method, *args, **kwargs):
+        """
+        Queue a call, it runs once results() is iterated
+        :param method: Name of an ERS method, e.g. add_device, or any callable returning a result dictionary
+        :return: Index of the call, results are yielded with it
+        """
+        func = getattr(self.ers, method) if isinstance(method, str) else method
+        index = self.total
+        self._calls.append((index, func, args, kwargs))
+        self.total += 1
+        return index
+
+    def cancel(self):
+        """
+        Drop every call not started yet, the ones in flight still finish and are yielded
+        :return: Number of calls dropped
+        """
+        dropped = len(self._calls)
+        self._calls.clear()
+        self.total -= dropped
+        return dropped
+
+    def close(self):
+        """
+        Cancel what is left and shut the pool down
+        """
+        self.cancel()
+        self._pool.shutdown(wait=True)
+
+    def _run(self, func, args, kwargs):
+        start = time.perf_counter()
+        overloaded = False
+        try:
+            result = func(*args, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            result = {'success': False, 'response': str(e), 'error': ''}
+            overloaded = True
+        except Exception as e:
+            result = {'success': False, 'response': str(e), 'error': ''}
+        if not result['success'] and result['error'] in self.ers.retry_statuses:
+            overloaded = True
+        return result, time.perf_counter() - start, overloaded
+
+    def _adapt(self, latency, overloaded):
+        """
+        Additive increase, multiplicative decrease of the number of calls in flight
+        """
+        self._latency = latency if self._latency is None else self._latency * 0.8 + latency * 0.2
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+        self._since_cut += 1
+
+        if overloaded or self._latency > self._best_latency * self.latency_factor:
+            self._clean = 0
+            # The calls in flight when the limit was cut report the same congestion, let them drain first
+            if self._since_cut >= self._window:
+                self._window = self.limit
+                self.limit = max(self.min_workers, self.limit // 2)
+                self._since_cut = 0
+        else:
+            self._clean += 1
+            if self._clean >= self.limit:
+                self.limit = min(self.max_workers, self.limit + 1)
+                self._clean = 0
+
+    def results(self):
+        """
+        Run the queued calls
+        :return: Generator of (index, result dictionary) tuples in completion order
+        """
+        in_flight = {}
+        while self._calls or in_flight:
+            while self._calls and len(in_flight) < self.limit:
+                index, func, args, kwargs = self._calls.popleft()
+                in_flight[self._pool.submit(self._run, func, args, kwargs)] = index
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = in_flight.pop(future)
+                result, latency, overloaded = future.result()
+                self._adapt(latency, overloaded)
+                self.done += 1
+                if not result['success']:
+                    self.failed += 1
+                if self.progress is not None:
+                    self.progress(self.done, self.total, self.failed)
+                yield index, result
+
+
+class JSONDecoder(object):
+    # Preferred backends, fastest first
+    backends = ('msgspec', 'orjson', 'json')
+
+    if msgspec is not None:
+        # Only the fields listings use, msgspec skips everything else while parsing. Typed as loosely
+        # as ISE sends them: descriptions may be null and the total a string.
+        _Resource = TypedDict('_Resource', {'id': str, 'name': str, 'description': Optional[str]}, total=False)
+        _Link = TypedDict('_Link', {'href': str}, total=False)
+        _SearchResult = TypedDict('_SearchResult', {'total': Union[int, str], 'resources': List[_Resource],
+                                                    'nextPage': _Link}, total=False)
+        _SearchPage = TypedDict('_SearchPage', {'SearchResult': _SearchResult}, total=False)
+
+    def __init__(self, backend=None):
+        """
+        Decodes ERS response bodies with the fastest JSON library installed
+        :param backend: msgspec, orjson or json, defaults to the first one installed
+        """
+        modules = {'msgspec': msgspec, 'orjson': orjson, 'json': json}
+        if backend is None:
+            backend = next(i for i in self.backends if modules[i] is not None)
+        if backend not in modules:
+            raise ValueError('Unknown JSON backend {0}, use one of {1}'.format(backend, ', '.join(self.backends)))
+        if modules[backend] is None:
+            raise ImportError('{0} is not installed, install it with "pip install {0}"'.format(backend))
+
+        self.backend = backend
+        # What decode raises on a body that isn't JSON
+        self.errors = (ValueError, msgspec.DecodeError) if backend == 'msgspec' else (ValueError,)
+        if backend == 'msgspec':
+            self.decode = msgspec.json.decode
+            self.decode_page = self._decode_page
+            self._page_decoder = msgspec.json.Decoder(JSONDecoder._SearchPage)
+        elif backend == 'orjson':
+            self.decode = self.decode_page = orjson.loads
+        else:
+            self.decode = self.decode_page = json.loads
+
+    def _decode_page(self, body):
+        """
+        Decode a SearchResult page with msgspec, only keeping the listing fields
+        """
+        try:
+            return self._page_decoder.decode(body)
+        except msgspec.ValidationError:
+            # A page the schema does not fit is still JSON, decode all of it like the other backends do
+            return msgspec.json.decode(body)
+
+
 class ERS(object):
-    def __init__(self, ise_node, ers_user, ers_pass, verify=False, disable_warnings=False, timeout=2):
+    # Largest page size the ERS SearchResult API accepts
+    max_page_size = 100
+    # Largest number of resources sent in one ERS bulk request
+    max_bulk_size = 500
+    # resourceMediaType of bulk requests per resource type, network devices live in their own namespace
+    bulk_media_types = {
+        'endpoint': 'vnd.com.cisco.ise.identity.endpoint.1.0+xml',
+        'internaluser': 'vnd.com.cisco.ise.identity.internaluser.1.0+xml',
+        'networkdevice': 'vnd.com.cisco.ise.network.networkdevice.1.1+xml',
+    }
+    # Responses worth retrying: throttled or the node is (re)starting
+    retry_statuses = (429, 502, 503, 504)
+    idempotent_methods = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+    # Methods secondary nodes can serve, everything else goes to the primary admin node
+    read_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, ise_node, ers_user, ers_pass, verify=False, disable_warnings=False, timeout=2,
+                 cache_ttl=300, cache_size=4096, retries=3, backoff=0.5, rate_limit=None, max_concurrency=None,
+                 url_base=None, hooks=None, json_backend=None, nodes=None, read_strategy='round_robin',
+                 node_cooldown=30, pool_maxsize=None, pool_block=False, detail_ttl=0, detail_cache_size=1024,
+                 detail_cache_path=None, coalesce=True, max_backoff=30):
         """
-        Class to interact with Cisco ISE via the ERS API
+        Class to interact with Cisco ISE via the ERS API. Headers and auth are set once here and
+        every request passes its own state as arguments, so one instance, with its connection
+        pool and caches, can be shared by any number of threads.
         :param ise_node: IP Address of the primary admin ISE node
         :param ers_user: ERS username
         :param ers_pass: ERS password
         :param verify: Verify SSL cert
         :param disable_warnings: Disable requests warnings
         :param timeout: Query timeout
+        :param cache_ttl: Seconds a name to OID resolution is cached
+        :param cache_size: Maximum number of cached resolutions, 0 disables the cache
+        :param retries: Number of times an idempotent request is retried on throttling, 5xx or connection errors
+        :param backoff: Base delay in seconds of the jittered exponential backoff between retries
+        :param rate_limit: Maximum requests per second sent to ISE, None for no limit
+        :param max_concurrency: Maximum requests in flight at once, None for no limit
+        :param url_base: ERS base URL, defaults to https://ise_node:9060/ers
+        :param hooks: Callables passed a RequestRecord after every request
+        :param json_backend: JSON library decoding responses (msgspec, orjson or json), the fastest installed if None
+        :param nodes: Nodes to spread reads over, as addresses or ERS base URLs. Writes always go to ise_node.
+        :param read_strategy: How reads pick a node, round_robin or least_latency
+        :param node_cooldown: Seconds a node that failed a read is left out of rotation
+        :param pool_maxsize: Keep-alive connections kept open per node, defaults to max_concurrency or 32
+        :param pool_block: Wait for a pooled connection when all are busy instead of opening a throwaway one
+        :param detail_ttl: Seconds a cached detail GET is served without asking ISE, 0 always revalidates it
+        :param detail_cache_size: Detail GET responses cached in memory, 0 disables the cache unless it is on disk
+        :param detail_cache_path: SQLite file keeping cached detail GET responses across runs
+        :param coalesce: Share one in flight GET between threads asking for the same URL at the same time
+        :param max_backoff: Longest wait in seconds before a retry, also capping what Retry-After asks for
         """
         self.ise_node = ise_node
         self.user_name = ers_user
         self.user_pass = ers_pass
 
-        self.url_base = 'https://{0}:9060/ers'.format(self.ise_node)
+        self.url_base = url_base or 'https://{0}:9060/ers'.format(self.ise_node)
         self.ise = requests.session()
         self.ise.auth = (self.user_name, self.user_pass)
         self.ise.verify = verify  # http://docs.python-requests.org/en/latest/user/advanced/#ssl-cert-verification
         self.disable_warnings = disable_warnings
         self.timeout = timeout
-        self.ise.headers.update({'Connection': 'keep_alive'})
+        # Fixed once here, per-request state is only ever passed as arguments so threads can share the session
+        self.ise.headers.update({'ACCEPT': 'application/json', 'Content-Type': 'application/json',
+                                 'Connection': 'keep-alive'})
+        self.id_cache = ResolutionCache(ttl=cache_ttl, max_size=cache_size)
+        self.detail_cache = None
+        if detail_cache_size > 0 or detail_cache_path is not None:
+            self.detail_cache = DetailCache(ttl=detail_ttl, max_size=detail_cache_size, path=detail_cache_path)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.governor = RequestGovernor(rate_limit=rate_limit, max_concurrency=max_concurrency)
+        self.hooks = list(hooks or [])
+        self.decoder = JSONDecoder(json_backend)
+        self.coalesce = coalesce
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self.nodes = None
+        if nodes:
+            self.nodes = NodePool([i if '://' in i else 'https://{0}:9060/ers'.format(i) for i in nodes],
+                                  strategy=read_strategy, cooldown=node_cooldown)
+
+        # The default pool keeps 10 connections, more concurrent requests than that each pay for a
+        # new TLS handshake. Size it for the concurrency so every request finds a warm connection.
+        adapter = HTTPAdapter(pool_connections=max(10, len(nodes or ()) + 1),
+                              pool_maxsize=pool_maxsize or max_concurrency or 32, pool_block=pool_block)
+        self.ise.mount('https://', adapter)
+        self.ise.mount('http://', adapter)
+
+        if self.disable_warnings:
+            requests.packages.urllib3.disable_warnings()
+
+
+    def _retry_delay(self, attempt, resp=None):
+        """
+        Seconds to wait before a retry, honouring Retry-After when ISE sends one, up to max_backoff
+        """
+        retry_after = resp.headers.get('Retry-After') if resp is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _request(self, method, url, idempotent=None, page=None, primary=False, **kwargs):
+        """
+        Send a request, see _send. While a GET is in flight, identical GETs from other threads
+        wait for it and get the same response instead of sending their own, so a fan-out that
+        keeps looking up the same few names costs the PAN one request per name at a time.
+        :return: requests response object
+        """
+        if not self.coalesce or method != 'GET':
+            try:
+                return self._send(method, url, idempotent, page, primary, **kwargs)
+            finally:
+                if self.coalesce and method not in self.read_methods:
+                    self._forget_flights(url)
+
+        key = (url, primary, tuple(sorted((kwargs.get('headers') or {}).items())))
+        with self._in_flight_lock:
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = Future()
+        if not leader:
+            return flight.result()
+
+        try:
+            resp = self._send(method, url, idempotent, page, primary, **kwargs)
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(resp)
+            return resp
+        finally:
+            with self._in_flight_lock:
+                if self._in_flight.get(key) is flight:
+                    del self._in_flight[key]
+
+    def _forget_flights(self, url):
+        """
+        Stop sharing the in flight GETs of the resource a write to url changed. They may have
+        been sent before the write, so a GET sent after it must not get their answer, see
+        _invalidate_detail for the cache.
+        """
+        resource = ERS._resource_of(url).split('/')[0]
+        with self._in_flight_lock:
+            for key in [k for k in self._in_flight if ERS._resource_of(k[0]).split('/')[0] == resource]:
+                del self._in_flight[key]
+
+    def _send(self, method, url, idempotent=None, page=None, primary=False, **kwargs):
+        """
+        Send a request through the governor, applying the timeout and retrying idempotent
+        requests with jittered exponential backoff. With read nodes configured, reads go to
+        the next healthy node and a failed read moves straight on to another one. The
+        instrumentation hooks get a RequestRecord once it is done.
+        :param method: HTTP method
+        :param url: URL
+        :param idempotent: Whether the request may be retried, by default decided by the method
+        :param page: SearchResult page number, for instrumentation
+        :param primary: Send a read to the primary admin node, e.g. for state only it has
+        :return: requests response object
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        if idempotent is None:
+            idempotent = method in self.idempotent_methods
+        retries = self.retries if idempotent else 0
+        pool = self.nodes if not primary and method in self.read_methods else None
+
+        attempt = 0
+        resp = None
+        error = None
+        target = url
+        start = time.perf_counter()
+        try:
+            while True:
+                # Falls back to the primary when every read node is cooling down, unless they are only
+                # throttling: their load would just move onto the PAN, so wait for one instead
+                node = pool.pick() if pool is not None else None
+                throttle_delay = pool.throttled_for() if node is None and pool is not None else None
+                if throttle_delay is not None:
+                    time.sleep(min(throttle_delay, self.max_backoff))
+                    node = pool.pick()
+                target = pool.route(url, node, self.url_base) if node is not None else url
+                sent = time.perf_counter()
+                try:
+                    with self.governor:
+                        resp = self.ise.request(method, target, **kwargs)
+                except (requests.ConnectionError, requests.Timeout):
+                    if node is not None:
+                        pool.failed(node)
+                    if attempt >= retries:
+                        raise
+                    if node is None:
+                        time.sleep(self._retry_delay(attempt))
+                else:
+                    if resp.status_code not in self.retry_statuses:
+                        if node is not None:
+                            pool.succeeded(node, time.perf_counter() - sent)
+                        return resp
+                    if node is not None:
+                        pool.failed(node, self._retry_delay(attempt, resp) if resp.status_code == 429 else None)
+                    if attempt >= retries:
+                        return resp
+                    if node is None:
+                        time.sleep(self._retry_delay(attempt, resp))
+                attempt += 1
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            if self.detail_cache is not None and method not in self.read_methods:
+                self._invalidate_detail(url)
+            if self.hooks:
+                self._record(method, target, kwargs.get('data'), resp, time.perf_counter() - start, attempt, page,
+                             error)
+
+    def _invalidate_detail(self, url):
+        """
+        Drop the cached details a write to url may have changed
+        """
+        path = url.split('/config/', 1)[-1].split('?', 1)[0].split('/')
+        if len(path) == 2:
+            self.detail_cache.invalidate(path[0], path[1])
+        elif len(path) > 2 and path[1] == 'bulk':
+            self.detail_cache.invalidate(path[0])
+
+    def _get_detail(self, resource, oid):
+        """
+        GET the detail of a resource through the detail cache, revalidating stale copies with If-None-Match
+        :param resource: ERS resource type, e.g. networkdevice
+        :param oid: OID of the resource
+        :return: requests response object, or a CachedResponse when the cached copy is still good
+        """
+        url = '{0}/config/{1}/{2}'.format(self.url_base, resource, oid)
+        if self.detail_cache is None:
+            return self._request('GET', url)
+
+        cached = self.detail_cache.get(resource, oid)
+        if cached is not None and cached[2]:
+            return CachedResponse(200, cached[1], {'ETag': cached[0]})
+
+        headers = {'If-None-Match': cached[0]} if cached is not None and cached[0] else None
+        resp = self._request('GET', url, headers=headers)
+        if resp.status_code == 304 and cached is not None:
+            self.detail_cache.touch(resource, oid)
+            return CachedResponse(200, cached[1], {'ETag': cached[0]})
+        if resp.status_code == 200:
+            self.detail_cache.set(resource, oid, resp.headers.get('ETag'), resp.content)
+        elif resp.status_code == 404:
+            self.detail_cache.invalidate(resource, oid)
+        return resp
+
+    @staticmethod
+    def _resource_of(url):
+        """
+        ERS resource type a URL addresses, with /bulk appended for the bulk API
+        """
+        path = url.split('/config/', 1)[-1].split('?', 1)[0].split('/')
+        return path[0] if len(path) == 1 or path[1] != 'bulk' else path[0] + '/bulk'
+
+    @staticmethod
+    def _body_size(data):
+        """
+        Bytes a request body puts on the wire, str bodies being sent UTF-8 encoded
+        """
+        return len(data.encode('utf-8')) if isinstance(data, str) else len(data or b'')
+
+    def _record(self, method, url, data, resp, latency, retries, page, error):
+        """
+        Pass a RequestRecord to the instrumentation hooks
+        """
+        record = RequestRecord(method=method, resource=ERS._resource_of(url), url=url,
+                               status_code=resp.status_code if resp is not None and error is None else None,
+                               latency=latency, bytes_sent=ERS._body_size(data),
+                               bytes_received=len(resp.content) if resp is not None else 0,
+                               retries=retries, page=page, error=error)
+        for hook in self.hooks:
+            hook(record)
+
+    def add_hook(self, hook):
+        """
+        Register an instrumentation hook
+        :param hook: Callable called with a RequestRecord after every HTTP call, e.g. a MetricsAggregator
+        """
+        self.hooks.append(hook)
+
+    def batch(self, workers=4, min_workers=1, max_workers=32, progress=None):
+        """
+        Start a batch of method calls run concurrently over this session, see Batch
+        :param workers: Calls in flight to start with, adapted to the observed latency and error rate
+        :param min_workers: Fewest calls in flight
+        :param max_workers: Most calls in flight
+        :param progress: Callable passed (done, total, failed) after every call
+        :return: Batch
+        """
+        return Batch(self, workers=workers, min_workers=min_workers, max_workers=max_workers, progress=progress)
+
+    def pool_stats(self):
+        """
+        Connection pool statistics per node, to confirm that connections are reused rather than reopened
+        :return: Dictionary keyed by scheme://host:port of connections (opened so far), requests (sent so far),
+                 reused (requests that found an open connection), idle (open connections waiting in the pool)
+                 and maxsize
+        """
+        stats = {}
+        for adapter in {id(i): i for i in self.ise.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                try:
+                    pool = pools[key]
+                except KeyError:
+                    continue
+                idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0
+                stats['{0}://{1}:{2}'.format(pool.scheme, pool.host, pool.port)] = {
+                    'connections': pool.num_connections, 'requests': pool.num_requests,
+                    'reused': max(pool.num_requests - pool.num_connections, 0), 'idle': idle,
+                    'maxsize': pool.pool.maxsize if pool.pool is not None else 0}
+        return stats
+
+    def check_nodes(self):
+        """
+        Health check the read nodes with a one row listing each, taking the failing ones
+        out of rotation and putting recovered ones back
+        :return: Dictionary of node statistics keyed by ERS base URL, see NodePool.stats
+        """
+        if self.nodes is None:
+            return {}
+
+        def probe(url_base):
+            # Through the governor and hooks like any request, but straight to the node and without retries
+            start = time.perf_counter()
+            try:
+                resp = self._request('GET', '{0}/config/endpointgroup?size=1'.format(url_base), idempotent=False,
+                                     primary=True)
+            except (requests.ConnectionError, requests.Timeout):
+                resp = None
+            if resp is not None and resp.status_code == 200:
+                self.nodes.succeeded(url_base, time.perf_counter() - start)
+            else:
+                self.nodes.failed(url_base)
+
+        with ThreadPoolExecutor(max_workers=len(self.nodes.url_bases)) as pool:
+            list(pool.map(probe, self.nodes.url_bases))
+        return self.nodes.stats()
+
+    @staticmethod
+    def _mac_test(mac):
+        """
+        Test for valid mac address
+        :param mac: MAC address such as AA:BB:CC:00:11:22, aa-bb-cc-00-11-22, aabb.cc00.1122 or aabbcc001122
+        :return: True/False
+        """
+
+        if MAC_RE.fullmatch(mac) is not None:
+            return True
+        else:
+            return False
+
+    @staticmethod
+    def normalize_macs(macs):
+        """
+        Convert MAC addresses to the canonical AA:BB:CC:00:11:22 form in a single pass.
+        Colon or dash separated, Cisco dotted and bare hex addresses are accepted, in any case.
+        :param macs: Iterable of MAC addresses
+        :return: Tuple of the canonical MACs, in input order with None for each reject, and the rejected inputs
+        """
+        match = MAC_RE.fullmatch
+        canonical = []
+        rejects = []
+        for mac in macs:
+            if isinstance(mac, str):
+                mac = mac.strip()
+                if match(mac):
+                    h = mac.translate(MAC_SEPARATORS).upper()
+                    canonical.append(':'.join((h[0:2], h[2:4], h[4:6], h[6:8], h[8:10], h[10:12])))
+                    continue
+            canonical.append(None)
+            rejects.append(mac)
+        return canonical, rejects
+
+    @staticmethod
+    def _invalid_mac(mac):
+        """
+        Per-item result dictionary of a rejected MAC address
+        """
+        return {'success': False, 'error': 400,
+                'response': '{0}. Must be in the form of AA:BB:CC:00:11:22'.format(mac)}
+
+    @staticmethod
+    def normalize_mac(mac):
+        """
+        Convert a MAC address to the canonical AA:BB:CC:00:11:22 form
+        :param mac: MAC address in any form normalize_macs accepts
+        :return: Canonical MAC, None if it is not a valid MAC address
+        """
+        return ERS.normalize_macs((mac,))[0][0]
+
+    @staticmethod
+    def _ers_error(resp):
+        """
+        Extract the error title from a failed ERS response
+        :param resp: requests response object
+        :return: Error title
+        """
+        try:
+            return resp.json()['ERSResponse']['messages'][0]['title']
+        except (ValueError, KeyError, IndexError):
+            return resp.reason
+
+    @staticmethod
+    def _endpoint_data(name, mac, group_id, static_profile_assigment='false', static_group_assignment='true',
+                       profile_id='', description=''):
+        """
+        Build an ERSEndPoint payload
+        :return: Payload dictionary
+        """
+        return { "ERSEndPoint" : { 'name': name, 'description': description, 'mac': mac,
+                                   'profileId': profile_id, 'staticProfileAssignment': static_profile_assigment,
+                                   'groupId': group_id, 'staticGroupAssignment': static_group_assignment,
+                                    'customAttributes': {'customAttributes': {'key1': 'value1'} } } }
+
+    @staticmethod
+    def _user_data(user_id, password, user_group_oid, enable='', first_name='', last_name='', email='',
+                   description=''):
+        """
+        Build an InternalUser payload
+        :return: Payload dictionary
+        """
+        return { "InternalUser" : { 'name': user_id, 'password': password, 'enablePassword': enable,
+                                   'firstName': first_name, 'lastName': last_name, 'email': email,
+                                   'description': description, 'identityGroups': user_group_oid }}
+
+    @staticmethod
+    def _device_data(name, ip_address, radius_key, snmp_ro, dev_group, dev_location, dev_type, description='',
+                     snmp_v='TWO_C', dev_profile='Cisco', mask=32):
+        """
+        Build a NetworkDevice payload
+        :return: Payload dictionary
+        """
+        return { 'NetworkDevice' : { 'name': name,
+                    'description': description,
+                    'authenticationSettings' : {
+                        'networkProtocol': 'RADIUS',
+                        'radiusSharedSecret': radius_key,
+                        'enableKeyWrap' : 'false',
+                    },
+                    'snmpsettings' : {
+                        'version': snmp_v,
+                        'roCommunity': snmp_ro,
+                        'pollingInterval': 3600,
+                        'linkTrapQuery': 'true',
+                        'macTrapQuery': 'true',
+                        'originatingPolicyServicesNode': 'Auto'
+                    },
+                    'profileName': dev_profile,
+                    'coaPort': 1700,
+                    'NetworkDeviceIPList': [ {
+                        'ipaddress': ip_address,
+                        'mask': mask
+                    } ],
+                    'NetworkDeviceGroupList': [dev_group, dev_type, dev_location, 'IPSEC#Is IPSEC Device#No']
+                    }
+                }
+
+    def _get_page(self, url, page=None):
+        """
+        Get a single SearchResult page
+        :param url: URL of the page
+        :param page: Page number, for instrumentation
+        :return: SearchResult dictionary
+        """
+        resp = self._request('GET', url, page=page)
+        if resp.status_code != 200:
+            raise ERSError(ERS._ers_error(resp), resp.status_code)
+
+        return self.decoder.decode_page(resp.content)['SearchResult']
+
+    def _iter_pages(self, url, page_size=None, workers=1, ordered=True, start_page=1, first_page=None):
+        """
+        Iterate over all pages of a SearchResult listing
+        :param url: URL of the listing, optionally with a filter but without size or page parameters
+        :param page_size: Rows per page, capped at the ERS maximum of 100
+        :param workers: Number of pages to fetch concurrently once the total is known
+        :param ordered: Yield pages in page order, otherwise in completion order
+        :param start_page: First page to fetch, to resume a listing part way through
+        :param first_page: SearchResult of start_page when the caller already has it
+        :return: Generator of SearchResult dictionaries, one per page
+        """
+        page_size = min(page_size or self.max_page_size, self.max_page_size)
+        url = '{0}{1}size={2}'.format(url, '&' if '?' in url else '?', page_size)
+
+        if first_page is not None:
+            json_res = first_page
+        elif start_page > 1:
+            json_res = self._get_page('{0}&page={1}'.format(url, start_page), page=start_page)
+        else:
+            json_res = self._get_page(url, page=1)
+        yield json_res
+
+        if workers <= 1:
+            # Follow the nextPage links one after another
+            page = start_page
+            while 'nextPage' in json_res:
+                page += 1
+                json_res = self._get_page(json_res['nextPage']['href'], page=page)
+                yield json_res
+            return
+
+        # The first page tells us how many there are, fan the rest out over the pool
+        last_page = -(-int(json_res['total']) // page_size)
+        pages = range(start_page + 1, last_page + 1)
+        window = workers * 2
+
+        pool = ThreadPoolExecutor(max_workers=workers)
+        in_flight = deque()
+        try:
+            for page in pages:
+                in_flight.append(pool.submit(self._get_page, '{0}&page={1}'.format(url, page), page))
+                if len(in_flight) < window:
+                    continue
+                if ordered:
+                    yield in_flight.popleft().result()
+                else:
+                    done, not_done = wait(in_flight, return_when=FIRST_COMPLETED)
+                    in_flight = deque(not_done)
+                    for future in done:
+                        yield future.result()
+
+            futures = in_flight if ordered else as_completed(in_flight)
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in in_flight:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+    def _listing(self, url, compact=False, workers=1):
+        """
+        Get a (name, id) listing
+        :param url: URL of the listing, optionally with a filter
+        :param compact: Fetch every page into a ResourceList instead of returning the first page as a list
+        :param workers: Number of pages to fetch concurrently when compact
+        :return: result dictionary
+        """
+        result = {
+            'success': False,
+            'response': '',
+            'error': '',
+        }
+
+        if compact:
+            rows = ResourceList()
+            try:
+                for json_res in self._iter_pages(url, workers=workers):
+                    rows.extend(json_res['resources'])
+            except ERSError as e:
+                result['response'] = e.value
+                result['error'] = e.status_code
+                return result
+
+            result['success'] = True
+            result['response'] = rows
+            return result
+
+        resp = self._request('GET', url)
+        if resp.status_code == 200:
+            result['success'] = True
+            result['response'] = [(i['name'], i['id'])
+                                  for i in self.decoder.decode_page(resp.content)['SearchResult']['resources']]
+            return result
+        else:
+            result['response'] = ERS._ers_error(resp)
+            result['error'] = resp.status_code
+            return result
+
+    def _resolve(self, resource, name, field='name'):
+        """
+        Turn a name into an OID, using the resolution cache when possible
+        :param resource: ERS resource type, e.g. endpointgroup
+        :param name: Name (or MAC for endpoints) to resolve
+        :param field: Field to filter on
+        :return: Tuple of OID (None if not found) and status code, 409 if the name matches several objects
+        """
+        oid = self.id_cache.get(resource, name)
+        if oid is not None:
+            return oid, 200
+
+        resp = self._request('GET', '{0}/config/{1}?filter={2}.EQ.{3}'.format(self.url_base, resource, field, name))
+        if resp.status_code != 200:
+            return None, resp.status_code
+
+        found = self.decoder.decode_page(resp.content)['SearchResult']
+        if int(found['total']) != 1:
+            return None, 409 if int(found['total']) > 1 else 404
+
+        oid = found['resources'][0]['id']
+        self.id_cache.set(resource, name, oid)
+        return oid, 200
+
+    @staticmethod
+    def _unresolved(name, status):
+        """
+        Response text for a name _resolve returned no OID for
+        """
+        if status == 409:
+            return '{0} matches more than one object'.format(name)
+        return '{0} not found'.format(name)
+
+    def _cache_created(self, resource, name, resp):
+        """
+        Record the OID of a freshly created resource from the Location header
+        """
+        location = resp.headers.get('Location')
+        if location:
+            self.id_cache.set(resource, name, location.rstrip('/').rsplit('/', 1)[-1])
+        else:
+            self.id_cache.invalidate(resource, name)
+
+    def warm_cache(self, resource, workers=1):
+        """
+        Pre-warm the resolution cache with every name of a resource type from one paged listing
+        :param resource: ERS resource type, one of endpoint, endpointgroup, identitygroup, internaluser, networkdevice
+        :param workers: Number of pages to fetch concurrently
+        :return: Number of names cached
+        """
+        count = 0
+        for json_res in self._iter_pages('{0}/config/{1}'.format(self.url_base, resource), workers=workers):
+            for i in json_res['resources']:
+                self.id_cache.set(resource, i['name'], i['id'])
+                count += 1
+        return count
+
+    def get_endpoint_groups(self):
+        """
+        Get all endpoint identity groups
+        :return: result dictionary
+        """
+        result = {
+            'success': False,
+            'response': '',
+            'error': '',
+        }
+
+        resp = self._request('GET', '{0}/config/endpointgroup'.format(self.url_base))
+
+        if resp.status_code == 200:
+            result['success'] = True
+            result['response'] = [(i['name'], i['id'], i['description'])
+                                  for i in self.decoder.decode_page(resp.content)['SearchResult']['resources']]
+
+            return result
+        else:
+            result['response'] = ERS._ers_error(resp)
+            result['error'] = resp.status_code
+            return result
+
+    def get_endpoint_group(self, group):
+        """
+        Get endpoint identity group details
+        :param group: Name of the identity group
+        :return: result dictionary
+        """
+        result = {
+            'success': False,
+            'response': '',
+            'error': '',
+        }
+
+        oid, status = self._resolve('endpointgroup', group)
+
+        if oid is None:
+            result['response'] = ERS._unresolved(group, status)
+            result['error'] = status
+            return result
+
+        resp = self._get_detail('endpointgroup', oid)
+        if resp.status_code == 200:
+            result['success'] = True
+            result['response'] = self.decoder.decode(resp.content)['EndPointGroup']
+            return result
+        elif resp.status_code == 404:
+            self.id_cache.invalidate('endpointgroup', group)
+            result['response'] = '{0} not found'.format(group)
+            result['error'] = resp.status_code
+            return result
+        else:
+            result['response'] = ERS._ers_error(resp)
+            result['error'] = resp.status_code
+            return result
+
+    def get_endpoint_group_id(self, group):
+        """
+        Get endpoint identity group OID
+        :param group: Name of the identity group
+        :return: result dictionary
+        """
+        result = {
+            'success': False,
+            'response': '',
+            'error': '',
+        }
+
+        oid, status = self._resolve('endpointgroup', group)
+
+        if oid is None:
+            result['response'] = ERS._unresolved(group, status)
+            result['error'] = status
+            return result
+
+        result['success'] = True
+        result['response'] = oid
+        return result
+
+    def get_endpoints(self, compact=False, workers=1):
+        """
+        Get all endpoints
+        :param compact: Return every row as a ResourceList instead of the first page as a list of tuples
+        :param workers: Number of pages to fetch concurrently when compact
+        :return: result dictionary
+        """
+        return self._listing('{0}/config/endpoint'.format(self.url_base), compact=compact, workers=workers)
+
+    def get_endpoint(self, mac_address):
+        """
+        Get endpoint details
+        :param mac_address: MAC address of the endpoint
+        :return: result dictionary
+        """
+        canonical = ERS.normalize_mac(mac_address)
+
+        if canonical is None:
+            raise InvalidMacAddress('{0}. Must be in the form of AA:BB:CC:00:11:22'.format(mac_address))
+        else:
+            mac_address = canonical
+
+            result = {
+                'success': False,
+                'response': '',
+                'error': '',
+            }
+
+            oid, status = self._resolve('endpoint', mac_address, field='mac')
+
+            if oid is None:
+                result['response'] = ERS._unresolved(mac_address, status)
+                result['error'] = status
+                return result
+
+            resp = self._get_detail('endpoint', oid)
+            if resp.status_code == 200:
+                result['success'] = True
+                result['response'] = self.decoder.decode(resp.content)['ERSEndPoint']
+                return result
+            elif resp.status_code == 404:
+                self.id_cache.invalidate('endpoint', mac_address)
+                result['response'] = '{0} not found'.format(mac_address)
+                result['error'] = resp.status_code
+                return result
+            else:
+                result['response'] = ERS._ers_error(resp)
+                result['error'] = resp.status_code
+                return result
+
+    def search_endpoints_by_group(self, group_id, compact=False, workers=1):
+        """
+        Get all endpoints in an endpoint group
+        :param group_id: OID of the endpoint group
+        :param compact: Return every row as a ResourceList instead of the first page as a list of tuples
+        :param workers: Number of pages to fetch concurrently when compact
+        :return: result dictionary
+        """
+        url = '{0}/config/endpoint?filter=groupId.EQ.{1}'.format(self.url_base, group_id)
+        return self._listing(url, compact=compact, workers=workers)
+
+    def list_endpoints_in_group(self, group_id, page=1):
+        """
+        Get all endpoints
+        :return: result dictionary
+        """
+        #print('{0}/config/endpoint?size=100&filter=identityGroup.EQ.{1}&page={2}'.format(self.url_base, group_id, page))
+
+        resp = self._request('GET', '{0}/config/endpoint?size=100&filter=groupId.EQ.{1}&page={2}'.format(self.url_base, group_id, page))
+
+        result = {
+            'success': False,
+            'response': '',
+            'error': '',
+        }
+
+        json_res = self.decoder.decode_page(resp.content)['SearchResult']
+
+        if resp.status_code == 200 and int(json_res['total']) > 100:
+            result['success'] = True
+            result['response'] = [(i['name'])
+                                  for i in json_res['resources']]
+            result['total'] = json_res['total']
+            #result['next'] = True if ('nextPage' in json_res) else False
+            if 'nextPage' in json_res:
+                result['next'] = True
+            else:
+                result['next'] = False
+            return result
+
+        if resp.status_code == 200 and int(json_res['total']) > 1:
+            result['success'] = True
+            result['response'] = [(i['name'])
+                                  for i in json_res['resources']]
+            result['total'] = json_res['total']
+            if 'nextPage' in json_res:
+                result['next'] = True
+            else:
+                result['next'] = False
+            return result
+
+        elif resp.status_code == 200 and int(json_res['total']) == 1:
+            result['success'] = True
+            result['response'] = [(json_res['resources'][0]['name'])]
+            return result
+
+        elif resp.status_code == 200 and int(json_res['total']) == 0:
+            result['success'] = True
+            result['response'] = []
+            return result
+
+        else:
+            result['response'] = ERS._ers_error(resp)
+            result['error'] = resp.status_code
+            return result
+
+    def iter_endpoints(self, page_size=None, workers=1, ordered=True):
+        """
+        Iterate over all endpoints, following the pagination on its own
+        :param page_size: Rows per page, defaults to (and is capped at) the ERS maximum of 100
+        :param workers: Number of pages to fetch concurrently
+        :param ordered: Yield in page order, otherwise in the order pages complete
+        :return: Generator of (name, id) tuples
+        """
+        url = '{0}/config/endpoint'.format(self.url_base)
+        for json_res in self._iter_pages(url, page_size, workers, ordered):
+            for i in json_res['resources']:
+                yield (i['name'], i['id'])
+
+    def iter_endpoints_in_group(self, group_id, page_size=None, workers=1, ordered=True):
+        """
+        Iterate over all endpoints in an endpoint identity group, following the
+        pagination on its own. MACs are yielded as soon as each page arrives.
+        :param group_id: OID of the endpoint identity group
+        :param page_size: Rows per page, defaults to (and is capped at) the ERS maximum of 100
+        :param workers: Number of pages to fetch concurrently
+        :param ordered: Yield in page order, otherwise in the order pages complete
+        :return: Generator of endpoint MAC addresses
+        """
+        url = '{0}/config/endpoint?filter=groupId.EQ.{1}'.format(self.url_base, group_id)
+        for json_res in self._iter_pages(url, page_size, workers, ordered):
+            for i in json_res['resources']:
+                yield i['name']
+
+    def add_endpoint(self,
+                    name,
+                    mac,
+                    group_id,
+                    static_profile_assigment='false',
+                    static_group_assignment='true',
+                    profile_id='',
+                    description=''):
+        """
+        Add a user to the local user store
+        :param name: Name
+        :param mac: Macaddress
+        :param group_id: OID of group to add endpoint in
+        :param static_profile_assigment: Set static profile
+        :param static_group_assignment: Set static group
+        :param profile_id: OID of profile
+        :param description: User description
+        :return: result dictionary
+        """
+
+        canonical = ERS.normalize_mac(mac)
+        if canonical is None:
+            raise InvalidMacAddress('{0}. Must be in the form of AA:BB:CC:00:11:22'.format(mac))
+        else:
+            mac = canonical
+
+            result = {
+                'success': False,
+                'response': '',
+                'error': '',
+            }
+
+            data = ERS._endpoint_data(name, mac, group_id, static_profile_assigment, static_group_assignment,
+                                      profile_id, description)
+
+            resp = self._request('POST', '{0}/config/endpoint'.format(self.url_base), data=json.dumps(data))
+            if resp.status_code == 201:
+                self._cache_created('endpoint', mac, resp)
+                result['success'] = True
+                result['response'] = '{0} Added Successfully'.format(name)
+                return result
+            else:
+                result['response'] = ERS._ers_error(resp)
+                result['error'] = resp.status_code
+                return result
+
+
+    def delete_endpoint(self, mac):
+        """
+        Delete an endpoint
+        :param mac: Endpoint Macaddress
+        :return: Result dictionary
+        """
+        canonical = ERS.normalize_mac(mac)
+        if canonical is None:
+            raise InvalidMacAddress('{0}. Must be in the form of AA:BB:CC:00:11:22'.format(mac))
+        mac = canonical
+
+        result = {
+            'success': False,
+            'response': '',
+            'error': '',
+        }
+
+        oid, status = self._resolve('endpoint', mac, field='mac')
+
+        if oid is None:
+            result['response'] = ERS._unresolved(mac, status)
+            result['error'] = status
+            return result
+
+        resp = self._request('DELETE', '{0}/config/endpoint/{1}'.format(self.url_base, oid))
+        self.id_cache.invalidate('endpoint', mac)
+
+        if resp.status_code == 204:
+            result['success'] = True
+            result['response'] = '{0} Deleted Successfully'.format(mac)
+            return result
+        elif resp.status_code == 404:
+            result['response'] = '{0} not found'.format(mac)
+            result['error'] = resp.status_code
+            return result
+        else:
+            result['response'] = ERS._ers_error(resp)
+            result['error'] = resp.status_code
+            return result
+
+    def _bulk_run(self, resource, request_key, operation, batch, poll_interval, poll_timeout):
+        """
+        Submit one ERS bulk request and wait for it on the bulk status monitor
+        :param resource: ERS resource type, e.g. endpoint
+        :param request_key: Root key of the bulk request, e.g. EndpointBulkRequest
+        :param operation: create, update or delete
+        :param batch: List of resource payloads, or of OIDs for delete
+        :param poll_interval: Seconds between status polls
+        :param poll_timeout: Seconds to wait for the bulk request to finish
+        :return: BulkStatus dictionary
+        """
+        request = {'operationType': operation, 'resourceMediaType': self.bulk_media_types[resource]}
+        if operation == 'delete':
+            request['idList'] = {'id': batch}
+        else:
+            request['resourcesList'] = {resource: batch}
+
+        resp = self._request('PUT', '{0}/config/{1}/bulk/submit'.format(self.url_base, resource),
+                            data=json.dumps({request_key: request}), idempotent=False)
+        if resp.status_code != 202:
+            raise ERSError(ERS._ers_error(resp), resp.status_code)
+
+        monitor_url = resp.headers['Location']
+        deadline = time.monotonic() + poll_timeout
+        while True:
+            resp = self._request('GET', monitor_url, primary=True)
+            if resp.status_code != 200:
+                raise ERSError(ERS._ers_error(resp), resp.status_code)
+
+            status = self.decoder.decode(resp.content)['BulkStatus']
+            if status['executionStatus'] not in ('PENDING', 'IN_PROGRESS'):
+                return status
+            if time.monotonic() > deadline:
+                raise ERSError('Bulk request {0} did not finish within {1}s'.format(status['bulkId'], poll_timeout))
+            time.sleep(poll_interval)
+
+    def _bulk(self, resource, request_key, operation, items, key, workers, batch_size, poll_interval, poll_timeout,
+              progress=None):
+        """
+        Split items into bulk requests and run them concurrently
+        :param items: List of (name, payload) tuples, the payload being an OID for delete
+        :param key: BulkStatus field matching a status to its item, name or id
+        :param progress: Callable passed (done, total, failed) items after every bulk request
+        :return: Dictionary of per-item result dictionaries keyed by name
+        """
+        if not batch_size:
+            # Spread the items evenly across the workers, within the ERS bulk limit
+            batch_size = max(1, min(self.max_bulk_size, -(-len(items) // max(workers, 1))))
+        batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+        def run(batch):
+            try:
+                status = self._bulk_run(resource, request_key, operation, [payload for _, payload in batch],
+                                        poll_interval, poll_timeout)
+            except (ERSError, requests.RequestException) as e:
+                error = e.status_code if isinstance(e, ERSError) else ''
+                return {name: {'success': False, 'response': str(e), 'error': error} for name, _ in batch}
+
+            reported = {i[key]: i for i in status.get('resourcesStatus', [])}
+            outcome = {}
+            for name, payload in batch:
+                # Statuses name the resource as sent, which for an endpoint need not be its MAC
+                item = reported.get(payload if operation == 'delete' else payload[key])
+                if item is None:
+                    outcome[name] = {'success': False, 'response': 'No status reported', 'error': ''}
+                elif item['resourceExecutionStatus'] == 'SUCCESS':
+                    outcome[name] = {'success': True, 'response': item.get('status', ''), 'error': ''}
+                    if operation == 'create' and item.get('id'):
+                        self.id_cache.set(resource, name, item['id'])
+                else:
+                    outcome[name] = {'success': False, 'response': item.get('status', ''),
+                                     'error': item['resourceExecutionStatus']}
+            return outcome
+
+        outcomes = {}
+        failed = 0
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            for future in as_completed([pool.submit(run, batch) for batch in batches]):
+                outcome = future.result()
+                outcomes.update(outcome)
+                if progress is not None:
+                    failed += sum(1 for i in outcome.values() if not i['success'])
+                    progress(len(outcomes), len(items), failed)
+        return outcomes
+
+    def _resolve_names(self, resource, names, workers=8, field='name'):
+        """
+        Resolve many names to OIDs. When a paged listing of the resource takes fewer requests
+        than one filter search per uncached name, the listing is used and only the names it does
+        not list are searched for.
+        :param resource: ERS resource type
+        :param names: List of unique names
+        :param workers: Number of requests to run concurrently
+        :param field: Field the filter searches match on
+        :return: Dictionary of (OID or None, status code) tuples keyed by name
+        """
+        resolved = {}
+        todo = []
+        for name in names:
+            oid = self.id_cache.get(resource, name)
+            if oid is not None:
+                resolved[name] = (oid, 200)
+            else:
+                todo.append(name)
+
+        if len(todo) > self.max_page_size:
+            url = '{0}/config/{1}'.format(self.url_base, resource)
+            total = int(self._get_page('{0}?size=1'.format(url))['total'])
+            if -(-total // self.max_page_size) < len(todo):
+                wanted = set(todo)
+                # Endpoints are listed by name, only those named by something other than a MAC can hide one
+                others = []
+                for json_res in self._iter_pages(url, workers=workers):
+                    rows = json_res['resources']
+                    keys = ([i['name'] for i in rows] if field == 'name' else
+                            ERS.normalize_macs(i['name'] for i in rows)[0])
+                    for i, key in zip(rows, keys):
+                        if key is None:
+                            others.append(i['id'])
+                        elif key in wanted:
+                            self.id_cache.set(resource, key, i['id'])
+                            resolved[key] = (i['id'], 200)
+                todo = [name for name in todo if name not in resolved]
+
+                if others and len(others) < len(todo):
+                    # Fewer details to read than searches to send
+                    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+                        for oid, resp in zip(others, pool.map(lambda oid: self._get_detail(resource, oid), others)):
+                            if resp.status_code != 200:
+                                continue
+                            key = ERS.normalize_mac(next(iter(self.decoder.decode(resp.content).values())).get(field))
+                            if key in wanted and key not in resolved:
+                                self.id_cache.set(resource, key, oid)
+                                resolved[key] = (oid, 200)
+                    others = []
+                if not others:
+                    # The listing was complete, whatever it did not name does not exist
+                    resolved.update((name, (None, 404)) for name in todo if name not in resolved)
+                    todo = []
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            resolved.update(zip(todo, pool.map(lambda name: self._resolve(resource, name, field=field), todo)))
+        return resolved
+
+    def _resolve_macs(self, macs, workers=8):
+        """
+        Resolve many MACs to endpoint OIDs, see _resolve_names
+        :param macs: List of unique MAC addresses
+        :param workers: Number of requests to run concurrently
+        :return: Dictionary of (OID or None, status code) tuples keyed by MAC
+        """
+        return self._resolve_names('endpoint', macs, workers, field='mac')
+
+    def get_endpoints_by_mac(self, macs, workers=8):
+        """
+        Get the details of many endpoints at once. Duplicate MACs are looked up once and
+        the cheaper of per-MAC filter searches and a listing of all endpoints resolves them.
+        :param macs: Iterable of MAC addresses
+        :param workers: Number of requests to run concurrently
+        :return: result dictionary, the response being a dictionary of get_endpoint style results keyed by MAC
+        """
+        result = {
+            'success': False,
+            'response': '',
+            'error': '',
+        }
+
+        canonical, rejects = ERS.normalize_macs(macs)
+        outcomes = {mac: ERS._invalid_mac(mac) for mac in rejects}
+        valid = list(OrderedDict.fromkeys(mac for mac in canonical if mac is not None))
+
+        resolved = self._resolve_macs(valid, workers)
+
+        def detail(mac):
+            outcome = {'success': False, 'response': '', 'error': ''}
+            oid, status = resolved[mac]
+            if oid is None:
+                outcome['response'] = ERS._unresolved(mac, status)
+                outcome['error'] = status
+                return mac, outcome
+
+            resp = self._get_detail('endpoint', oid)
+            if resp.status_code == 200:
+                outcome['success'] = True
+                outcome['response'] = self.decoder.decode(resp.content)['ERSEndPoint']
+            elif resp.status_code == 404:
+                self.id_cache.invalidate('endpoint', mac)
+                outcome['response'] = '{0} not found'.format(mac)
+                outcome['error'] = resp.status_code
+            else:
+                outcome['response'] = ERS._ers_error(resp)
+                outcome['error'] = resp.status_code
+            return mac, outcome
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            outcomes.update(pool.map(detail, valid))
+
+        result['response'] = outcomes
+        result['success'] = all(i['success'] for i in outcomes.values())
+        if not result['success']:
+            result['error'] = '{0} of {1} endpoints failed'.format(
+                    sum(1 for i in outcomes.values() if not i['success']), len(outcomes))
+        return result
+
+    def bulk_add_endpoints(self, endpoints, group_id=None, workers=4, batch_size=None, poll_interval=1,
+                           poll_timeout=300):
+        """
+        Add many endpoints through the ERS bulk request API
+        :param endpoints: Iterable of MAC addresses, or of dictionaries of add_endpoint arguments. Each one is
+                          checked on its own, and a bad one is reported in the result without being sent.
+        :param group_id: OID of the group to add endpoints in that don't name their own group_id
+        :param workers: Number of bulk requests to run concurrently
+        :param batch_size: Endpoints per bulk request, picked automatically by default
+        :param poll_interval: Seconds between bulk status polls
+        :param poll_timeout: Seconds to wait for each bulk request to finish
+        :return: result dictionary, the response being a dictionary of per-endpoint results keyed by MAC
+        """
+        result = {
+            'success': False,
+            'response': '',
+            'error': '',
+        }
+
+        endpoints = [{'mac': i} if isinstance(i, str) else i for i in endpoints]
+        canonical, _ = ERS.normalize_macs(i.get('mac') if isinstance(i, dict) else None for i in endpoints)
+
+        items = []
+        outcomes = {}
+        seen = set()
+        # Bulk statuses are matched to endpoints by name, so no two endpoints sent may share one
+        names = set()
+        for number, (endpoint, mac) in enumerate(zip(endpoints, canonical), 1):
+            unknown = sorted(set(endpoint) - set(ENDPOINT_FIELDS)) if isinstance(endpoint, dict) else []
+            if not isinstance(endpoint, dict):
+                outcome = {'success': False, 'response': 'Not a MAC address or a dictionary of add_endpoint arguments',
+                           'error': 'invalid'}
+                endpoint = {}
+            elif unknown:
+                outcome = {'success': False, 'response': 'Unknown field {0}'.format(', '.join(unknown)), 'error': 'invalid'}
+            elif mac is None:
+                outcome = ERS._invalid_mac(endpoint.get('mac'))
+            elif mac in seen:
+                outcome = {'success': False, 'response': 'Duplicate endpoint {0}'.format(mac), 'error': 'invalid'}
+            elif not endpoint.get('group_id', group_id):
+                outcome = {'success': False, 'response': 'No endpoint group', 'error': 'invalid'}
+            elif str(endpoint.get('name') or mac).upper() in names:
+                outcome = {'success': False, 'response': 'Duplicate name {0}'.format(endpoint.get('name') or mac),
+                           'error': 'invalid'}
+            else:
+                args = dict({'name': mac, 'group_id': group_id}, **endpoint)
+                args['mac'] = mac
+                items.append((mac, ERS._endpoint_data(**args)['ERSEndPoint']))
+                seen.add(mac)
+                names.add(str(args['name']).upper())
+                continue
+
+            key = mac or endpoint.get('mac')
+            if not key or key in seen:
+                # Keep the outcome of the first row by that MAC
+                key = '{0} (row {1})'.format(key, number) if key else 'row {0}'.format(number)
+            outcomes[key] = outcome
+            seen.add(key)
+
+        outcomes.update(self._bulk('endpoint', 'EndpointBulkRequest', 'create', items, 'name',
+                                   workers, batch_size, poll_interval, poll_timeout))
+
+        result['response'] = outcomes
+        result['success'] = all(i['success'] for i in outcomes.values())
+        if not result['success']:
+            result['error'] = '{0} of {1} endpoints failed'.format(
+                    sum(1 for i in outcomes.values() if not i['success']), len(outcomes))
+        return result
+
+    def bulk_delete_endpoints(self, macs, workers=4, batch_size=None, poll_interval=1, poll_timeout=300):
+        """
+        Delete many endpoints through the ERS bulk request API
+        :param macs: Iterable of endpoint MAC addresses
+        :param workers: Number of lookups and bulk requests to run concurrently
+        :param batch_size: Endpoints per bulk request, picked automatically by default
+        :param poll_interval: Seconds between bulk status polls
+        :param poll_timeout: Seconds to wait for each bulk request to finish
+        :return: result dictionary, the response being a dictionary of per-endpoint results keyed by MAC
+        """
+        result = {
+            'success': False,
+            'response': '',
+            'error': '',
+        }
+
+        canonical, rejects = ERS.normalize_macs(macs)
+        macs = list(OrderedDict.fromkeys(mac for mac in canonical if mac is not None))
+        resolved = self._resolve_macs(macs, workers)
+
+        items = []
+        outcomes = {mac: ERS._invalid_mac(mac) for mac in rejects}
+        for mac in macs:
+            oid, status = resolved[mac]
+            if oid is None:
+                outcomes[mac] = {'success': False, 'response': ERS._unresolved(mac, status), 'error': status}
+            else:
+                items.append((mac, oid))
+
+        outcomes.update(self._bulk('endpoint', 'EndpointBulkRequest', 'delete', items, 'id',
+                                   workers, batch_size, poll_interval, poll_timeout))
+        for mac, _ in items:
+            self.id_cache.invalidate('endpoint', mac)
+
+        result['response'] = outcomes
+        result['success'] = all(i['success'] for i in outcomes.values())
+        if not result['success']:
+            result['error'] = '{0} of {1} endpoints failed'.format(
+                    sum(1 for i in outcomes.values() if not i['success']), len(outcomes))
+        return result
+
+    def move_endpoints_to_group(self, macs, target_group, workers=8, bulk=False, batch_size=None, poll_interval=1,
+                                poll_timeout=300):
+        """
+        Move endpoints into an endpoint identity group, statically assigning them to it
+        :param macs: Iterable of endpoint MAC addresses
+        :param target_group: Name of the endpoint identity group to move them to
+        :param workers: Number of lookups and updates to run concurrently
+        :param bulk: Send the updates through the ERS bulk request API instead of one PUT per endpoint
+        :param batch_size: Endpoints per bulk request, picked automatically by default
+        :param poll_interval: Seconds between bulk status polls
+        :param poll_timeout: Seconds to wait for each bulk request to finish
+        :return: result dictionary, the response being a dictionary of per-endpoint results keyed by MAC
+        """
+        result = {
+            'success': False,
+            'response': '',
+            'error': '',
+        }
+
+        group_id, status = self._resolve('endpointgroup', target_group)
+        if group_id is None:
+            result['response'] = ERS._unresolved(target_group, status)
+            result['error'] = status
+            return result
+
+        canonical, rejects = ERS.normalize_macs(macs)
+        macs = list(OrderedDict.fromkeys(mac for mac in canonical if mac is not None))
+        resolved = self._resolve_macs(macs, workers)
+
+        items = []
+        outcomes = {mac: ERS._invalid_mac(mac) for mac in rejects}
+        for mac in macs:
+            oid, status = resolved[mac]
+            if oid is None:
+                outcomes[mac] = {'success': False, 'response': ERS._unresolved(mac, status), 'error': status}
+            else:
+                # No name, an update that sends one renames the endpoint
+                items.append((mac, {'id': oid, 'mac': mac, 'groupId': group_id, 'staticGroupAssignment': True}))
+
+        def move(item):
+            mac, endpoint = item
+            outcome = {'success': False, 'response': '', 'error': ''}
+            resp = self._request('PUT', '{0}/config/endpoint/{1}'.format(self.url_base, endpoint['id']),
+                                data=json.dumps({'ERSEndPoint': endpoint}))
+            if resp.status_code == 200:
+                outcome['success'] = True
+                outcome['response'] = '{0} Moved Successfully'.format(mac)
+            elif resp.status_code == 404:
+                self.id_cache.invalidate('endpoint', mac)
+                outcome['response'] = '{0} not found'.format(mac)
+                outcome['error'] = resp.status_code
+            else:
+                outcome['response'] = ERS._ers_error(resp)
+                outcome['error'] = resp.status_code
+            return mac, outcome
 
-        if self.disable_warnings:
-            requests.packages.urllib3.disable_warnings()
+        if bulk:
+            outcomes.update(self._bulk('endpoint', 'EndpointBulkRequest', 'update', items, 'id',
+                                       workers, batch_size, poll_interval, poll_timeout))
+        else:
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+                outcomes.update(pool.map(move, items))
 
+        result['response'] = outcomes
+        result['success'] = all(i['success'] for i in outcomes.values())
+        if not result['success']:
+            result['error'] = '{0} of {1} endpoints failed'.format(
+                    sum(1 for i in outcomes.values() if not i['success']), len(outcomes))
+        return result
 
-    @staticmethod
-    def _mac_test(mac):
+    def _get_endpoint_detail(self, oid):
         """
-        Test for valid mac address
-        :param mac: MAC address in the form of AA:BB:CC:00:11:22
-        :return: True/False
+        Get the ERSEndPoint of an endpoint OID
+        :return: ERSEndPoint dictionary
         """
+        resp = self._get_detail('endpoint', oid)
+        if resp.status_code != 200:
+            raise ERSError(ERS._ers_error(resp), resp.status_code)
 
-        if re.search(r'([0-9A-F]{2}[:]){5}([0-9A-F]){2}', mac.upper()) is not None:
-            return True
-        else:
-            return False
+        return self.decoder.decode(resp.content)['ERSEndPoint']
 
-    def get_endpoint_groups(self):
+    def _get_profile_name(self, profile_id, profiles):
         """
-        Get all endpoint identity groups
-        :return: result dictionary
+        Get the name of an endpoint profiling policy, remembering it in profiles
+        """
+        if profile_id not in profiles:
+            resp = self._get_detail('profilerprofile', profile_id)
+            profiles[profile_id] = self.decoder.decode(resp.content)['ProfilerProfile']['name'] if resp.status_code == 200 else ''
+        return profiles[profile_id]
+
+    def _find_resume_point(self, url, state):
+        """
+        Find where an interrupted export carries on. The last row written is looked up by name, not
+        by comparing names, as ISE's sort order is its own. Endpoints deleted or added since shift
+        rows by at most the change in the listing's total, so only that many pages around the last
+        one written are searched. When the row is gone, the export resumes at the row offset recorded.
+        :param url: URL of the listing, without size or page parameters
+        :param state: Checkpoint of the export
+        :return: Tuple of the page to resume on, rows of it already written and its SearchResult
+        """
+        fetched = {}
+
+        def fetch(page):
+            if page not in fetched:
+                fetched[page] = self._get_page('{0}&size={1}&page={2}'.format(url, self.max_page_size, page),
+                                               page=page)
+            return fetched[page]
+
+        page = state['page']
+        shift = int(fetch(page)['total']) - state['total'] if state['total'] is not None else 0
+        span = range(1, -(-abs(shift) // self.max_page_size) + 1)
+        candidates = [page] + ([page - i for i in span if page - i >= 1] if shift < 0 else [page + i for i in span])
+        for candidate in candidates:
+            names = [i['name'] for i in fetch(candidate)['resources']]
+            if state['last'] in names:
+                return candidate, names.index(state['last']) + 1, fetch(candidate)
+        return page, state['row'], fetch(page)
+
+    def export_endpoints_in_group(self, group, path, fmt=None, compress=None, detail=False, workers=1, resume=True):
+        """
+        Stream all endpoints in an endpoint identity group to a file, either in the layout of the
+        ISE endpoint import template (csv) or as one JSON object per line (ndjson). Each page is
+        written as soon as it arrives, sorted by MAC, and checkpointed to path.checkpoint. When a
+        run fails part way, running it again resumes after the last page written.
+        :param group: Name of the endpoint identity group
+        :param path: File to write
+        :param fmt: csv or ndjson, guessed from the file name by default
+        :param compress: Gzip the output, by default when the file name ends in .gz
+        :param detail: Fetch the full ERSEndPoint of every endpoint to fill in the remaining columns
+        :param workers: Number of pages, and detail fetches, to run concurrently
+        :param resume: Continue from the checkpoint a failed run left behind, if there is one
+        :return: result dictionary, the response being the number of endpoints written
         """
         result = {
             'success': False,
@@ -69,381 +2210,606 @@ class ERS(object):
             'error': '',
         }
 
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
+        name = path[:-3] if path.endswith('.gz') else path
+        if compress is None:
+            compress = path.endswith('.gz')
+        if fmt is None:
+            fmt = 'ndjson' if name.endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
 
-        resp = self.ise.get('{0}/config/endpointgroup'.format(self.url_base))
+        group_id, status = self._resolve('endpointgroup', group)
+        if group_id is None:
+            result['response'] = ERS._unresolved(group, status)
+            result['error'] = status
+            return result
 
-        if resp.status_code == 200:
-            result['success'] = True
-            result['response'] = [(i['name'], i['id'], i['description']) for i in resp.json()['SearchResult']['resources']]
+        checkpoint = path + '.checkpoint'
+        job = {'group': group, 'fmt': fmt, 'compress': compress, 'detail': detail}
+        state = dict(job, page=0, count=0, offset=0, last=None, row=0, total=None)
+        if resume and os.path.exists(checkpoint) and os.path.exists(path):
+            with open(checkpoint) as f:
+                saved = json.load(f)
+            if all(saved.get(k) == v for k, v in job.items()) and os.path.getsize(path) >= saved['offset']:
+                state.update(saved)
+
+        url = '{0}/config/endpoint?filter=groupId.EQ.{1}&sortasc=name'.format(self.url_base, group_id)
+        profiles = {}
+        pool = ThreadPoolExecutor(max_workers=max(workers, 1)) if detail else None
+        raw = open(path, 'r+b' if state['page'] else 'wb')
+        try:
+            raw.truncate(state['offset'])
+            raw.seek(state['offset'])
+
+            buf = io.StringIO()
+            writer = csv.writer(buf, lineterminator='\n')
+            if fmt == 'csv' and not state['page']:
+                writer.writerow(ENDPOINT_CSV_FIELDS)
+
+            page, skip, first = 1, 0, None
+            if state['page']:
+                page, skip, first = self._find_resume_point(url, state)
+
+            for json_res in self._iter_pages(url, workers=workers, start_page=page, first_page=first):
+                rows = json_res['resources'][skip:]
+                skip = 0
+                last = rows[-1]['name'] if rows else state['last']
+                if detail:
+                    rows = list(pool.map(self._get_endpoint_detail, [i['id'] for i in rows]))
+
+                for i in rows:
+                    if fmt == 'ndjson':
+                        row = i if detail else {'mac': i['name'], 'id': i['id'], 'group': group}
+                        buf.write(json.dumps(row))
+                        buf.write('\n')
+                    elif detail:
+                        profile = self._get_profile_name(i['profileId'], profiles) if i.get('profileId') else ''
+                        writer.writerow((i['mac'], profile, group, i.get('description', '')))
+                    else:
+                        writer.writerow((i['name'], '', group, ''))
+
+                # One write per page keeps memory flat without a syscall per row. Gzip output gets a
+                # member per page, so a resumed run can cut the file back to any page boundary.
+                data = buf.getvalue().encode('utf-8')
+                buf.seek(0)
+                buf.truncate()
+                if data:
+                    raw.write(gzip.compress(data) if compress else data)
+                    raw.flush()
+
+                state.update(page=page, count=state['count'] + len(rows), offset=raw.tell(), last=last,
+                             row=len(json_res['resources']), total=int(json_res['total']))
+                with open(checkpoint + '.tmp', 'w') as f:
+                    json.dump(state, f)
+                os.replace(checkpoint + '.tmp', checkpoint)
+                page += 1
+        except (ERSError, requests.RequestException) as e:
+            result['response'] = str(e)
+            result['error'] = e.status_code if isinstance(e, ERSError) else ''
+            return result
+        finally:
+            raw.close()
+            if pool is not None:
+                pool.shutdown()
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        result['success'] = True
+        result['response'] = state['count']
+        return result
+
+    def _read_membership(self, path):
+        """
+        Read desired endpoint group membership from a file laid out like export_endpoints_in_group
+        writes it: the ISE endpoint import template (csv) or JSON lines (ndjson), optionally gzipped.
+        JSON lines either carry mac and group, or are whole ERSEndPoint objects (detail=True) whose
+        groupId is looked up once per group.
+        :param path: File to read
+        :return: Generator of (mac, group) tuples
+        """
+        group_names = {}
+        name = path[:-3] if path.endswith('.gz') else path
+        f = gzip.open(path, 'rt', newline='') if path.endswith('.gz') else open(path, newline='')
+        with f:
+            if name.endswith(('.ndjson', '.jsonl', '.json')):
+                for number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    row = json.loads(line)
+                    if 'group' in row:
+                        yield row.get('mac'), row['group']
+                        continue
+                    group_id = row.get('groupId')
+                    if not group_id:
+                        raise ERSError('Line {0} of {1} has neither a group nor a groupId'.format(number, path))
+                    if group_id not in group_names:
+                        resp = self._get_detail('endpointgroup', group_id)
+                        if resp.status_code != 200:
+                            raise ERSError('Endpoint group {0} on line {1} of {2}: {3}'.format(
+                                    group_id, number, path, ERS._ers_error(resp)), resp.status_code)
+                        group_names[group_id] = self.decoder.decode(resp.content)['EndPointGroup']['name']
+                        self.id_cache.set('endpointgroup', group_names[group_id], group_id)
+                    yield row.get('mac'), group_names[group_id]
+            else:
+                reader = csv.DictReader(f)
+                missing = [k for k in ('MACAddress', 'IdentityGroup') if k not in (reader.fieldnames or ())]
+                if missing:
+                    raise ERSError('{0} has no {1} column'.format(path, ' or '.join(missing)))
+                for row in reader:
+                    yield row['MACAddress'], row['IdentityGroup']
+
+    def plan_group_membership(self, desired, groups=None, prune=False, workers=4):
+        """
+        Work out the smallest set of changes that brings endpoint group membership in line with a
+        desired state. Current membership of the managed groups is streamed into a hash index and
+        diffed against the desired state in one pass over each; desired MACs found in none of the
+        managed groups are resolved the cheapest way get_endpoints_by_mac knows.
+        :param desired: File of desired membership (csv or ndjson, see export_endpoints_in_group) or an
+                        iterable of (mac, group name) tuples. A MAC listed twice ends up in the last group.
+        :param groups: Names of the endpoint groups managed, by default every group in the desired state
+        :param prune: Delete endpoints in the managed groups that the desired state does not list. This deletes
+                      the whole endpoint, profiling data included, so only use it with a complete desired state.
+        :param workers: Number of requests to run concurrently
+        :return: result dictionary, the response being a MembershipPlan
+        """
+        result = {
+            'success': False,
+            'response': '',
+            'error': '',
+        }
 
+        try:
+            rows = list(self._read_membership(desired) if isinstance(desired, str) else desired)
+        except ERSError as e:
+            result['response'] = e.value
+            result['error'] = e.status_code
             return result
-        else:
-            result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-            result['error'] = resp.status_code
+        canonical, rejects = ERS.normalize_macs(mac for mac, _ in rows)
+        wanted = OrderedDict((mac, row[1]) for mac, row in zip(canonical, rows) if mac is not None)
+        managed = list(OrderedDict.fromkeys(wanted.values() if groups is None else groups))
+
+        group_ids = {}
+        for group in OrderedDict.fromkeys(managed + list(wanted.values())):
+            group_ids[group], status = self._resolve('endpointgroup', group)
+            if group_ids[group] is None:
+                result['response'] = ERS._unresolved(group, status)
+                result['error'] = status
+                return result
+
+        current = {}
+        try:
+            for group in managed:
+                names = list(self.iter_endpoints_in_group(group_ids[group], workers=workers))
+                macs, invalid = ERS.normalize_macs(names)
+                # The listing only has names, one that is not a MAC can't be diffed (or deleted) safely
+                rejects.extend(invalid)
+                current.update((mac, group) for mac in macs if mac is not None)
+        except ERSError as e:
+            result['response'] = e.value
+            result['error'] = e.status_code
             return result
 
-    def get_endpoint_group(self, group):
+        move = []
+        unknown = []
+        unchanged = 0
+        for mac, group in wanted.items():
+            have = current.get(mac)
+            if have == group:
+                unchanged += 1
+            elif have is not None:
+                move.append((mac, group))
+            else:
+                unknown.append(mac)
+        delete = [mac for mac in current if mac not in wanted] if prune else []
+
+        # Endpoints outside the managed groups need moving, the ones ISE does not know adding
+        add = []
+        resolved = self._resolve_macs(unknown, workers)
+        failed = [mac for mac in unknown if resolved[mac][1] not in (200, 404)]
+        if failed:
+            result['response'] = 'Could not look up {0} of {1} endpoints'.format(len(failed), len(unknown))
+            result['error'] = resolved[failed[0]][1]
+            return result
+        for mac in unknown:
+            (move if resolved[mac][0] is not None else add).append((mac, wanted[mac]))
+
+        result['success'] = True
+        result['response'] = MembershipPlan(add=add, move=move, delete=delete, unchanged=unchanged, rejects=rejects)
+        return result
+
+    def apply_group_membership(self, plan, workers=8, bulk=False, batch_size=None, poll_interval=1,
+                               poll_timeout=300):
         """
-        Get endpoint identity group details
-        :param group: Name of the identity group
-        :return: result dictionary
+        Carry out a MembershipPlan. Moves and adds are grouped by target group, and every group of
+        changes runs workers at a time.
+        :param plan: MembershipPlan from plan_group_membership
+        :param workers: Number of requests to run concurrently
+        :param bulk: Send the changes through the ERS bulk request API instead of one request per endpoint
+        :param batch_size: Endpoints per bulk request, picked automatically by default
+        :param poll_interval: Seconds between bulk status polls
+        :param poll_timeout: Seconds to wait for each bulk request to finish
+        :return: result dictionary, the response being a dictionary of per-endpoint results keyed by MAC
         """
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
-
         result = {
             'success': False,
             'response': '',
             'error': '',
         }
 
-        resp = self.ise.get('{0}/config/endpointgroup?filter=name.EQ.{1}'.format(self.url_base, group))
-        found_group = resp.json()
+        bulk_args = {'batch_size': batch_size, 'poll_interval': poll_interval, 'poll_timeout': poll_timeout}
+        outcomes = {}
 
-        if found_group['SearchResult']['total'] == 1:
-            resp = self.ise.get('{0}/config/endpointgroup/{1}'.format(self.url_base, found_group['SearchResult']['resources'][0]['id']))
-            if resp.status_code == 200:
-                result['success'] = True
-                result['response'] = resp.json()['EndPointGroup']
-                return result
-            elif resp.status_code == 404:
-                result['response'] = '{0} not found'.format(group)
-                result['error'] = resp.status_code
-                return result
-            else:
-                result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-                result['error'] = resp.status_code
-                return result
-        elif found_group['SearchResult']['total'] == 0:
-            result['response'] = '{0} not found'.format(group)
-            result['error'] = 404
-            return result
+        def safely(func, *args, **kwargs):
+            # A change that raises is reported like any other failure, the rest of the plan still runs
+            try:
+                return func(*args, **kwargs)
+            except (InvalidMacAddress, ERSError, requests.RequestException) as e:
+                return {'success': False, 'response': getattr(e, 'value', str(e)),
+                        'error': getattr(e, 'status_code', '')}
 
-        else:
-            result['response'] = '{0} not found'.format(group)
-            result['error'] = resp.status_code
-            return result
+        def collect(res, macs):
+            if isinstance(res['response'], dict):
+                outcomes.update(res['response'])
+            else:
+                outcomes.update((mac, res) for mac in macs)
+
+        def by_group(changes):
+            grouped = OrderedDict()
+            for mac, group in changes:
+                grouped.setdefault(group, []).append(mac)
+            return grouped.items()
+
+        for group, macs in by_group(plan.move):
+            collect(safely(self.move_endpoints_to_group, macs, group, workers=workers, bulk=bulk, **bulk_args), macs)
+
+        for group, macs in by_group(plan.add):
+            group_id, status = self._resolve('endpointgroup', group)
+            if group_id is None:
+                collect({'success': False, 'response': ERS._unresolved(group, status), 'error': status}, macs)
+            elif bulk:
+                collect(safely(self.bulk_add_endpoints, macs, group_id=group_id, workers=workers, **bulk_args), macs)
+            else:
+                with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+                    outcomes.update(zip(macs, pool.map(lambda mac: safely(self.add_endpoint, mac, mac, group_id),
+                                                       macs)))
+
+        if plan.delete and bulk:
+            collect(safely(self.bulk_delete_endpoints, plan.delete, workers=workers, **bulk_args), plan.delete)
+        elif plan.delete:
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+                outcomes.update(zip(plan.delete, pool.map(lambda mac: safely(self.delete_endpoint, mac),
+                                                          plan.delete)))
+
+        result['response'] = outcomes
+        result['success'] = all(i['success'] for i in outcomes.values())
+        if not result['success']:
+            result['error'] = '{0} of {1} endpoints failed'.format(
+                    sum(1 for i in outcomes.values() if not i['success']), len(outcomes))
+        return result
 
-    def get_endpoint_group_id(self, group):
+    def get_identity_groups(self):
         """
-        Get endpoint identity group details
-        :param group: Name of the identity group
+        Get all identity groups
         :return: result dictionary
         """
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
-
         result = {
             'success': False,
             'response': '',
             'error': '',
         }
 
-        resp = self.ise.get('{0}/config/endpointgroup?filter=name.EQ.{1}'.format(self.url_base, group))
-        found_group = resp.json()
+        resp = self._request('GET', '{0}/config/identitygroup'.format(self.url_base))
 
-        if found_group['SearchResult']['total'] == 1:
-            resp = self.ise.get('{0}/config/endpointgroup/{1}'.format(self.url_base, found_group['SearchResult']['resources'][0]['id']))
-            if resp.status_code == 200:
-                result['success'] = True
-                result['response'] = resp.json()['EndPointGroup']['id']
-                return result
-            elif resp.status_code == 404:
-                result['response'] = '{0} not found'.format(group)
-                result['error'] = resp.status_code
-                return result
-            else:
-                result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-                result['error'] = resp.status_code
-                return result
-        elif found_group['SearchResult']['total'] == 0:
-            result['response'] = '{0} not found'.format(group)
-            result['error'] = 404
+        if resp.status_code == 200:
+            result['success'] = True
+            result['response'] = [(i['name'], i['id'], i['description'])
+                                  for i in self.decoder.decode_page(resp.content)['SearchResult']['resources']]
             return result
-
         else:
-            result['response'] = '{0} not found'.format(group)
+            result['response'] = ERS._ers_error(resp)
             result['error'] = resp.status_code
             return result
 
-    def get_endpoints(self):
+    def get_identity_group(self, group):
         """
-        Get all endpoints
+        Get identity group details
+        :param group: Name of the identity group
         :return: result dictionary
         """
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
-
-        resp = self.ise.get('{0}/config/endpoint'.format(self.url_base))
-
         result = {
             'success': False,
             'response': '',
             'error': '',
         }
 
-        json_res = resp.json()['SearchResult']
+        oid, status = self._resolve('identitygroup', group)
 
-        if resp.status_code == 200 and int(json_res['total']) > 1:
-            result['success'] = True
-            result['response'] = [(i['name'], i['id'])
-                                  for i in json_res['resources']]
+        if oid is None:
+            result['response'] = ERS._unresolved(group, status)
+            result['error'] = status
             return result
 
-        elif resp.status_code == 200 and int(json_res['total']) == 1:
+        resp = self._get_detail('identitygroup', oid)
+        if resp.status_code == 200:
             result['success'] = True
-            result['response'] = [(json_res['resources'][0]['name'],
-                                   json_res['resources'][0]['id'])]
+            result['response'] = self.decoder.decode(resp.content)['IdentityGroup']
             return result
-
-        elif resp.status_code == 200 and int(json_res['total']) == 0:
-            result['success'] = True
-            result['response'] = []
+        elif resp.status_code == 404:
+            self.id_cache.invalidate('identitygroup', group)
+            result['response'] = '{0} not found'.format(group)
+            result['error'] = resp.status_code
             return result
-
         else:
-            result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
+            result['response'] = ERS._ers_error(resp)
             result['error'] = resp.status_code
             return result
 
-    def get_endpoint(self, mac_address):
+    def get_users(self, compact=False, workers=1):
         """
-        Get endpoint details
-        :param mac_address: MAC address of the endpoint
-        :return: result dictionary
+        Get all internal users
+        :param compact: Return every row as a ResourceList instead of the first page as a list of tuples
+        :param workers: Number of pages to fetch concurrently when compact
+        :return: List of tuples of user details
         """
-        is_valid = ERS._mac_test(mac_address)
-
-        if not is_valid:
-            raise InvalidMacAddress('{0}. Must be in the form of AA:BB:CC:00:11:22'.format(mac_address))
-        else:
-            self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
-
-            result = {
-                'success': False,
-                'response': '',
-                'error': '',
-            }
-
-            resp = self.ise.get('{0}/config/endpoint?filter=mac.EQ.{1}'.format(self.url_base, mac_address))
-            found_endpoint = resp.json()
-
-            if found_endpoint['SearchResult']['total'] == 1:
-                resp = self.ise.get('{0}/config/endpoint/{1}'.format(
-                        self.url_base, found_endpoint['SearchResult']['resources'][0]['id']))
-                if resp.status_code == 200:
-                    result['success'] = True
-                    result['response'] = resp.json()['ERSEndPoint']
-                    return result
-                elif resp.status_code == 404:
-                    result['response'] = '{0} not found'.format(mac_address)
-                    result['error'] = resp.status_code
-                    return result
-                else:
-                    result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-                    result['error'] = resp.status_code
-                    return result
-            elif found_endpoint['SearchResult']['total'] == 0:
-                result['response'] = '{0} not found'.format(mac_address)
-                result['error'] = 404
-                return result
-
-            else:
-                result['response'] = '{0} not found'.format(mac_address)
-                result['error'] = resp.status_code
-                return result
+        return self._listing('{0}/config/internaluser'.format(self.url_base), compact=compact, workers=workers)
 
-    def search_endpoints_by_group(self, group_id):
+    def get_user(self, user_id):
         """
-        Get all endpoints
+        Get user detailed info
+        :param user_id: User ID
         :return: result dictionary
         """
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
-
-        print('{0}/config/endpoint?filter=identityGroup.EQ.{1}'.format(self.url_base, group_id))
-
-        resp = self.ise.get('{0}/config/endpoint?filter=groupId.EQ.{1}'.format(self.url_base, group_id))
-
         result = {
             'success': False,
             'response': '',
             'error': '',
         }
 
-        json_res = resp.json()['SearchResult']
+        oid, status = self._resolve('internaluser', user_id)
 
-        if resp.status_code == 200 and int(json_res['total']) > 1:
-            result['success'] = True
-            result['response'] = [(i['name'], i['id'])
-                                  for i in json_res['resources']]
+        if oid is None:
+            result['response'] = ERS._unresolved(user_id, status)
+            result['error'] = status
             return result
 
-        elif resp.status_code == 200 and int(json_res['total']) == 1:
+        resp = self._get_detail('internaluser', oid)
+        if resp.status_code == 200:
             result['success'] = True
-            result['response'] = [(json_res['resources'][0]['name'],
-                                   json_res['resources'][0]['id'])]
+            result['response'] = self.decoder.decode(resp.content)['InternalUser']
             return result
-
-        elif resp.status_code == 200 and int(json_res['total']) == 0:
-            result['success'] = True
-            result['response'] = []
+        elif resp.status_code == 404:
+            self.id_cache.invalidate('internaluser', user_id)
+            result['response'] = '{0} not found'.format(user_id)
+            result['error'] = resp.status_code
             return result
-
         else:
-            result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
+            result['response'] = ERS._ers_error(resp)
             result['error'] = resp.status_code
             return result
 
-    def list_endpoints_in_group(self, group_id, page=1):
+    def add_user(self,
+                 user_id,
+                 password,
+                 user_group_oid,
+                 enable='',
+                 first_name='',
+                 last_name='',
+                 email='',
+                 description=''):
         """
-        Get all endpoints
+        Add a user to the local user store
+        :param user_id: User ID
+        :param password: User password
+        :param user_group_oid: OID of group to add user to
+        :param enable: Enable password used for Tacacs
+        :param first_name: First name
+        :param last_name: Last name
+        :param email: email address
+        :param description: User description
         :return: result dictionary
         """
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
+        result = {
+            'success': False,
+            'response': '',
+            'error': '',
+        }
 
-        #print('{0}/config/endpoint?size=100&filter=identityGroup.EQ.{1}&page={2}'.format(self.url_base, group_id, page))
+        data = ERS._user_data(user_id, password, user_group_oid, enable, first_name, last_name, email, description)
 
-        resp = self.ise.get('{0}/config/endpoint?size=100&filter=groupId.EQ.{1}&page={2}'.format(self.url_base, group_id, page))
+        resp = self._request('POST', '{0}/config/internaluser'.format(self.url_base), data=json.dumps(data))
+        if resp.status_code == 201:
+            self._cache_created('internaluser', user_id, resp)
+            result['success'] = True
+            result['response'] = '{0} Added Successfully'.format(user_id)
+            return result
+        else:
+            result['response'] = ERS._ers_error(resp)
+            result['error'] = resp.status_code
+            return result
 
+    def delete_user(self, user_id):
+        """
+        Delete a user
+        :param user_id: User ID
+        :return: Result dictionary
+        """
         result = {
             'success': False,
             'response': '',
             'error': '',
         }
 
-        json_res = resp.json()['SearchResult']
+        oid, status = self._resolve('internaluser', user_id)
 
-        if resp.status_code == 200 and int(json_res['total']) > 100:
-            result['success'] = True
-            result['response'] = [(i['name'])
-                                  for i in json_res['resources']]
-            result['total'] = json_res['total']
-            #result['next'] = True if ('nextPage' in json_res) else False
-            if 'nextPage' in json_res:
-                result['next'] = True
-            else:
-                result['next'] = False
+        if oid is None:
+            result['response'] = ERS._unresolved(user_id, status)
+            result['error'] = status
             return result
 
-        if resp.status_code == 200 and int(json_res['total']) > 1:
-            result['success'] = True
-            result['response'] = [(i['name'])
-                                  for i in json_res['resources']]
-            result['total'] = json_res['total']
-            if 'nextPage' in json_res:
-                result['next'] = True
-            else:
-                result['next'] = False
-            return result
+        resp = self._request('DELETE', '{0}/config/internaluser/{1}'.format(self.url_base, oid))
+        self.id_cache.invalidate('internaluser', user_id)
 
-        elif resp.status_code == 200 and int(json_res['total']) == 1:
+        if resp.status_code == 204:
             result['success'] = True
-            result['response'] = [(json_res['resources'][0]['name'])]
+            result['response'] = '{0} Deleted Successfully'.format(user_id)
             return result
-
-        elif resp.status_code == 200 and int(json_res['total']) == 0:
-            result['success'] = True
-            result['response'] = []
+        elif resp.status_code == 404:
+            result['response'] = '{0} not found'.format(user_id)
+            result['error'] = resp.status_code
             return result
-
         else:
-            result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
+            result['response'] = ERS._ers_error(resp)
             result['error'] = resp.status_code
             return result
 
-    def add_endpoint(self,
-                    name,
-                    mac,
-                    group_id,
-                    static_profile_assigment='false',
-                    static_group_assignment='true',
-                    profile_id='',
-                    description=''):
+    def bulk_add_users(self, users, group=None, bulk=False, workers=8, batch_size=None, progress=None,
+                       poll_interval=1, poll_timeout=300):
         """
-        Add a user to the local user store
-        :param name: Name
-        :param mac: Macaddress
-        :param group_id: OID of group to add endpoint in
-        :param static_profile_assigment: Set static profile
-        :param static_group_assignment: Set static group
-        :param profile_id: OID of profile
-        :param description: User description
-        :return: result dictionary
+        Add many internal users. Identity group names are resolved once up front, then the users
+        are added through a Batch, or the ERS bulk request API with bulk=True. A user that fails
+        is reported and the rest carry on.
+        :param users: Iterable of dictionaries of add_user arguments. Instead of user_group_oid, group may name
+                      the identity group, or a list of them.
+        :param group: Identity group name of users that give neither
+        :param bulk: Send the users through the ERS bulk request API instead of one POST per user
+        :param workers: Number of adds, or bulk requests, to run concurrently
+        :param batch_size: Users per bulk request, picked automatically by default
+        :param progress: Callable passed (done, total, failed) as users complete
+        :param poll_interval: Seconds between bulk status polls
+        :param poll_timeout: Seconds to wait for each bulk request to finish
+        :return: result dictionary, the response being a dictionary of per-user results keyed by user ID
         """
+        result = {
+            'success': False,
+            'response': '',
+            'error': '',
+        }
 
-        is_valid = ERS._mac_test(mac)
-        if not is_valid:
-            raise InvalidMacAddress('{0}. Must be in the form of AA:BB:CC:00:11:22'.format(mac))
-        else:
-            self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
-
-            result = {
-                'success': False,
-                'response': '',
-                'error': '',
-            }
-
-            data = { "ERSEndPoint" : { 'name': name, 'description': description, 'mac': mac,
-                                       'profileId': profile_id, 'staticProfileAssignment': static_profile_assigment,
-                                       'groupId': group_id, 'staticGroupAssignment': static_group_assignment,
-                                        'customAttributes': {'customAttributes': {'key1': 'value1'} } } }
-
-            resp = self.ise.post('{0}/config/endpoint'.format(self.url_base), data=json.dumps(data), timeout=self.timeout)
-            if resp.status_code == 201:
-                result['success'] = True
-                result['response'] = '{0} Added Successfully'.format(name)
-                return result
-            else:
-                result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-                result['error'] = resp.status_code
-                return result
-
-
-    def delete_endpoint(self, mac):
+        users = [dict(i) for i in users]
+        for user in users:
+            names = user.pop('group', None) or (None if user.get('user_group_oid') else group)
+            user['groups'] = [] if names is None else [names] if isinstance(names, str) else list(names)
+
+        group_ids = {}
+        for name in OrderedDict.fromkeys(name for user in users for name in user['groups']):
+            group_ids[name] = self._resolve('identitygroup', name)
+
+        items = []
+        outcomes = OrderedDict()
+        seen = set()
+        for number, user in enumerate(users, 1):
+            user_id, names = user.get('user_id'), user.pop('groups')
+            missing = [name for name in names if group_ids[name][0] is None]
+            unknown = sorted(set(user) - set(USER_FIELDS))
+
+            if unknown:
+                outcome = {'success': False, 'response': 'Unknown field {0}'.format(', '.join(unknown)), 'error': 'invalid'}
+            elif not user_id or not user.get('password'):
+                outcome = {'success': False, 'response': 'Missing user_id or password', 'error': 'invalid'}
+            elif user_id in seen:
+                outcome = {'success': False, 'response': 'Duplicate user {0}'.format(user_id), 'error': 'invalid'}
+            elif missing:
+                outcome = {'success': False, 'response': ERS._unresolved(missing[0], group_ids[missing[0]][1]),
+                           'error': group_ids[missing[0]][1]}
+            elif not names and not user.get('user_group_oid'):
+                outcome = {'success': False, 'response': 'No identity group', 'error': 'invalid'}
+            else:
+                if names:
+                    user['user_group_oid'] = ','.join(group_ids[name][0] for name in names)
+                items.append((user_id, user))
+                seen.add(user_id)
+                continue
+
+            if not user_id or user_id in seen:
+                # Keep the outcome of the first row by that ID
+                user_id = '{0} (row {1})'.format(user_id, number) if user_id else 'row {0}'.format(number)
+            outcomes[user_id] = outcome
+            seen.add(user_id)
+
+        if bulk:
+            items = [(user_id, ERS._user_data(**user)['InternalUser']) for user_id, user in items]
+            outcomes.update(self._bulk('internaluser', 'InternalUserBulkRequest', 'create', items, 'name',
+                                       workers, batch_size, poll_interval, poll_timeout, progress))
+        else:
+            with self.batch(workers=workers, progress=progress) as batch:
+                index = {batch.submit('add_user', **user): user_id for user_id, user in items}
+                for i, outcome in batch.results():
+                    outcomes[index[i]] = outcome
+
+        result['response'] = outcomes
+        result['success'] = all(i['success'] for i in outcomes.values())
+        if not result['success']:
+            result['error'] = '{0} of {1} users failed'.format(
+                    sum(1 for i in outcomes.values() if not i['success']), len(outcomes))
+        return result
+
+    def bulk_delete_users(self, user_ids, bulk=False, workers=8, batch_size=None, progress=None, poll_interval=1,
+                          poll_timeout=300):
         """
-        Delete an endpoint
-        :param mac: Endpoint Macaddress
-        :return: Result dictionary
+        Delete many internal users. User IDs are resolved the cheapest way, one listing of all users
+        when that takes fewer requests than a filter search per user, then deleted through a Batch,
+        or the ERS bulk request API with bulk=True. A user that fails is reported and the rest carry on.
+        :param user_ids: Iterable of user IDs
+        :param bulk: Send the deletes through the ERS bulk request API instead of one DELETE per user
+        :param workers: Number of lookups and deletes, or bulk requests, to run concurrently
+        :param batch_size: Users per bulk request, picked automatically by default
+        :param progress: Callable passed (done, total, failed) as users complete
+        :param poll_interval: Seconds between bulk status polls
+        :param poll_timeout: Seconds to wait for each bulk request to finish
+        :return: result dictionary, the response being a dictionary of per-user results keyed by user ID
         """
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
-
         result = {
             'success': False,
             'response': '',
             'error': '',
         }
 
-        resp = self.ise.get('{0}/config/endpoint?filter=mac.EQ.{1}'.format(self.url_base, mac))
-        found_endpoint = resp.json()
-        if found_endpoint['SearchResult']['total'] == 1:
-            endpoint_oid = found_endpoint['SearchResult']['resources'][0]['id']
-            resp = self.ise.delete('{0}/config/endpoint/{1}'.format(self.url_base, endpoint_oid), timeout=self.timeout)
+        user_ids = list(OrderedDict.fromkeys(user_ids))
+        resolved = self._resolve_names('internaluser', user_ids, workers)
+
+        items = []
+        outcomes = OrderedDict()
+        for user_id in user_ids:
+            oid, status = resolved[user_id]
+            if oid is None:
+                outcomes[user_id] = {'success': False, 'response': ERS._unresolved(user_id, status), 'error': status}
+            else:
+                items.append((user_id, oid))
 
+        def delete(user_id, oid):
+            outcome = {'success': False, 'response': '', 'error': ''}
+            resp = self._request('DELETE', '{0}/config/internaluser/{1}'.format(self.url_base, oid))
             if resp.status_code == 204:
-                result['success'] = True
-                result['response'] = '{0} Deleted Successfully'.format(mac)
-                return result
+                outcome['success'] = True
+                outcome['response'] = '{0} Deleted Successfully'.format(user_id)
             elif resp.status_code == 404:
-                result['response'] = '{0} not found'.format(mac)
-                result['error'] = resp.status_code
-                return result
+                outcome['response'] = '{0} not found'.format(user_id)
+                outcome['error'] = resp.status_code
             else:
-                result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-                result['error'] = resp.status_code
-                return result
-        elif found_endpoint['SearchResult']['total'] == 0:
-                result['response'] = '{0} not found'.format(mac)
-                result['error'] = 404
-                return result
-        else:
-            result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-            result['error'] = resp.status_code
-            return result
-
+                outcome['response'] = ERS._ers_error(resp)
+                outcome['error'] = resp.status_code
+            return outcome
 
+        if bulk:
+            outcomes.update(self._bulk('internaluser', 'InternalUserBulkRequest', 'delete', items, 'id',
+                                       workers, batch_size, poll_interval, poll_timeout, progress))
+        else:
+            with self.batch(workers=workers, progress=progress) as batch:
+                index = {batch.submit(delete, user_id, oid): user_id for user_id, oid in items}
+                for i, outcome in batch.results():
+                    outcomes[index[i]] = outcome
+        for user_id, _ in items:
+            self.id_cache.invalidate('internaluser', user_id)
+
+        result['response'] = outcomes
+        result['success'] = all(i['success'] for i in outcomes.values())
+        if not result['success']:
+            result['error'] = '{0} of {1} users failed'.format(
+                    sum(1 for i in outcomes.values() if not i['success']), len(outcomes))
+        return result
 
-    def get_identity_groups(self):
+    def get_device_groups(self):
         """
-        Get all identity groups
-        :return: result dictionary
+        Get a list tuples of device groups
+        :return:
         """
         result = {
             'success': False,
@@ -451,27 +2817,25 @@ class ERS(object):
             'error': '',
         }
 
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
-
-        resp = self.ise.get('{0}/config/identitygroup'.format(self.url_base))
+        resp = self._request('GET', '{0}/config/networkdevicegroup'.format(self.url_base))
 
         if resp.status_code == 200:
             result['success'] = True
-            result['response'] = [(i['name'], i['id'], i['description'])
-                                  for i in resp.json()['SearchResult']['resources']]
+            result['response'] = [(i['name'], i['id'])
+                                  for i in self.decoder.decode_page(resp.content)['SearchResult']['resources']]
             return result
         else:
-            result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
+            result['response'] = ERS._ers_error(resp)
             result['error'] = resp.status_code
             return result
 
-    def get_identity_group(self, group):
+    def get_device_group(self, device_group_oid):
         """
-        Get identity group details
-        :param group: Name of the identity group
+        Get a device group details
+        :param device_group_oid: oid of the device group
         :return: result dictionary
         """
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
+        resp = self._get_detail('networkdevicegroup', device_group_oid)
 
         result = {
             'success': False,
@@ -479,134 +2843,125 @@ class ERS(object):
             'error': '',
         }
 
-        resp = self.ise.get('{0}/config/identitygroup?filter=name.EQ.{1}'.format(self.url_base, group))
-        found_group = resp.json()
-
-        if found_group['SearchResult']['total'] == 1:
-            resp = self.ise.get('{0}/config/identitygroup/{1}'.format(
-                    self.url_base, found_group['SearchResult']['resources'][0]['id']))
-            if resp.status_code == 200:
-                result['success'] = True
-                result['response'] = resp.json()['IdentityGroup']
-                return result
-            elif resp.status_code == 404:
-                result['response'] = '{0} not found'.format(group)
-                result['error'] = resp.status_code
-                return result
-            else:
-                result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-                result['error'] = resp.status_code
-                return result
-        elif found_group['SearchResult']['total'] == 0:
-            result['response'] = '{0} not found'.format(group)
-            result['error'] = 404
+        if resp.status_code == 200:
+            result['success'] = True
+            result['response'] = self.decoder.decode(resp.content)['NetworkDeviceGroup']
+            return result
+        elif resp.status_code == 404:
+            result['response'] = '{0} not found'.format(device_group_oid)
+            result['error'] = resp.status_code
             return result
-
         else:
-            result['response'] = '{0} not found'.format(group)
+            result['response'] = ERS._ers_error(resp)
             result['error'] = resp.status_code
             return result
 
-    def get_users(self):
+    def get_devices(self, compact=False, workers=1):
         """
-        Get all internal users
-        :return: List of tuples of user details
+        Get a list of devices
+        :param compact: Return every row as a ResourceList instead of the first page as a list of tuples
+        :param workers: Number of pages to fetch concurrently when compact
+        :return: result dictionary
         """
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
+        return self._listing('{0}/config/networkdevice'.format(self.url_base), compact=compact, workers=workers)
 
-        resp = self.ise.get('{0}/config/internaluser'.format(self.url_base))
+    def iter_devices(self, page_size=None, workers=1, ordered=True):
+        """
+        Iterate over all network devices, following the pagination on its own
+        :param page_size: Rows per page, defaults to (and is capped at) the ERS maximum of 100
+        :param workers: Number of pages to fetch concurrently
+        :param ordered: Yield in page order, otherwise in the order pages complete
+        :return: Generator of (name, id) tuples
+        """
+        url = '{0}/config/networkdevice'.format(self.url_base)
+        for json_res in self._iter_pages(url, page_size, workers, ordered):
+            for i in json_res['resources']:
+                yield (i['name'], i['id'])
 
+    def get_device(self, device):
+        """
+        Get device detailed info
+        :param device: Device name
+        :return: result dictionary
+        """
         result = {
             'success': False,
             'response': '',
             'error': '',
         }
 
-        json_res = resp.json()['SearchResult']
+        oid, status = self._resolve('networkdevice', device)
 
-        if resp.status_code == 200 and int(json_res['total']) > 1:
-            result['success'] = True
-            result['response'] = [(i['name'], i['id'])
-                                  for i in json_res['resources']]
+        if oid is None:
+            result['response'] = ERS._unresolved(device, status)
+            result['error'] = status
             return result
 
-        elif resp.status_code == 200 and int(json_res['total']) == 1:
+        resp = self._get_detail('networkdevice', oid)
+        if resp.status_code == 200:
             result['success'] = True
-            result['response'] = [(json_res['resources'][0]['name'],
-                                   json_res['resources'][0]['id'])]
+            result['response'] = self.decoder.decode(resp.content)['NetworkDevice']
             return result
-
-        elif resp.status_code == 200 and int(json_res['total']) == 0:
-            result['success'] = True
-            result['response'] = []
+        elif resp.status_code == 404:
+            self.id_cache.invalidate('networkdevice', device)
+            result['response'] = '{0} not found'.format(device)
+            result['error'] = resp.status_code
             return result
-
         else:
-            result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
+            result['response'] = ERS._ers_error(resp)
             result['error'] = resp.status_code
             return result
 
-    def get_user(self, user_id):
+    def add_device(self,
+                   name,
+                   ip_address,
+                   radius_key,
+                   snmp_ro,
+                   dev_group,
+                   dev_location,
+                   dev_type,
+                   description='',
+                   snmp_v='TWO_C',
+                   dev_profile='Cisco'):
         """
-        Get user detailed info
-        :param user_id: User ID
-        :return: result dictionary
+        Add a device
+        :param name: name of device
+        :param ip_address: IP address of device
+        :param radius_key: Radius shared secret
+        :param snmp_ro: SNMP read only community string
+        :param dev_group: Device group name
+        :param dev_location: Device location
+        :param dev_type: Device type
+        :param description: Device description
+        :param dev_profile: Device profile
+        :return: Result dictionary
         """
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
-
         result = {
             'success': False,
             'response': '',
             'error': '',
         }
 
-        resp = self.ise.get('{0}/config/internaluser?filter=name.EQ.{1}'.format(self.url_base, user_id))
-        found_user = resp.json()
+        data = ERS._device_data(name, ip_address, radius_key, snmp_ro, dev_group, dev_location, dev_type,
+                                description, snmp_v, dev_profile)
 
-        if found_user['SearchResult']['total'] == 1:
-            resp = self.ise.get('{0}/config/internaluser/{1}'.format(
-                    self.url_base, found_user['SearchResult']['resources'][0]['id']))
-            if resp.status_code == 200:
-                result['success'] = True
-                result['response'] = resp.json()['InternalUser']
-                return result
-            elif resp.status_code == 404:
-                result['response'] = '{0} not found'.format(user_id)
-                result['error'] = resp.status_code
-                return result
-            else:
-                result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-                result['error'] = resp.status_code
-                return result
-        elif found_user['SearchResult']['total'] == 0:
-            result['response'] = '{0} not found'.format(user_id)
-            result['error'] = 404
+        resp = self._request('POST', '{0}/config/networkdevice'.format(self.url_base), data=json.dumps(data))
+
+        if resp.status_code == 201:
+            self._cache_created('networkdevice', name, resp)
+            result['success'] = True
+            result['response'] = '{0} Added Successfully'.format(name)
             return result
         else:
-            result['response'] = 'Unknown error'
+            result['response'] = ERS._ers_error(resp)
             result['error'] = resp.status_code
             return result
 
-    def add_user(self,
-                 user_id,
-                 password,
-                 user_group_oid,
-                 enable='',
-                 first_name='',
-                 last_name='',
-                 email='',
-                 description=''):
+    def delete_device(self, device):
         """
-        Add a user to the local user store
-        :param user_id: User ID
-        :param password: User password
-        :param user_group_oid: OID of group to add user to
-        :param enable: Enable password used for Tacacs
-        :param first_name: First name
-        :param last_name: Last name
-        :param email: email address
-        :param description: User description
-        :return: result dictionary
+        Delete a device
+        :param device: Device name
+        :return: Result dictionary
         """
         result = {
             'success': False,
@@ -614,70 +2969,652 @@ class ERS(object):
             'error': '',
         }
 
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
-
-        data = { "InternalUser" : { 'name': user_id, 'password': password, 'enablePassword': enable,
-                                   'firstName': first_name, 'lastName': last_name, 'email': email,
-                                   'description': description, 'identityGroups': user_group_oid }}
+        oid, status = self._resolve('networkdevice', device)
 
+        if oid is None:
+            result['response'] = ERS._unresolved(device, status)
+            result['error'] = status
+            return result
 
+        resp = self._request('DELETE', '{0}/config/networkdevice/{1}'.format(self.url_base, oid))
+        self.id_cache.invalidate('networkdevice', device)
 
-        resp = self.ise.post('{0}/config/internaluser'.format(self.url_base), data=json.dumps(data), timeout=self.timeout)
-        if resp.status_code == 201:
+        if resp.status_code == 204:
             result['success'] = True
-            result['response'] = '{0} Added Successfully'.format(user_id)
+            result['response'] = '{0} Deleted Successfully'.format(device)
+            return result
+        elif resp.status_code == 404:
+            result['response'] = '{0} not found'.format(device)
+            result['error'] = resp.status_code
             return result
         else:
-            result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
+            result['response'] = ERS._ers_error(resp)
             result['error'] = resp.status_code
             return result
 
-    def delete_user(self, user_id):
+
+    @staticmethod
+    def _read_inventory(path):
         """
-        Delete a user
-        :param user_id: User ID
-        :return: Result dictionary
+        Read network devices from an inventory file: csv with add_device argument names as the
+        column headers, or YAML holding a list of mappings with the same keys (several documents
+        are read one after another). Rows are yielded as they are read.
+        :param path: File to read
+        :return: Generator of dictionaries of add_device arguments
+        """
+        if path.endswith(('.yml', '.yaml')):
+            if yaml is None:
+                raise ImportError('Reading a YAML inventory needs PyYAML installed')
+            with open(path) as f:
+                for doc in yaml.safe_load_all(f):
+                    for row in doc if isinstance(doc, list) else [doc] if doc else []:
+                        yield row
+        else:
+            with open(path, newline='') as f:
+                for row in csv.DictReader(f):
+                    # Empty cells fall back to the add_device defaults
+                    yield {k: v for k, v in row.items() if v not in (None, '')}
+
+    @staticmethod
+    def _check_device(row, groups, names, addresses):
+        """
+        Validate one inventory row, remembering its name and address to catch duplicates
+        :param row: Dictionary of add_device arguments, the IP address optionally with a /prefix
+        :param groups: Set of network device group names the PAN has
+        :param names: Set of device names seen so far
+        :param addresses: Set of IP addresses seen so far
+        :return: (NetworkDevice payload, None) or (None, reason the row is rejected)
+        """
+        unknown = sorted(set(row) - set(DEVICE_INVENTORY_FIELDS))
+        if unknown:
+            return None, 'Unknown field {0}'.format(', '.join(unknown))
+        missing = [k for k in DEVICE_INVENTORY_FIELDS[:7] if row.get(k) in (None, '')]
+        if missing:
+            return None, 'Missing {0}'.format(', '.join(missing))
+
+        args = {k: str(v) for k, v in row.items()}
+        try:
+            interface = ipaddress.ip_interface(args.pop('ip_address'))
+        except ValueError:
+            return None, 'Invalid IP address {0}'.format(row['ip_address'])
+
+        for k in ('dev_group', 'dev_location', 'dev_type'):
+            if args[k] not in groups:
+                return None, 'Unknown network device group {0}'.format(args[k])
+        if args['name'] in names:
+            return None, 'Duplicate device {0}'.format(args['name'])
+        if interface.ip in addresses:
+            return None, 'Duplicate IP address {0}'.format(interface.ip)
+
+        names.add(args['name'])
+        addresses.add(interface.ip)
+        return ERS._device_data(ip_address=str(interface.ip), mask=interface.network.prefixlen,
+                                **args)['NetworkDevice'], None
+
+    def bulk_add_devices(self, inventory, report=None, bulk=False, workers=8, batch_size=None, progress=None,
+                         poll_interval=1, poll_timeout=300):
+        """
+        Onboard many network devices. Each row is validated as it is read: the IP address must
+        parse, names and addresses must be unique, and every network device group path must
+        exist on the PAN, checked against one listing of the groups fetched up front. Valid
+        devices are then added through a Batch, or the ERS bulk request API with bulk=True,
+        and rejected rows are reported without being sent.
+        :param inventory: csv or YAML file (see _read_inventory), or an iterable of dictionaries of add_device
+                          arguments
+        :param report: csv file to write one line per device to, as its outcome comes in
+        :param bulk: Send the devices through the ERS bulk request API instead of one POST per device
+        :param workers: Number of adds, or bulk requests, to run concurrently
+        :param batch_size: Devices per bulk request, picked automatically by default
+        :param progress: Callable passed (done, total, failed) as devices complete
+        :param poll_interval: Seconds between bulk status polls
+        :param poll_timeout: Seconds to wait for each bulk request to finish
+        :return: result dictionary, the response being a dictionary of per-device results keyed by name
+        """
+        result = {
+            'success': False,
+            'response': '',
+            'error': '',
+        }
+
+        try:
+            groups = set(i['name'] for json_res in self._iter_pages(
+                    '{0}/config/networkdevicegroup'.format(self.url_base)) for i in json_res['resources'])
+        except (ERSError, requests.RequestException) as e:
+            result['response'] = str(e)
+            result['error'] = e.status_code if isinstance(e, ERSError) else ''
+            return result
+
+        out = open(report, 'w', newline='') if report else None
+        writer = csv.writer(out) if out else None
+        if writer:
+            writer.writerow(DEVICE_REPORT_FIELDS)
+
+        outcomes = OrderedDict()
+        addresses = {}
+
+        def record(name, outcome):
+            outcomes[name] = outcome
+            if writer:
+                writer.writerow((name, addresses.get(name, ''), outcome['success'], outcome['response'],
+                                 outcome['error']))
+                out.flush()
+
+        def add(name, device):
+            outcome = {'success': False, 'response': '', 'error': ''}
+            resp = self._request('POST', '{0}/config/networkdevice'.format(self.url_base),
+                                 data=json.dumps({'NetworkDevice': device}))
+            if resp.status_code == 201:
+                self._cache_created('networkdevice', name, resp)
+                outcome['success'] = True
+                outcome['response'] = '{0} Added Successfully'.format(name)
+            else:
+                outcome['response'] = ERS._ers_error(resp)
+                outcome['error'] = resp.status_code
+            return outcome
+
+        try:
+            rows = ERS._read_inventory(inventory) if isinstance(inventory, str) else inventory
+            items = []
+            names, seen = set(), set()
+            for number, row in enumerate(rows, 1):
+                name = str(row.get('name') or 'row {0}'.format(number))
+                device, error = ERS._check_device(row, groups, names, seen)
+                # A name is taken by its first row, valid or not, so later rows by that name are
+                # rejected as duplicates and keep their own outcome
+                if row.get('name'):
+                    names.add(str(row['name']))
+                if name in addresses:
+                    name = '{0} (row {1})'.format(name, number)
+                addresses[name] = str(row.get('ip_address', ''))
+                if device is None:
+                    record(name, {'success': False, 'response': error, 'error': 'invalid'})
+                else:
+                    items.append((name, device))
+
+            if bulk:
+                for name, outcome in self._bulk('networkdevice', 'NetworkDeviceBulkRequest', 'create', items, 'name',
+                                                workers, batch_size, poll_interval, poll_timeout, progress).items():
+                    record(name, outcome)
+            else:
+                with self.batch(workers=workers, progress=progress) as batch:
+                    index = {batch.submit(add, name, device): name for name, device in items}
+                    for i, outcome in batch.results():
+                        record(index[i], outcome)
+        finally:
+            if out:
+                out.close()
+
+        result['response'] = outcomes
+        result['success'] = all(i['success'] for i in outcomes.values())
+        if not result['success']:
+            result['error'] = '{0} of {1} devices failed'.format(
+                    sum(1 for i in outcomes.values() if not i['success']), len(outcomes))
+        return result
+
+class EndpointMirror(object):
+    def __init__(self, ers, path=':memory:', workers=4):
+        """
+        Local SQLite mirror of endpoints, endpoint identity groups and network devices, so
+        lookups by MAC, group or name don't have to go to the PAN
+        :param ers: ERS instance to sync from
+        :param path: SQLite database file, in memory by default
+        :param workers: Number of pages to fetch concurrently while syncing
+        """
+        self.ers = ers
+        self.workers = workers
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._stop = None
+        # Background updates failed in a row, and the error of the last one
+        self.failures = 0
+        self.last_error = None
+
+        with self._lock, self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS endpoint_groups (id TEXT PRIMARY KEY, name TEXT, description TEXT, seen INTEGER);
+                CREATE INDEX IF NOT EXISTS endpoint_groups_name ON endpoint_groups (name);
+                CREATE TABLE IF NOT EXISTS endpoints (id TEXT PRIMARY KEY, mac TEXT, group_id TEXT, seen INTEGER);
+                CREATE INDEX IF NOT EXISTS endpoints_mac ON endpoints (mac);
+                CREATE INDEX IF NOT EXISTS endpoints_group_id ON endpoints (group_id);
+                CREATE TABLE IF NOT EXISTS devices (id TEXT PRIMARY KEY, name TEXT, seen INTEGER);
+                CREATE INDEX IF NOT EXISTS devices_name ON devices (name);
+                CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value REAL);
+            """)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def _state(self, key):
+        rows = self._query('SELECT value FROM sync_state WHERE key = ?', (key,))
+        return rows[0][0] if rows else None
+
+    def _set_state(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', (key, value))
+
+    def _total(self, url):
+        # A one row page is the cheapest way to learn how many rows a listing has
+        return int(self.ers._get_page('{0}{1}size=1'.format(url, '&' if '?' in url else '?'))['total'])
+
+    def _sync_listing(self, table, url, columns, stamp, scope=None, checkpoint=False):
+        """
+        Upsert every row of a paged listing, then drop the rows that were not seen
+        :param table: Table to sync
+        :param url: Listing URL
+        :param columns: Function turning a resource into the row values after its id
+        :param stamp: Generation of this sync
+        :param scope: Optional (column, value) limiting the rows dropped afterwards
+        :param checkpoint: Record the last page stored in sync_state and continue from there
+        :return: Number of rows synced
+        """
+        key = 'page:' + url
+        start = int(self._state(key) or 1) if checkpoint else 1
+
+        # -1 marks a listing an interrupted sync already finished
+        if start != -1:
+            for page, json_res in enumerate(self.ers._iter_pages(url, workers=self.workers, start_page=start), start):
+                rows = [(i['id'],) + columns(i) + (stamp,) for i in json_res['resources']]
+                with self._lock, self.db:
+                    if rows:
+                        self.db.executemany('INSERT OR REPLACE INTO {0} VALUES ({1})'.format(
+                                table, ', '.join('?' * len(rows[0]))), rows)
+                    if checkpoint:
+                        # Resume on this page rather than the next, a delete meanwhile shifts rows back
+                        self._set_state(key, page)
+
+            with self._lock, self.db:
+                if scope is None:
+                    self.db.execute('DELETE FROM {0} WHERE seen < ?'.format(table), (stamp,))
+                else:
+                    self.db.execute('DELETE FROM {0} WHERE seen < ? AND {1} = ?'.format(table, scope[0]),
+                                    (stamp, scope[1]))
+                if checkpoint:
+                    self._set_state(key, -1)
+
+        if scope is None:
+            return self._query('SELECT COUNT(*) FROM {0} WHERE seen >= ?'.format(table), (stamp,))[0][0]
+        return self._query('SELECT COUNT(*) FROM {0} WHERE seen >= ? AND {1} = ?'.format(table, scope[0]),
+                           (stamp, scope[1]))[0][0]
+
+    def sync(self):
+        """
+        Full sync of endpoint groups, their endpoints and network devices. Progress is kept in
+        sync_state page by page, so after a failure calling sync() again carries on where the
+        last run stopped instead of starting over.
+        :return: Dictionary of row counts per table
+        """
+        stamp = self._state('sync_started')
+        if stamp is None:
+            stamp = time.time()
+            with self._lock, self.db:
+                self._set_state('sync_started', stamp)
+
+        base = self.ers.url_base
+        counts = {'endpoint_groups': self._sync_listing(
+                'endpoint_groups', '{0}/config/endpointgroup?sortasc=name'.format(base),
+                lambda i: (i['name'], i.get('description', '')), stamp, checkpoint=True)}
+
+        counts['endpoints'] = 0
+        for (group_id,) in self._query('SELECT id FROM endpoint_groups ORDER BY name'):
+            counts['endpoints'] += self._sync_group(group_id, stamp, checkpoint=True)
+        with self._lock, self.db:
+            self.db.execute('DELETE FROM endpoints WHERE seen < ?', (stamp,))
+
+        counts['devices'] = self._sync_listing('devices', '{0}/config/networkdevice?sortasc=name'.format(base),
+                                               lambda i: (i['name'],), stamp, checkpoint=True)
+
+        with self._lock, self.db:
+            self._set_state('full_sync', stamp)
+            self._set_state('refreshed', stamp)
+            self.db.execute("DELETE FROM sync_state WHERE key = 'sync_started' OR key LIKE 'page:%'")
+        return counts
+
+    def _sync_group(self, group_id, stamp, checkpoint=False):
+        url = '{0}/config/endpoint?filter=groupId.EQ.{1}&sortasc=name'.format(self.ers.url_base, group_id)
+        return self._sync_listing('endpoints', url, lambda i: (i['name'].upper(), group_id), stamp,
+                                  scope=('group_id', group_id), checkpoint=checkpoint)
+
+    def refresh(self):
+        """
+        Incremental refresh. ERS has no change feed, so this re-reads the group and device
+        listings and checks each group's endpoint total with a one row page, re-syncing only
+        the groups whose count changed. A move that leaves both counts unchanged is only
+        picked up by the next full sync().
+        :return: List of OIDs of the endpoint groups that were re-synced
+        """
+        if self._state('full_sync') is None:
+            self.sync()
+            return [group_id for (group_id,) in self._query('SELECT id FROM endpoint_groups')]
+
+        stamp = time.time()
+        base = self.ers.url_base
+        self._sync_listing('endpoint_groups', '{0}/config/endpointgroup'.format(base),
+                           lambda i: (i['name'], i.get('description', '')), stamp)
+
+        changed = []
+        for (group_id,) in self._query('SELECT id FROM endpoint_groups'):
+            total = self._total('{0}/config/endpoint?filter=groupId.EQ.{1}'.format(base, group_id))
+            local = self._query('SELECT COUNT(*) FROM endpoints WHERE group_id = ?', (group_id,))[0][0]
+            if total != local:
+                self._sync_group(group_id, stamp)
+                changed.append(group_id)
+
+        if self._total('{0}/config/networkdevice'.format(base)) != self._query('SELECT COUNT(*) FROM devices')[0][0]:
+            self._sync_listing('devices', '{0}/config/networkdevice'.format(base), lambda i: (i['name'],), stamp)
+
+        with self._lock, self.db:
+            # Endpoints of groups that no longer exist
+            self.db.execute('DELETE FROM endpoints WHERE group_id NOT IN (SELECT id FROM endpoint_groups)')
+            self._set_state('refreshed', stamp)
+        return changed
+
+    def start(self, interval=300, full_every=12):
+        """
+        Keep the mirror up to date from a background thread
+        :param interval: Seconds between incremental refreshes
+        :param full_every: Run a full sync instead of every this many refreshes, 0 never
+        """
+        self.stop()
+        self._stop = stop = threading.Event()
+
+        def run():
+            runs = 0
+            while not stop.is_set():
+                try:
+                    if full_every and runs and runs % full_every == 0:
+                        self.sync()
+                    else:
+                        self.refresh()
+                except Exception as e:
+                    # Whatever went wrong, keep the thread alive and serve the last good data,
+                    # freshness() shows how old it is and why the update failed
+                    log.exception('Endpoint mirror update failed')
+                    self.failures += 1
+                    self.last_error = '{0}: {1}'.format(type(e).__name__, e)
+                else:
+                    self.failures = 0
+                    self.last_error = None
+                runs += 1
+                stop.wait(interval)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def stop(self):
+        """
+        Stop the background refresh
+        """
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+    def freshness(self):
+        """
+        How up to date the mirror is
+        :return: Dictionary with the full_sync and refreshed timestamps, the age in seconds (None if never synced),
+                 and the number of background updates failed in a row with the error of the last one
+        """
+        refreshed = self._state('refreshed')
+        return {'full_sync': self._state('full_sync'), 'refreshed': refreshed,
+                'age': time.time() - refreshed if refreshed is not None else None,
+                'failures': self.failures, 'error': self.last_error}
+
+    def is_stale(self, max_age):
+        """
+        Test whether the mirror is older than max_age seconds, or was never synced
+        :return: True/False
+        """
+        age = self.freshness()['age']
+        return age is None or age > max_age
+
+    def get_endpoint(self, mac):
+        """
+        Look up an endpoint by MAC
+        :return: Dictionary of mac, id, group and group_id, None if not found
+        """
+        rows = self._query('SELECT e.mac, e.id, g.name, e.group_id FROM endpoints e '
+                           'LEFT JOIN endpoint_groups g ON g.id = e.group_id WHERE e.mac = ?',
+                           (ERS.normalize_mac(mac) or mac.upper(),))
+        return dict(zip(('mac', 'id', 'group', 'group_id'), rows[0])) if rows else None
+
+    def get_endpoint_group_of(self, mac):
+        """
+        Name of the endpoint identity group a MAC is in
+        :return: Group name, None if the MAC is not known
+        """
+        endpoint = self.get_endpoint(mac)
+        return endpoint['group'] if endpoint else None
+
+    def get_endpoints_in_group(self, group):
+        """
+        MACs of all endpoints in an endpoint identity group
+        :param group: Name of the group
+        :return: List of MACs
+        """
+        return [mac for (mac,) in self._query(
+                'SELECT e.mac FROM endpoints e JOIN endpoint_groups g ON g.id = e.group_id WHERE g.name = ? '
+                'ORDER BY e.mac', (group,))]
+
+    def get_endpoint_group_id(self, group):
+        """
+        OID of an endpoint identity group
+        :return: OID, None if not found
+        """
+        rows = self._query('SELECT id FROM endpoint_groups WHERE name = ?', (group,))
+        return rows[0][0] if rows else None
+
+    def get_device_id(self, device):
+        """
+        OID of a network device
+        :return: OID, None if not found
+        """
+        rows = self._query('SELECT id FROM devices WHERE name = ?', (device,))
+        return rows[0][0] if rows else None
+
+
+class AsyncERS(object):
+    max_page_size = 100
+
+    def __init__(self, ise_node, ers_user, ers_pass, verify=False, timeout=2, limit=100, limit_per_host=0,
+                 url_base=None, hooks=None, json_backend=None, coalesce=True):
+        """
+        Class to interact with Cisco ISE via the ERS API from asyncio code. Offers the
+        same resource methods as ERS as coroutines, sharing one aiohttp connection pool.
+        Requires aiohttp.
+        :param ise_node: IP Address of the primary admin ISE node
+        :param ers_user: ERS username
+        :param ers_pass: ERS password
+        :param verify: Verify SSL cert
+        :param timeout: Query timeout
+        :param limit: Maximum number of simultaneous connections
+        :param limit_per_host: Maximum number of simultaneous connections per node, 0 for no limit
+        :param url_base: ERS base URL, defaults to https://ise_node:9060/ers
+        :param json_backend: JSON library decoding responses (msgspec, orjson or json), the fastest installed if None
+        :param hooks: Callables passed a RequestRecord after every request
+        :param coalesce: Share one in flight GET between coroutines asking for the same URL at the same time
+        """
+        if aiohttp is None:
+            raise ImportError('AsyncERS requires aiohttp, install it with "pip install aiohttp"')
+
+        self.ise_node = ise_node
+        self.user_name = ers_user
+        self.user_pass = ers_pass
+
+        self.url_base = url_base or 'https://{0}:9060/ers'.format(self.ise_node)
+        self.verify = verify
+        self.timeout = timeout
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.decoder = JSONDecoder(json_backend)
+        self.hooks = list(hooks or [])
+        self.coalesce = coalesce
+        self._in_flight = {}
+        self.ise = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """
+        Close the underlying session and its connections
+        """
+        if self.ise is not None:
+            await self.ise.close()
+            self.ise = None
+
+    def _session(self):
+        # The session has to be created inside the running event loop
+        if self.ise is None:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                             ssl=None if self.verify else False)
+            self.ise = aiohttp.ClientSession(
+                connector=connector,
+                headers={'ACCEPT': 'application/json', 'Content-Type': 'application/json',
+                         'Authorization': 'Basic {0}'.format(base64.b64encode('{0}:{1}'.format(
+                                 self.user_name, self.user_pass).encode('latin-1')).decode('ascii'))},
+                # Per socket operation, a request queued for a pooled connection must not time out while it waits
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout))
+        return self.ise
+
+    async def _request(self, method, url, data=None, page=False):
+        """
+        Send a request. While a GET is in flight, identical GETs share its response instead of
+        sending their own.
+        :param page: The response is a SearchResult page, only decode the listing fields. Its page number
+                     for instrumentation when it is one of a listing, True when it is not (e.g. a filter lookup).
+        :return: Tuple of status code and decoded JSON body (None when empty)
+        """
+        if not self.coalesce or method != 'GET':
+            try:
+                return self._decode(*await self._send(method, url, data, page), page=page)
+            finally:
+                if self.coalesce and method not in ERS.read_methods:
+                    # GETs of the resource sent before the write must not answer ones sent after it
+                    resource = ERS._resource_of(url).split('/')[0]
+                    for key in [k for k in self._in_flight if ERS._resource_of(k[0]).split('/')[0] == resource]:
+                        del self._in_flight[key]
+
+        key = (url, page)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(self._send(method, url, data, page))
+
+            def done(_):
+                if self._in_flight.get(key) is task:
+                    del self._in_flight[key]
+            task.add_done_callback(done)
+        # Shielded, a caller that is cancelled must not cancel the request for the others. The raw body
+        # is shared and each caller decodes its own copy, so one changing its result can't change the others'.
+        return self._decode(*await asyncio.shield(task), page=page)
+
+    async def _send(self, method, url, data=None, page=False):
+        """
+        Send a request
+        :return: Tuple of status code and raw body
+        """
+        status = None
+        body = b''
+        error = None
+        start = time.perf_counter()
+        try:
+            async with self._session().request(method, url, data=data) as resp:
+                status = resp.status
+                body = await resp.read()
+                return status, body
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            if self.hooks:
+                self._record(method, url, data, status, body, time.perf_counter() - start, page, error)
+
+    def _decode(self, status, body, page=False):
+        """
+        Decode a response body, see _request
+        :return: Tuple of status code and decoded JSON body (None when empty)
+        """
+        if not body:
+            return status, None
+        if page and status == 200:
+            return status, self.decoder.decode_page(body)
+        try:
+            return status, self.decoder.decode(body)
+        except self.decoder.errors:
+            if status < 400:
+                raise
+            # An HTML error page from a proxy or the node itself, _error falls back to the reason
+            return status, None
+
+    def _record(self, method, url, data, status, body, latency, page, error):
+        """
+        Pass a RequestRecord to the instrumentation hooks, see ERS._record
+        """
+        record = RequestRecord(method=method, resource=ERS._resource_of(url), url=url,
+                               status_code=status if error is None else None, latency=latency,
+                               bytes_sent=ERS._body_size(data), bytes_received=len(body), retries=0,
+                               page=None if page is True else page or None, error=error)
+        for hook in self.hooks:
+            hook(record)
+
+    def add_hook(self, hook):
+        """
+        Register an instrumentation hook
+        :param hook: Callable called with a RequestRecord after every HTTP call, e.g. a MetricsAggregator
+        """
+        self.hooks.append(hook)
+
+    @staticmethod
+    def _error(status, body):
+        try:
+            return body['ERSResponse']['messages'][0]['title']
+        except (TypeError, KeyError, IndexError):
+            try:
+                return http.HTTPStatus(status).phrase
+            except ValueError:
+                return 'Unknown error'
+
+    async def _list(self, path, fields):
+        """
+        Get the first page of a listing
+        :param path: Resource path below the ERS base URL
+        :param fields: Resource fields to return for each row
+        :return: result dictionary
         """
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
-
         result = {
             'success': False,
             'response': '',
             'error': '',
         }
 
-        resp = self.ise.get('{0}/config/internaluser?filter=name.EQ.{1}'.format(self.url_base, user_id))
-        found_user = resp.json()
-
-        if found_user['SearchResult']['total'] == 1:
-            user_oid = found_user['SearchResult']['resources'][0]['id']
-            resp = self.ise.delete('{0}/config/internaluser/{1}'.format(self.url_base, user_oid), timeout=self.timeout)
+        status, body = await self._request('GET', '{0}/{1}'.format(self.url_base, path), page=1)
 
-            if resp.status_code == 204:
-                result['success'] = True
-                result['response'] = '{0} Deleted Successfully'.format(user_id)
-                return result
-            elif resp.status_code == 404:
-                result['response'] = '{0} not found'.format(user_id)
-                result['error'] = resp.status_code
-                return result
-            else:
-                result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-                result['error'] = resp.status_code
-                return result
-        elif found_user['SearchResult']['total'] == 0:
-            result['response'] = '{0} not found'.format(user_id)
-            result['error'] = 404
+        if status == 200:
+            result['success'] = True
+            result['response'] = [tuple(i[f] for f in fields) for i in body['SearchResult']['resources']]
             return result
         else:
-            result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-            result['error'] = resp.status_code
+            result['response'] = AsyncERS._error(status, body)
+            result['error'] = status
             return result
 
-    def get_device_groups(self):
+    async def _find(self, resource, field, value):
         """
-        Get a list tuples of device groups
-        :return:
+        Look up the OID of a resource by filter
+        :return: Tuple of status code and OID (None if not found)
+        """
+        status, body = await self._request('GET', '{0}/config/{1}?filter={2}.EQ.{3}'.format(
+                self.url_base, resource, field, value), page=True)
+
+        if status == 200 and body['SearchResult']['total'] == 1:
+            return status, body['SearchResult']['resources'][0]['id']
+        return status, None
+
+    async def _detail(self, resource, oid, key, name):
+        """
+        Get the details of a resource by OID
+        :return: result dictionary
         """
         result = {
             'success': False,
@@ -685,140 +3622,327 @@ class ERS(object):
             'error': '',
         }
 
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
+        status, body = await self._request('GET', '{0}/config/{1}/{2}'.format(self.url_base, resource, oid))
 
-        resp = self.ise.get('{0}/config/networkdevicegroup'.format(self.url_base))
-
-        if resp.status_code == 200:
+        if status == 200:
             result['success'] = True
-            result['response'] = [(i['name'], i['id'])
-                                  for i in resp.json()['SearchResult']['resources']]
+            result['response'] = body[key]
+            return result
+        elif status == 404:
+            result['response'] = '{0} not found'.format(name)
+            result['error'] = status
             return result
         else:
-            result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-            result['error'] = resp.status_code
+            result['response'] = AsyncERS._error(status, body)
+            result['error'] = status
             return result
 
-    def get_device_group(self, device_group_oid):
+    async def _detail_by_name(self, resource, field, name, key):
         """
-        Get a device group details
-        :param device_group_oid: oid of the device group
+        Look up a resource by filter and get its details
         :return: result dictionary
         """
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
+        status, oid = await self._find(resource, field, name)
 
-        resp = self.ise.get('{0}/config/networkdevicegroup/{1}'.format(self.url_base, device_group_oid))
+        if oid is None:
+            return {'success': False, 'response': '{0} not found'.format(name), 'error': 404 if status == 200 else status}
+        return await self._detail(resource, oid, key, name)
 
+    async def _add(self, resource, data, name):
+        """
+        Create a resource
+        :return: result dictionary
+        """
         result = {
             'success': False,
             'response': '',
             'error': '',
         }
 
-        if resp.status_code == 200:
+        status, body = await self._request('POST', '{0}/config/{1}'.format(self.url_base, resource),
+                                           data=json.dumps(data))
+        if status == 201:
             result['success'] = True
-            result['response'] = resp.json()['NetworkDeviceGroup']
-            return result
-        elif resp.status_code == 404:
-            result['response'] = '{0} not found'.format(device_group_oid)
-            result['error'] = resp.status_code
+            result['response'] = '{0} Added Successfully'.format(name)
             return result
         else:
-            result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-            result['error'] = resp.status_code
+            result['response'] = AsyncERS._error(status, body)
+            result['error'] = status
             return result
 
-    def get_devices(self):
+    async def _delete_by_name(self, resource, field, name):
         """
-        Get a list of devices
+        Look up a resource by filter and delete it
         :return: result dictionary
         """
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
-
-        resp = self.ise.get('{0}/config/networkdevice'.format(self.url_base))
-
         result = {
             'success': False,
             'response': '',
             'error': '',
         }
 
-        json_res = resp.json()['SearchResult']
-
-        if resp.status_code == 200 and int(json_res['total']) > 1:
-            result['success'] = True
-            result['response'] = [(i['name'], i['id'])
-                                  for i in json_res['resources']]
+        status, oid = await self._find(resource, field, name)
+        if oid is None:
+            result['response'] = '{0} not found'.format(name)
+            result['error'] = 404 if status == 200 else status
             return result
 
-        elif resp.status_code == 200 and int(json_res['total']) == 1:
+        status, body = await self._request('DELETE', '{0}/config/{1}/{2}'.format(self.url_base, resource, oid))
+        if status == 204:
             result['success'] = True
-            result['response'] = [(json_res['resources'][0]['name'],
-                                   json_res['resources'][0]['id'])]
+            result['response'] = '{0} Deleted Successfully'.format(name)
             return result
-
-        elif resp.status_code == 200 and int(json_res['total']) == 0:
-            result['success'] = True
-            result['response'] = []
+        elif status == 404:
+            result['response'] = '{0} not found'.format(name)
+            result['error'] = status
             return result
-
         else:
-            result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-            result['error'] = resp.status_code
+            result['response'] = AsyncERS._error(status, body)
+            result['error'] = status
             return result
 
-    def get_device(self, device):
+    async def _get_page(self, url, page):
+        status, body = await self._request('GET', url, page=page)
+        if status != 200:
+            raise ERSError(AsyncERS._error(status, body), status)
+        return body['SearchResult']
+
+    async def _iter_pages(self, url, page_size=None, workers=1):
         """
-        Get device detailed info
-        :param device: User ID
+        Iterate over all pages of a SearchResult listing in page order
+        :param url: URL of the listing, optionally with a filter but without size or page parameters
+        :param page_size: Rows per page, capped at the ERS maximum of 100
+        :param workers: Number of pages to fetch concurrently once the total is known
+        :return: Async generator of SearchResult dictionaries, one per page
+        """
+        page_size = min(page_size or self.max_page_size, self.max_page_size)
+        url = '{0}{1}size={2}'.format(url, '&' if '?' in url else '?', page_size)
+
+        json_res = await self._get_page(url, 1)
+        yield json_res
+
+        if workers <= 1:
+            page = 1
+            while 'nextPage' in json_res:
+                page += 1
+                json_res = await self._get_page(json_res['nextPage']['href'], page)
+                yield json_res
+            return
+
+        last_page = -(-int(json_res['total']) // page_size)
+        in_flight = deque()
+        try:
+            for page in range(2, last_page + 1):
+                in_flight.append(asyncio.ensure_future(self._get_page('{0}&page={1}'.format(url, page), page)))
+                if len(in_flight) >= workers:
+                    yield await in_flight.popleft()
+            while in_flight:
+                yield await in_flight.popleft()
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    async def get_endpoint_groups(self):
+        """
+        Get all endpoint identity groups
         :return: result dictionary
         """
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
+        return await self._list('config/endpointgroup', ('name', 'id', 'description'))
 
-        result = {
-            'success': False,
-            'response': '',
-            'error': '',
-        }
+    async def get_endpoint_group(self, group):
+        """
+        Get endpoint identity group details
+        :param group: Name of the identity group
+        :return: result dictionary
+        """
+        return await self._detail_by_name('endpointgroup', 'name', group, 'EndPointGroup')
 
-        resp = self.ise.get('{0}/config/networkdevice?filter=name.EQ.{1}'.format(self.url_base, device))
-        found_device = resp.json()
+    async def get_endpoint_group_id(self, group):
+        """
+        Get endpoint identity group OID
+        :param group: Name of the identity group
+        :return: result dictionary
+        """
+        status, oid = await self._find('endpointgroup', 'name', group)
 
-        if found_device['SearchResult']['total'] == 1:
-            resp = self.ise.get('{0}/config/networkdevice/{1}'.format(
-                    self.url_base, found_device['SearchResult']['resources'][0]['id']))
-            if resp.status_code == 200:
-                result['success'] = True
-                result['response'] = resp.json()['NetworkDevice']
-                return result
-            elif resp.status_code == 404:
-                result['response'] = '{0} not found'.format(device)
-                result['error'] = resp.status_code
-                return result
-            else:
-                result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-                result['error'] = resp.status_code
-                return result
-        elif found_device['SearchResult']['total'] == 0:
-                result['response'] = '{0} not found'.format(device)
-                result['error'] = 404
-                return result
-        else:
-            result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-            result['error'] = resp.status_code
-            return result
+        if oid is None:
+            return {'success': False, 'response': '{0} not found'.format(group), 'error': 404 if status == 200 else status}
+        return {'success': True, 'response': oid, 'error': ''}
 
-    def add_device(self,
-                   name,
-                   ip_address,
-                   radius_key,
-                   snmp_ro,
-                   dev_group,
-                   dev_location,
-                   dev_type,
-                   description='',
-                   snmp_v='TWO_C',
-                   dev_profile='Cisco'):
+    async def get_endpoints(self):
+        """
+        Get all endpoints
+        :return: result dictionary
+        """
+        return await self._list('config/endpoint', ('name', 'id'))
+
+    async def get_endpoint(self, mac_address):
+        """
+        Get endpoint details
+        :param mac_address: MAC address of the endpoint
+        :return: result dictionary
+        """
+        canonical = ERS.normalize_mac(mac_address)
+        if canonical is None:
+            raise InvalidMacAddress('{0}. Must be in the form of AA:BB:CC:00:11:22'.format(mac_address))
+
+        return await self._detail_by_name('endpoint', 'mac', canonical, 'ERSEndPoint')
+
+    async def iter_endpoints_in_group(self, group_id, page_size=None, workers=1):
+        """
+        Iterate over all endpoints in an endpoint identity group, following the pagination on its own
+        :param group_id: OID of the endpoint identity group
+        :param page_size: Rows per page, defaults to (and is capped at) the ERS maximum of 100
+        :param workers: Number of pages to fetch concurrently
+        :return: Async generator of endpoint MAC addresses
+        """
+        url = '{0}/config/endpoint?filter=groupId.EQ.{1}'.format(self.url_base, group_id)
+        async for json_res in self._iter_pages(url, page_size, workers):
+            for i in json_res['resources']:
+                yield i['name']
+
+    async def add_endpoint(self,
+                           name,
+                           mac,
+                           group_id,
+                           static_profile_assigment='false',
+                           static_group_assignment='true',
+                           profile_id='',
+                           description=''):
+        """
+        Add an endpoint
+        :param name: Name
+        :param mac: Macaddress
+        :param group_id: OID of group to add endpoint in
+        :param static_profile_assigment: Set static profile
+        :param static_group_assignment: Set static group
+        :param profile_id: OID of profile
+        :param description: Endpoint description
+        :return: result dictionary
+        """
+        canonical = ERS.normalize_mac(mac)
+        if canonical is None:
+            raise InvalidMacAddress('{0}. Must be in the form of AA:BB:CC:00:11:22'.format(mac))
+
+        data = ERS._endpoint_data(name, canonical, group_id, static_profile_assigment, static_group_assignment,
+                                  profile_id, description)
+        return await self._add('endpoint', data, name)
+
+    async def delete_endpoint(self, mac):
+        """
+        Delete an endpoint
+        :param mac: Endpoint Macaddress
+        :return: Result dictionary
+        """
+        canonical = ERS.normalize_mac(mac)
+        if canonical is None:
+            raise InvalidMacAddress('{0}. Must be in the form of AA:BB:CC:00:11:22'.format(mac))
+
+        return await self._delete_by_name('endpoint', 'mac', canonical)
+
+    async def get_identity_groups(self):
+        """
+        Get all identity groups
+        :return: result dictionary
+        """
+        return await self._list('config/identitygroup', ('name', 'id', 'description'))
+
+    async def get_identity_group(self, group):
+        """
+        Get identity group details
+        :param group: Name of the identity group
+        :return: result dictionary
+        """
+        return await self._detail_by_name('identitygroup', 'name', group, 'IdentityGroup')
+
+    async def get_users(self):
+        """
+        Get all internal users
+        :return: result dictionary
+        """
+        return await self._list('config/internaluser', ('name', 'id'))
+
+    async def get_user(self, user_id):
+        """
+        Get user detailed info
+        :param user_id: User ID
+        :return: result dictionary
+        """
+        return await self._detail_by_name('internaluser', 'name', user_id, 'InternalUser')
+
+    async def add_user(self,
+                       user_id,
+                       password,
+                       user_group_oid,
+                       enable='',
+                       first_name='',
+                       last_name='',
+                       email='',
+                       description=''):
+        """
+        Add a user to the local user store
+        :param user_id: User ID
+        :param password: User password
+        :param user_group_oid: OID of group to add user to
+        :param enable: Enable password used for Tacacs
+        :param first_name: First name
+        :param last_name: Last name
+        :param email: email address
+        :param description: User description
+        :return: result dictionary
+        """
+        data = ERS._user_data(user_id, password, user_group_oid, enable, first_name, last_name, email, description)
+        return await self._add('internaluser', data, user_id)
+
+    async def delete_user(self, user_id):
+        """
+        Delete a user
+        :param user_id: User ID
+        :return: Result dictionary
+        """
+        return await self._delete_by_name('internaluser', 'name', user_id)
+
+    async def get_device_groups(self):
+        """
+        Get a list tuples of device groups
+        :return: result dictionary
+        """
+        return await self._list('config/networkdevicegroup', ('name', 'id'))
+
+    async def get_device_group(self, device_group_oid):
+        """
+        Get a device group details
+        :param device_group_oid: oid of the device group
+        :return: result dictionary
+        """
+        return await self._detail('networkdevicegroup', device_group_oid, 'NetworkDeviceGroup', device_group_oid)
+
+    async def get_devices(self):
+        """
+        Get a list of devices
+        :return: result dictionary
+        """
+        return await self._list('config/networkdevice', ('name', 'id'))
+
+    async def get_device(self, device):
+        """
+        Get device detailed info
+        :param device: Device name
+        :return: result dictionary
+        """
+        return await self._detail_by_name('networkdevice', 'name', device, 'NetworkDevice')
+
+    async def add_device(self,
+                         name,
+                         ip_address,
+                         radius_key,
+                         snmp_ro,
+                         dev_group,
+                         dev_location,
+                         dev_type,
+                         description='',
+                         snmp_v='TWO_C',
+                         dev_profile='Cisco'):
         """
         Add a device
         :param name: name of device
@@ -832,88 +3956,14 @@ class ERS(object):
         :param dev_profile: Device profile
         :return: Result dictionary
         """
-        result = {
-            'success': False,
-            'response': '',
-            'error': '',
-        }
-
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
-
-
-        data = { 'NetworkDevice' : { 'name': name,
-                    'description': description,
-                    'authenticationSettings' : {
-                        'networkProtocol': 'RADIUS',
-                        'radiusSharedSecret': radius_key,
-                        'enableKeyWrap' : 'false',
-                    },
-                    'snmpsettings' : {
-                        'version': 'TWO_C',
-                        'roCommunity': snmp_ro,
-                        'pollingInterval': 3600,
-                        'linkTrapQuery': 'true',
-                        'macTrapQuery': 'true',
-                        'originatingPolicyServicesNode': 'Auto'
-                    },
-                    'profileName': dev_profile,
-                    'coaPort': 1700,
-                    'NetworkDeviceIPList': [ {
-                        'ipaddress': ip_address,
-                        'mask': 32
-                    } ],
-                    'NetworkDeviceGroupList': [dev_group, dev_type, dev_location, 'IPSEC#Is IPSEC Device#No']
-                    }
-                }
-
-        resp = self.ise.post('{0}/config/networkdevice'.format(self.url_base), data=json.dumps(data), timeout=self.timeout)
-
-        if resp.status_code == 201:
-            result['success'] = True
-            result['response'] = '{0} Added Successfully'.format(name)
-            return result
-        else:
-            result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-            result['error'] = resp.status_code
-            return result
+        data = ERS._device_data(name, ip_address, radius_key, snmp_ro, dev_group, dev_location, dev_type,
+                                description, snmp_v, dev_profile)
+        return await self._add('networkdevice', data, name)
 
-    def delete_device(self, device):
+    async def delete_device(self, device):
         """
         Delete a device
-        :param device: Device ID
+        :param device: Device name
         :return: Result dictionary
         """
-        self.ise.headers.update({'ACCEPT':'application/json', 'Content-Type':'application/json'})
-
-        result = {
-            'success': False,
-            'response': '',
-            'error': '',
-        }
-
-        resp = self.ise.get('{0}/config/networkdevice?filter=name.EQ.{1}'.format(self.url_base, device))
-        found_device = resp.json()
-        if found_device['SearchResult']['total'] == 1:
-            device_oid = found_device['SearchResult']['resources'][0]['id']
-            resp = self.ise.delete('{0}/config/networkdevice/{1}'.format(self.url_base, device_oid), timeout=self.timeout)
-
-            if resp.status_code == 204:
-                result['success'] = True
-                result['response'] = '{0} Deleted Successfully'.format(device)
-                return result
-            elif resp.status_code == 404:
-                result['response'] = '{0} not found'.format(device)
-                result['error'] = resp.status_code
-                return result
-            else:
-                result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-                result['error'] = resp.status_code
-                return result
-        elif found_device['SearchResult']['total'] == 0:
-                result['response'] = '{0} not found'.format(device)
-                result['error'] = 404
-                return result
-        else:
-            result['response'] = resp.json()['ERSResponse']['messages'][0]['title']
-            result['error'] = resp.status_code
-            return result
+        return await self._delete_by_name('networkdevice', 'name', device)
@@ -0,0 +1,109 @@
+"""
+Throughput benchmarks against the fake ERS server
+
+Run with pytest-benchmark installed for full statistics:
+    python -m pytest test/bench_ers.py
+Without it every benchmark runs once and prints endpoints/sec. Set BENCH_SIZES to
+limit the record counts, e.g. BENCH_SIZES=1000.
+"""
+import asyncio
+import os
+import time
+
+import pytest
+
+from cream import ERS, AsyncERS, aiohttp
+from fake_ers import FakeERS
+
+SIZES = [int(i) for i in os.environ.get('BENCH_SIZES', '1000,20000,100000').split(',')]
+# Single-request operations are measured on a sample, a 100k serial run proves nothing new
+SAMPLE = 1000
+WORKERS = 8
+
+try:
+    import pytest_benchmark  # noqa: F401
+except ImportError:
+    @pytest.fixture
+    def benchmark(request):
+        def run(func, *args, **kwargs):
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            run.elapsed = time.perf_counter() - start
+            return result
+
+        run.extra_info = {}
+        yield run
+        if 'endpoints' in run.extra_info:
+            print('\n{0}: {1:.0f} endpoints/sec'.format(request.node.name,
+                                                       run.extra_info['endpoints'] / run.elapsed))
+
+
+@pytest.fixture(scope='module', params=SIZES)
+def fake(request):
+    with FakeERS() as server:
+        server.group_ids = server.populate(request.param)
+        server.size = request.param
+        yield server
+
+
+@pytest.fixture
+def ise(fake):
+    return ERS('ise_node', 'ers_user', 'ers_pass', url_base=fake.url_base)
+
+
+@pytest.mark.parametrize('workers', [1, WORKERS], ids=['serial', 'threaded'])
+def test_export(benchmark, fake, ise, workers):
+    count = benchmark(lambda: sum(1 for _ in ise.iter_endpoints(workers=workers)))
+
+    assert count == fake.size
+    benchmark.extra_info['endpoints'] = count
+
+
+@pytest.mark.skipif(aiohttp is None, reason='aiohttp is not installed')
+def test_export_async(benchmark, fake):
+    async def export():
+        async with AsyncERS('ise_node', 'ers_user', 'ers_pass', url_base=fake.url_base, timeout=30) as ise:
+            url = '{0}/config/endpoint'.format(ise.url_base)
+            return sum([len(page['resources']) async for page in ise._iter_pages(url, workers=WORKERS)])
+
+    count = benchmark(lambda: asyncio.new_event_loop().run_until_complete(export()))
+
+    assert count == fake.size
+    benchmark.extra_info['endpoints'] = count
+
+
+def test_lookup(benchmark, fake, ise):
+    macs = [mac for (mac, _), _ in zip(ise.iter_endpoints(), range(SAMPLE))]
+
+    def lookup():
+        ise.id_cache.invalidate()
+        return sum(1 for mac in macs if ise.get_endpoint(mac)['success'])
+
+    assert benchmark(lookup) == len(macs)
+    benchmark.extra_info['endpoints'] = len(macs)
+
+
+def test_add_delete(benchmark, fake, ise):
+    macs = ['AA:CC:00:{0:02X}:{1:02X}:{2:02X}'.format(i >> 16 & 0xFF, i >> 8 & 0xFF, i & 0xFF)
+            for i in range(min(fake.size, SAMPLE))]
+
+    def add_delete():
+        for mac in macs:
+            ise.add_endpoint(mac, mac, fake.group_ids[0])
+        for mac in macs:
+            ise.delete_endpoint(mac)
+
+    benchmark(add_delete)
+    benchmark.extra_info['endpoints'] = len(macs) * 2
+
+
+def test_bulk_add_delete(benchmark, fake, ise):
+    macs = ['AA:DD:00:{0:02X}:{1:02X}:{2:02X}'.format(i >> 16 & 0xFF, i >> 8 & 0xFF, i & 0xFF)
+            for i in range(fake.size)]
+
+    def bulk_add_delete():
+        ise.bulk_add_endpoints(macs, group_id=fake.group_ids[0], workers=WORKERS, poll_interval=0.01)
+        ise.bulk_delete_endpoints(macs, workers=WORKERS, poll_interval=0.01)
+
+    benchmark(bulk_add_delete)
+    benchmark.extra_info['endpoints'] = len(macs) * 2
@@ -0,0 +1,308 @@
+"""
+In-process fake of the ISE ERS API for tests and benchmarks
+"""
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+# ERS resource type -> root key of its detail document
+ROOT_KEYS = {
+    'endpoint': 'ERSEndPoint',
+    'endpointgroup': 'EndPointGroup',
+    'identitygroup': 'IdentityGroup',
+    'internaluser': 'InternalUser',
+    'networkdevice': 'NetworkDevice',
+    'networkdevicegroup': 'NetworkDeviceGroup',
+    'profilerprofile': 'ProfilerProfile',
+}
+
+# ERS resource type -> resourceMediaType its bulk requests must carry
+BULK_MEDIA_TYPES = {
+    'endpoint': 'vnd.com.cisco.ise.identity.endpoint.1.0+xml',
+    'internaluser': 'vnd.com.cisco.ise.identity.internaluser.1.0+xml',
+    'networkdevice': 'vnd.com.cisco.ise.network.networkdevice.1.1+xml',
+}
+
+
+class FakeERS(object):
+    def __init__(self, latency=0, error_rate=0, error_status=503, max_page_size=100, error_body=None):
+        """
+        Fake ERS server listening on a random localhost port
+        :param latency: Seconds added to every response
+        :param error_rate: Fraction of requests answered with error_status instead
+        :param error_status: Status code of injected errors
+        :param max_page_size: Largest page size served
+        :param error_body: Raw body of injected errors, e.g. an HTML page, instead of an ERSResponse
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.max_page_size = max_page_size
+        self.error_body = error_body
+
+        self.resources = {resource: {} for resource in ROOT_KEYS}
+        self.names = {resource: {} for resource in ROOT_KEYS}
+        self.macs = {}
+        self.bulk_status = {}
+        self.requests = 0
+        self._lock = threading.RLock()
+        self._filters = {}
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url_base = 'http://127.0.0.1:{0}/ers'.format(self.server.server_address[1])
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add(self, resource, name, **fields):
+        """
+        Store a resource directly, bypassing HTTP
+        :return: OID of the resource
+        """
+        with self._lock:
+            oid = fields.pop('id', None) or str(uuid.uuid4())
+            self.resources[resource][oid] = dict(fields, id=oid, name=name)
+            self.names[resource][name.upper()] = oid
+            if fields.get('mac'):
+                self.macs[fields['mac'].upper()] = oid
+            self._filters.clear()
+            return oid
+
+    def remove(self, resource, oid):
+        """
+        Remove a resource directly, bypassing HTTP
+        :return: The removed resource, None if there was none
+        """
+        with self._lock:
+            row = self.resources[resource].pop(oid, None)
+            if row is not None:
+                self.names[resource].pop(row['name'].upper(), None)
+                if row.get('mac'):
+                    self.macs.pop(row['mac'].upper(), None)
+                self._filters.clear()
+            return row
+
+    def populate(self, endpoints, groups=('Blacklist', 'Profiled', 'Workstation')):
+        """
+        Fill in endpoint groups and endpoints spread evenly across them
+        :param endpoints: Number of endpoints
+        :return: List of group OIDs
+        """
+        group_ids = [self.add('endpointgroup', name, description='') for name in groups]
+        for i in range(endpoints):
+            mac = ':'.join('{0:02X}'.format(b) for b in (0xAA, 0xBB, i >> 24 & 0xFF, i >> 16 & 0xFF, i >> 8 & 0xFF, i & 0xFF))
+            self.add('endpoint', mac, mac=mac, groupId=group_ids[i % len(group_ids)], description='',
+                     staticGroupAssignment=True)
+        return group_ids
+
+    def _filtered(self, resource, filters, sort=None):
+        # Cache filter results between mutations, paging through 100k rows re-filters otherwise
+        key = (resource, tuple(filters), sort)
+        with self._lock:
+            if key not in self._filters:
+                field, _, value = filters[0].split('.', 2) if len(filters) == 1 else ('', '', '')
+                if field == 'name' or (resource == 'endpoint' and field == 'mac'):
+                    oid = (self.names[resource] if field == 'name' else self.macs).get(value.upper())
+                    return [self.resources[resource][oid]] if oid else []
+
+                rows = list(self.resources[resource].values())
+                for f in filters:
+                    field, _, value = f.split('.', 2)
+                    rows = [r for r in rows if str(r.get(field, '')).upper() == value.upper()]
+                if sort:
+                    field, descending = sort
+                    rows.sort(key=lambda r: str(r.get(field, '')).upper(), reverse=descending)
+                self._filters[key] = rows
+            return self._filters[key]
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                # Headers and body go out in separate writes, don't let Nagle hold the body back
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=None, headers=None):
+                data = json.dumps(body).encode('utf-8') if body is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _raw(self, status, data):
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _error(self, status, title):
+                self._send(status, {'ERSResponse': {'messages': [{'title': title, 'type': 'ERROR'}]}})
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+
+            def _dispatch(self):
+                with fake._lock:
+                    fake.requests += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                body = self._body() if self.command in ('POST', 'PUT') else None
+                if fake.error_rate and random.random() < fake.error_rate:
+                    if fake.error_body is not None:
+                        return self._raw(fake.error_status, fake.error_body)
+                    return self._error(fake.error_status, 'Injected error')
+
+                url = urlsplit(self.path)
+                parts = [unquote(p) for p in url.path.split('/') if p]
+                if len(parts) < 3 or parts[:2] != ['ers', 'config'] or parts[2] not in ROOT_KEYS:
+                    return self._error(404, 'Resource not found')
+
+                resource, rest = parts[2], parts[3:]
+                if rest[:1] == ['bulk']:
+                    return self._bulk(resource, rest[1:], body)
+                if not rest:
+                    if self.command == 'GET':
+                        return self._search(resource, parse_qs(url.query))
+                    if self.command == 'POST':
+                        return self._create(resource, body)
+                elif len(rest) == 1:
+                    if self.command == 'GET':
+                        return self._get(resource, rest[0])
+                    if self.command == 'PUT':
+                        return self._update(resource, rest[0], body)
+                    if self.command == 'DELETE':
+                        return self._delete(resource, rest[0])
+                return self._error(405, 'Method not allowed')
+
+            do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+            def _search(self, resource, query):
+                size = min(int(query.get('size', ['20'])[0]), fake.max_page_size)
+                page = int(query.get('page', ['1'])[0])
+                sort = None
+                if 'sortasc' in query or 'sortdsc' in query:
+                    sort = (query['sortasc'][0], False) if 'sortasc' in query else (query['sortdsc'][0], True)
+                rows = fake._filtered(resource, query.get('filter', []), sort)
+
+                json_res = {'total': len(rows), 'resources': [
+                    {'id': r['id'], 'name': r['name'], 'description': r.get('description', ''),
+                     'link': {'rel': 'self', 'href': '{0}/config/{1}/{2}'.format(fake.url_base, resource, r['id'])}}
+                    for r in rows[(page - 1) * size:page * size]]}
+
+                href = '{0}/config/{1}?size={2}{3}{4}&page={{0}}'.format(
+                        fake.url_base, resource, size, ''.join('&filter=' + f for f in query.get('filter', [])),
+                        ''.join('&{0}={1}'.format(k, query[k][0]) for k in ('sortasc', 'sortdsc') if k in query))
+                if page * size < len(rows):
+                    json_res['nextPage'] = {'rel': 'next', 'href': href.format(page + 1)}
+                if page > 1:
+                    json_res['previousPage'] = {'rel': 'previous', 'href': href.format(page - 1)}
+                self._send(200, {'SearchResult': json_res})
+
+            def _get(self, resource, oid):
+                row = fake.resources[resource].get(oid)
+                if row is None:
+                    return self._error(404, 'Resource not found')
+                etag = '"{0}"'.format(hashlib.sha1(json.dumps(row, sort_keys=True).encode('utf-8')).hexdigest())
+                if self.headers.get('If-None-Match') == etag:
+                    return self._send(304, headers={'ETag': etag})
+                self._send(200, {ROOT_KEYS[resource]: row}, headers={'ETag': etag})
+
+            def _create(self, resource, body):
+                row = body[ROOT_KEYS[resource]]
+                if row['name'].upper() in fake.names[resource]:
+                    return self._error(400, '{0} already exists'.format(row['name']))
+                oid = fake.add(resource, **row)
+                self._send(201, headers={'Location': '{0}/config/{1}/{2}'.format(fake.url_base, resource, oid)})
+
+            def _update(self, resource, oid, body):
+                with fake._lock:
+                    if oid not in fake.resources[resource]:
+                        return self._error(404, 'Resource not found')
+                    fake.resources[resource][oid].update(body[ROOT_KEYS[resource]])
+                    fake._filters.clear()
+                self._send(200, {'UpdatedFieldsList': {'updatedField': []}})
+
+            def _delete(self, resource, oid):
+                if fake.remove(resource, oid) is None:
+                    return self._error(404, 'Resource not found')
+                self._send(204)
+
+            def _bulk(self, resource, rest, body):
+                if rest == ['submit'] and self.command == 'PUT':
+                    request = list(body.values())[0]
+                    if request.get('resourceMediaType') != BULK_MEDIA_TYPES.get(resource):
+                        return self._error(400, 'Invalid resourceMediaType {0}'.format(request.get('resourceMediaType')))
+                    statuses = []
+                    if request['operationType'] == 'delete':
+                        for oid in request['idList']['id']:
+                            found = fake.remove(resource, oid)
+                            statuses.append({'id': oid, 'name': found['name'] if found else '',
+                                             'resourceExecutionStatus': 'SUCCESS' if found else 'FAIL',
+                                             'status': 'Deleted' if found else 'Resource not found'})
+                    else:
+                        for row in request['resourcesList'][resource]:
+                            with fake._lock:
+                                oid = row.get('id')
+                                name = row.get('name', '')
+                                if request['operationType'] == 'update' and oid in fake.resources[resource]:
+                                    fake.resources[resource][oid].update(row)
+                                    fake._filters.clear()
+                                    name = fake.resources[resource][oid]['name']
+                                    ok = True
+                                elif request['operationType'] == 'create' and row['name'].upper() not in fake.names[resource]:
+                                    oid = fake.add(resource, **row)
+                                    ok = True
+                                else:
+                                    ok = False
+                            statuses.append({'id': oid or '', 'name': name,
+                                             'resourceExecutionStatus': 'SUCCESS' if ok else 'FAIL',
+                                             'status': 'Done' if ok else 'Failed'})
+
+                    bulk_id = str(uuid.uuid4())
+                    fake.bulk_status[bulk_id] = {
+                        'bulkId': bulk_id, 'executionStatus': 'COMPLETED', 'operationType': request['operationType'],
+                        'resourcesCount': len(statuses),
+                        'successCount': sum(1 for i in statuses if i['resourceExecutionStatus'] == 'SUCCESS'),
+                        'failCount': sum(1 for i in statuses if i['resourceExecutionStatus'] == 'FAIL'),
+                        'resourcesStatus': statuses}
+                    return self._send(202, headers={
+                            'Location': '{0}/config/{1}/bulk/{2}'.format(fake.url_base, resource, bulk_id)})
+
+                if len(rest) == 1 and self.command == 'GET' and rest[0] in fake.bulk_status:
+                    return self._send(200, {'BulkStatus': fake.bulk_status[rest[0]]})
+                return self._error(404, 'Bulk request not found')
+
+        return Handler
@@ -1,9 +1,52 @@
-from cream import ERS
+from fake_ers import FakeERS
+from cream import (DEVICE_REPORT_FIELDS, ENDPOINT_CSV_FIELDS, AsyncERS, Batch, DetailCache, EndpointMirror, ERS,
+                   ERSError, InvalidMacAddress, JSONDecoder, MetricsAggregator, NodePool, RequestGovernor,
+                   ResolutionCache, ResourceList, aiohttp, msgspec, orjson, yaml)
+import asyncio
+import csv
+import gzip
 import json
+import os
+import requests
+import tempfile
+import uuid
 
-from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Semaphore
+from unittest import TestCase, skipIf
 from unittest.mock import patch, Mock
 
+
+def json_response(body, status_code=200, **kwargs):
+    """
+    Build a mocked response carrying a JSON body
+    """
+    resp = Mock(status_code=status_code, content=json.dumps(body).encode('utf-8'), **kwargs)
+    resp.json.return_value = body
+    return resp
+
+
+def search_result(names, total, next_href=None):
+    """
+    Build a mocked SearchResult page response
+    """
+    json_res = {'SearchResult': {'total': total,
+                                 'resources': [{'name': n, 'id': 'id-{0}'.format(n)} for n in names]}}
+    if next_href:
+        json_res['SearchResult']['nextPage'] = {'href': next_href}
+
+    return json_response(json_res)
+
+
+def by_method(**mocks):
+    """
+    Route mocked session requests to a mock per HTTP method
+    """
+    def request(method, url, **kwargs):
+        return mocks[method.lower()](url, **kwargs)
+    return request
+
+
 class ErsTest(TestCase):
 
     def setUp(self):
@@ -13,6 +56,1073 @@ class ErsTest(TestCase):
         result = self.ise._mac_test('24:be:05:0b:01:ab')
 
         self.assertTrue(result)
+        self.assertFalse(self.ise._mac_test('24:be:05:0b:01:ab:cd'))
+        self.assertFalse(self.ise._mac_test('24:be-05:0b:01:ab'))
+
+    def test_normalize_macs(self):
+        canonical, rejects = ERS.normalize_macs(['24:be:05:0b:01:ab', '24-BE-05-0B-01-AB', '24be.050b.01ab',
+                                                 ' 24BE050B01AB ', 'x24:be:05:0b:01:ab', '24be050b01a', None])
+
+        self.assertEqual(canonical, ['24:BE:05:0B:01:AB'] * 4 + [None] * 3)
+        self.assertEqual(rejects, ['x24:be:05:0b:01:ab', '24be050b01a', None])
+
+    def test_delete_endpoint_normalizes_mac(self):
+        self.ise.id_cache.set('endpoint', 'AA:BB:CC:00:11:22', 'id-1')
+
+        with patch.object(self.ise.ise, 'request', return_value=Mock(status_code=204)) as request:
+            self.assertTrue(self.ise.delete_endpoint('aabb.cc00.1122')['success'])
+        self.assertTrue(request.call_args[0][1].endswith('/config/endpoint/id-1'))
+        with self.assertRaises(InvalidMacAddress):
+            self.ise.delete_endpoint('AA:BB:CC:00:11:22:33')
+
+    def test_iter_endpoints_in_group_follows_next_page(self):
+        pages = [search_result(['AA:BB:CC:00:11:22', 'AA:BB:CC:00:11:23'], 3, next_href='page-2'),
+                 search_result(['AA:BB:CC:00:11:24'], 3)]
+
+        get = Mock(side_effect=pages)
+        with patch.object(self.ise.ise, 'request', side_effect=by_method(get=get)):
+            result = list(self.ise.iter_endpoints_in_group('group-id'))
+
+        self.assertEqual(result, ['AA:BB:CC:00:11:22', 'AA:BB:CC:00:11:23', 'AA:BB:CC:00:11:24'])
+        self.assertIn('size=100', get.call_args_list[0][0][0])
+        self.assertEqual(get.call_args_list[1][0][0], 'page-2')
+
+    def test_iter_endpoints_in_group_raises_on_error(self):
+        resp = Mock(status_code=401, reason='Unauthorized')
+        resp.json.side_effect = ValueError
+
+        with patch.object(self.ise.ise, 'request', return_value=resp):
+            with self.assertRaises(ERSError) as err:
+                list(self.ise.iter_endpoints_in_group('group-id'))
+
+        self.assertEqual(err.exception.status_code, 401)
+
+    def test_iter_endpoints_concurrent_pages(self):
+        def get(url, **kwargs):
+            page = int(url.split('page=')[1]) if 'page=' in url else 1
+            names = ['ep-{0}-{1}'.format(page, i) for i in range(2)]
+            return search_result(names, 9, next_href='unused')
+
+        with patch.object(self.ise.ise, 'request', side_effect=by_method(get=get)) as mocked:
+            ordered = list(self.ise.iter_endpoints(page_size=2, workers=3))
+            unordered = list(self.ise.iter_endpoints(page_size=2, workers=3, ordered=False))
+
+        expected = [('ep-{0}-{1}'.format(p, i), 'id-ep-{0}-{1}'.format(p, i)) for p in range(1, 6) for i in range(2)]
+        self.assertEqual(ordered, expected)
+        self.assertEqual(sorted(unordered), sorted(expected))
+        self.assertEqual(mocked.call_count, 10)
+
+    def test_resolution_cache_skips_filter_lookup(self):
+        detail = json_response({'EndPointGroup': {'name': 'Blacklist', 'id': 'id-Blacklist'}})
+
+        with patch.object(self.ise.ise, 'request', side_effect=[search_result(['Blacklist'], 1), detail, detail]) as get:
+            self.assertEqual(self.ise.get_endpoint_group_id('Blacklist')['response'], 'id-Blacklist')
+            self.assertTrue(self.ise.get_endpoint_group('Blacklist')['success'])
+            self.assertTrue(self.ise.get_endpoint_group('Blacklist')['success'])
+
+        self.assertEqual(get.call_count, 3)
+
+    def test_ambiguous_name_is_not_reported_missing(self):
+        with patch.object(self.ise.ise, 'request', return_value=search_result(['sw1', 'SW1'], 2)):
+            result = self.ise.get_device('sw1')
+
+        self.assertEqual(result['error'], 409)
+        self.assertEqual(result['response'], 'sw1 matches more than one object')
+        self.assertIsNone(self.ise.id_cache.get('networkdevice', 'sw1'))
+
+    def test_delete_invalidates_resolution_cache(self):
+        self.ise.id_cache.set('internaluser', 'test11', 'id-test11')
+
+        delete = Mock(return_value=Mock(status_code=204))
+        with patch.object(self.ise.ise, 'request', side_effect=by_method(delete=delete)):
+            self.assertTrue(self.ise.delete_user('test11')['success'])
+
+        self.assertTrue(delete.call_args[0][0].endswith('/config/internaluser/id-test11'))
+        self.assertIsNone(self.ise.id_cache.get('internaluser', 'test11'))
+
+    def test_warm_cache(self):
+        with patch.object(self.ise.ise, 'request', return_value=search_result(['Blacklist', 'Profiled'], 2)):
+            self.assertEqual(self.ise.warm_cache('endpointgroup'), 2)
+
+        self.assertEqual(self.ise.id_cache.get('endpointgroup', 'Profiled'), 'id-Profiled')
+
+    def test_bulk_add_endpoints(self):
+        submitted = Mock(status_code=202, headers={'Location': 'monitor'})
+        status = json_response({'BulkStatus': {'bulkId': '1', 'executionStatus': 'COMPLETED', 'resourcesStatus': [
+            {'name': 'AA:BB:CC:00:11:22', 'id': 'id-1', 'resourceExecutionStatus': 'SUCCESS', 'status': 'Created'},
+            {'name': 'AA:BB:CC:00:11:23', 'resourceExecutionStatus': 'FAIL', 'status': 'Already exists'}]}})
+
+        put = Mock(return_value=submitted)
+        with patch.object(self.ise.ise, 'request', side_effect=by_method(put=put, get=Mock(return_value=status))):
+            result = self.ise.bulk_add_endpoints(['AA:BB:CC:00:11:22', 'AA:BB:CC:00:11:23', 'bogus'],
+                                                 group_id='group-id', workers=1)
+
+        request = json.loads(put.call_args[1]['data'])['EndpointBulkRequest']
+        self.assertEqual(request['operationType'], 'create')
+        self.assertEqual(len(request['resourcesList']['endpoint']), 2)
+        self.assertFalse(result['success'])
+        self.assertTrue(result['response']['AA:BB:CC:00:11:22']['success'])
+        self.assertEqual(result['response']['AA:BB:CC:00:11:23']['response'], 'Already exists')
+        self.assertEqual(result['response']['bogus']['error'], 400)
+        self.assertEqual(self.ise.id_cache.get('endpoint', 'AA:BB:CC:00:11:22'), 'id-1')
+
+    def test_bulk_delete_endpoints_batches(self):
+        self.ise.max_bulk_size = 2
+        macs = ['AA:BB:CC:00:11:2{0}'.format(i) for i in range(5)]
+        for mac in macs:
+            self.ise.id_cache.set('endpoint', mac, 'id-' + mac)
+
+        def get(url, **kwargs):
+            ids = json.loads(put.call_args[1]['data'])['EndpointBulkRequest']['idList']['id']
+            resp = json_response({'BulkStatus': {'bulkId': '1', 'executionStatus': 'COMPLETED', 'resourcesStatus': [
+                {'id': i, 'resourceExecutionStatus': 'SUCCESS', 'status': 'Deleted'} for i in ids]}})
+            return resp
+
+        put = Mock(return_value=Mock(status_code=202, headers={'Location': 'monitor'}))
+        with patch.object(self.ise.ise, 'request', side_effect=by_method(put=put, get=get)):
+            result = self.ise.bulk_delete_endpoints(macs, workers=1)
+
+        self.assertTrue(result['success'])
+        self.assertEqual(put.call_count, 3)
+        self.assertIsNone(self.ise.id_cache.get('endpoint', macs[0]))
+
+    def test_move_endpoints_to_group(self):
+        self.ise.id_cache.set('endpointgroup', 'Blacklist', 'group-id')
+        self.ise.id_cache.set('endpoint', 'AA:BB:CC:00:11:22', 'id-1')
+        self.ise.id_cache.set('endpoint', 'AA:BB:CC:00:11:23', 'id-2')
+
+        def put(url, data, **kwargs):
+            return Mock(status_code=200 if url.endswith('id-1') else 404)
+
+        mocked = Mock(side_effect=put)
+        with patch.object(self.ise.ise, 'request', side_effect=by_method(put=mocked)):
+            result = self.ise.move_endpoints_to_group(['AA:BB:CC:00:11:22', 'AA:BB:CC:00:11:23'], 'Blacklist')
+
+        endpoint = json.loads(mocked.call_args_list[0][1]['data'])['ERSEndPoint']
+        self.assertEqual(endpoint['groupId'], 'group-id')
+        self.assertTrue(endpoint['staticGroupAssignment'])
+        self.assertTrue(result['response']['AA:BB:CC:00:11:22']['success'])
+        self.assertEqual(result['response']['AA:BB:CC:00:11:23']['error'], 404)
+        self.assertEqual(result['error'], '1 of 2 endpoints failed')
+
+    def test_export_endpoints_in_group_csv_gz(self):
+        self.ise.id_cache.set('endpointgroup', 'Blacklist', 'group-id')
+        pages = [search_result(['AA:BB:CC:00:11:22'], 2, next_href='page-2'), search_result(['AA:BB:CC:00:11:23'], 2)]
+        path = os.path.join(tempfile.mkdtemp(), 'blacklist.csv.gz')
+
+        with patch.object(self.ise.ise, 'request', side_effect=pages):
+            result = self.ise.export_endpoints_in_group('Blacklist', path)
+
+        self.assertEqual(result['response'], 2)
+        with gzip.open(path, 'rt') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], ','.join(ENDPOINT_CSV_FIELDS))
+        self.assertEqual(lines[1:], ['AA:BB:CC:00:11:22,,Blacklist,', 'AA:BB:CC:00:11:23,,Blacklist,'])
+
+    def test_export_endpoints_in_group_ndjson_detail(self):
+        self.ise.id_cache.set('endpointgroup', 'Blacklist', 'group-id')
+        detail = json_response({'ERSEndPoint': {'mac': 'AA:BB:CC:00:11:22', 'description': 'printer'}})
+        path = os.path.join(tempfile.mkdtemp(), 'blacklist.ndjson')
+
+        with patch.object(self.ise.ise, 'request', side_effect=[search_result(['AA:BB:CC:00:11:22'], 1), detail]):
+            self.ise.export_endpoints_in_group('Blacklist', path, detail=True)
+
+        with open(path) as f:
+            self.assertEqual([json.loads(line) for line in f], [{'mac': 'AA:BB:CC:00:11:22', 'description': 'printer'}])
+
+    def test_request_retries_idempotent_calls(self):
+        responses = [requests.ConnectionError(), Mock(status_code=503, headers={'Retry-After': '7'}),
+                     search_result([], 0)]
+
+        with patch.object(self.ise.ise, 'request', side_effect=responses) as request, \
+                patch('cream.time.sleep') as sleep:
+            self.assertTrue(self.ise.get_endpoints()['success'])
+
+        self.assertEqual(request.call_count, 3)
+        self.assertEqual(request.call_args[1]['timeout'], 2)
+        self.assertEqual(sleep.call_args[0][0], 7)
+
+    def test_retry_after_is_capped(self):
+        responses = [Mock(status_code=429, headers={'Retry-After': '3600'}), search_result([], 0)]
+
+        with patch.object(self.ise.ise, 'request', side_effect=responses), patch('cream.time.sleep') as sleep:
+            self.assertTrue(self.ise.get_endpoints()['success'])
+
+        self.assertEqual(sleep.call_args[0][0], 30)
+
+    def test_request_does_not_retry_post(self):
+        failed = Mock(status_code=503)
+        failed.json.return_value = {'ERSResponse': {'messages': [{'title': 'Service Unavailable'}]}}
+
+        with patch.object(self.ise.ise, 'request', return_value=failed) as request:
+            result = self.ise.add_user('test11', 'TeStInG11', 'group-id')
+
+        self.assertEqual(request.call_count, 1)
+        self.assertEqual(result['error'], 503)
+
+    def test_write_is_not_answered_by_earlier_get(self):
+        url = '{0}/config/endpoint/id-1'.format(self.ise.url_base)
+        sent, written = Event(), Event()
+
+        def get(url, **kwargs):
+            if not sent.is_set():
+                # The first GET is answered with what ISE held before the PUT
+                sent.set()
+                written.wait(1)
+                return json_response({'ERSEndPoint': {'description': 'before'}})
+            return json_response({'ERSEndPoint': {'description': 'after'}})
+
+        put = Mock(return_value=Mock(status_code=200))
+        with patch.object(self.ise.ise, 'request', side_effect=by_method(get=get, put=put)):
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                earlier = pool.submit(self.ise._request, 'GET', url)
+                sent.wait(1)
+                self.ise._request('PUT', url, data='{}')
+                later = self.ise._request('GET', url)
+                written.set()
+
+        self.assertEqual(earlier.result().json()['ERSEndPoint']['description'], 'before')
+        self.assertEqual(later.json()['ERSEndPoint']['description'], 'after')
+
+    def test_hooks_count_encoded_bytes(self):
+        records = []
+        self.ise.add_hook(records.append)
+        data = json.dumps({'ERSEndPoint': {'description': 'Büro Zürich'}}, ensure_ascii=False)
+
+        with patch.object(self.ise.ise, 'request', return_value=Mock(status_code=200, content=b'')):
+            self.ise._request('PUT', '{0}/config/endpoint/id-1'.format(self.ise.url_base), data=data)
+
+        self.assertEqual(records[0].bytes_sent, len(data) + 2)
+        self.assertIsNone(records[0].page)
+
+
+class FakeErsTest(TestCase):
+
+    def setUp(self):
+        self.fake = FakeERS()
+        self.fake.start()
+        self.group_ids = self.fake.populate(250)
+        self.ise = ERS('ise_node', 'ers_user', 'ers_pass', url_base=self.fake.url_base)
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_iter_endpoints_in_group(self):
+        serial = list(self.ise.iter_endpoints_in_group(self.group_ids[0]))
+        threaded = list(self.ise.iter_endpoints_in_group(self.group_ids[0], workers=4))
+
+        self.assertEqual(len(serial), 84)
+        self.assertEqual(serial, threaded)
+
+    def test_endpoint_lifecycle(self):
+        self.assertTrue(self.ise.add_endpoint('test02', 'AA:BB:CC:00:11:24', self.group_ids[1])['success'])
+        self.assertEqual(self.ise.get_endpoint('AA:BB:CC:00:11:24')['response']['groupId'], self.group_ids[1])
+        self.assertTrue(self.ise.move_endpoints_to_group(['AA:BB:CC:00:11:24'], 'Workstation')['success'])
+        self.assertEqual(self.ise.get_endpoint('AA:BB:CC:00:11:24')['response']['groupId'], self.group_ids[2])
+        self.assertTrue(self.ise.delete_endpoint('AA:BB:CC:00:11:24')['success'])
+        self.assertEqual(self.ise.get_endpoint('AA:BB:CC:00:11:24')['error'], 404)
+
+    def test_move_keeps_endpoint_names(self):
+        self.fake.add('endpoint', 'printer01', mac='AA:CC:00:00:00:01', groupId=self.group_ids[0])
+
+        for bulk, group, group_id in ((False, 'Workstation', self.group_ids[2]), (True, 'Profiled', self.group_ids[1])):
+            result = self.ise.move_endpoints_to_group(['AA:CC:00:00:00:01'], group, bulk=bulk, poll_interval=0.01)
+
+            self.assertTrue(result['response']['AA:CC:00:00:00:01']['success'])
+            endpoint = self.ise.get_endpoint('AA:CC:00:00:00:01')['response']
+            self.assertEqual((endpoint['name'], endpoint['groupId']), ('printer01', group_id))
+
+    def test_bulk_add_and_delete(self):
+        macs = ['AA:BB:CC:00:12:{0:02X}'.format(i) for i in range(30)]
+
+        self.assertTrue(self.ise.bulk_add_endpoints(macs, group_id=self.group_ids[0], batch_size=7)['success'])
+        self.assertEqual(len(list(self.ise.iter_endpoints_in_group(self.group_ids[0]))), 114)
+        self.assertTrue(self.ise.bulk_delete_endpoints(macs)['success'])
+        self.assertEqual(len(list(self.ise.iter_endpoints_in_group(self.group_ids[0]))), 84)
+
+    def test_bulk_add_endpoints_named(self):
+        result = self.ise.bulk_add_endpoints([{'mac': 'aa-cc-00-00-00-01', 'name': 'printer01', 'description': 'lobby'}],
+                                             group_id=self.group_ids[0], poll_interval=0.01)
+
+        self.assertEqual(result['response']['AA:CC:00:00:00:01']['success'], True)
+        self.assertEqual(self.ise.get_endpoint('AA:CC:00:00:00:01')['response']['name'], 'printer01')
+
+    def test_bulk_add_endpoints_rejects_bad_rows(self):
+        result = self.ise.bulk_add_endpoints([{'mac': 'AA:CC:00:00:00:01'}, {'mac': 'aa:cc:00:00:00:01'},
+                                              {'mac': 'AA:CC:00:00:00:02', 'colour': 'red'}, {'name': 'printer02'},
+                                              None, ('AA:CC:00:00:00:03',), {'mac': 'AA:CC:00:00:00:04', 'name': 'printer'},
+                                              {'mac': 'AA:CC:00:00:00:05', 'name': 'Printer'}],
+                                             group_id=self.group_ids[0], poll_interval=0.01)
+
+        self.assertTrue(result['response']['AA:CC:00:00:00:01']['success'])
+        self.assertEqual(result['response']['AA:CC:00:00:00:01 (row 2)']['response'], 'Duplicate endpoint AA:CC:00:00:00:01')
+        self.assertEqual(result['response']['AA:CC:00:00:00:02']['response'], 'Unknown field colour')
+        self.assertEqual(result['response']['row 4']['error'], 400)
+        self.assertEqual((result['response']['row 5']['error'], result['response']['row 6']['error']), ('invalid', 'invalid'))
+        self.assertTrue(result['response']['AA:CC:00:00:00:04']['success'])
+        self.assertEqual(result['response']['AA:CC:00:00:00:05']['response'], 'Duplicate name Printer')
+        self.assertEqual(result['error'], '6 of 8 endpoints failed')
+
+        result = self.ise.bulk_add_endpoints(['AA:CC:00:00:00:06'], poll_interval=0.01)
+        self.assertEqual(result['response']['AA:CC:00:00:00:06']['response'], 'No endpoint group')
+
+    def test_retries_injected_errors(self):
+        self.fake.error_rate = 0.3
+        self.ise.backoff = 0.001
+        self.ise.retries = 10
+
+        self.assertEqual(len(list(self.ise.iter_endpoints(workers=4))), 250)
+
+    def test_metrics_hooks(self):
+        metrics = MetricsAggregator()
+        records = []
+        self.ise.add_hook(metrics)
+        self.ise.add_hook(records.append)
+
+        list(self.ise.iter_endpoints(workers=2))
+        self.ise.get_endpoint('AA:BB:00:00:00:01')
+
+        summary = metrics.summary()
+        self.assertEqual(summary[('GET', 'endpoint')]['count'], 5)
+        self.assertEqual(summary[('GET', 'endpoint')]['max_page'], 3)
+        self.assertGreater(summary[('GET', 'endpoint')]['bytes_received'], 0)
+        self.assertEqual(records[-1].status_code, 200)
+        self.assertIn('ers_requests_total{method="GET",resource="endpoint",status="200"} 5',
+                      metrics.prometheus().splitlines())
+        self.assertIn('p95', metrics.report())
+
+    def test_get_endpoints_by_mac(self):
+        result = self.ise.get_endpoints_by_mac(['aa:bb:00:00:00:01', 'aabb.0000.0001', 'AA:BB:CC:00:11:99', 'bogus'])
+
+        self.assertEqual(sorted(result['response']), ['AA:BB:00:00:00:01', 'AA:BB:CC:00:11:99', 'bogus'])
+        self.assertEqual(result['response']['AA:BB:00:00:00:01']['response']['groupId'], self.group_ids[1])
+        self.assertEqual(result['response']['AA:BB:CC:00:11:99']['error'], 404)
+        self.assertEqual(result['response']['bogus']['error'], 400)
+
+    def test_get_endpoints_by_mac_lists_when_cheaper(self):
+        macs = ['AA:BB:00:00:00:{0:02X}'.format(i) for i in range(150)]
+        self.fake.requests = 0
+
+        result = self.ise.get_endpoints_by_mac(macs)
+
+        self.assertTrue(result['success'])
+        # One total, three listing pages and the details instead of 150 filter searches
+        self.assertEqual(self.fake.requests, 1 + 3 + 150)
+
+    def test_compact_listing(self):
+        full = self.ise.search_endpoints_by_group(self.group_ids[0], compact=True, workers=2)['response']
+        first_page = self.ise.search_endpoints_by_group(self.group_ids[0])['response']
+
+        self.assertIsInstance(full, ResourceList)
+        self.assertEqual(len(full), 84)
+        self.assertEqual(full[:20], first_page)
+        self.assertEqual(list(self.ise.iter_endpoints_in_group(self.group_ids[0])), full.names)
+
+    def test_group_membership_reconciliation(self):
+        desired = [('AA:BB:00:00:00:00', 'Blacklist'), ('aa-bb-00-00-00-01', 'Blacklist'),
+                   ('AA:BB:00:00:00:02', 'Blacklist'), ('AA:BB:CC:00:11:22', 'Blacklist'), ('bogus', 'Blacklist')]
+
+        self.assertEqual(self.ise.plan_group_membership(desired)['response'].delete, [])
+        plan = self.ise.plan_group_membership(desired, prune=True)['response']
+
+        self.assertEqual(plan.add, [('AA:BB:CC:00:11:22', 'Blacklist')])
+        self.assertEqual(plan.move, [('AA:BB:00:00:00:01', 'Blacklist'), ('AA:BB:00:00:00:02', 'Blacklist')])
+        self.assertEqual((len(plan.delete), plan.unchanged, plan.rejects), (83, 1, ['bogus']))
+
+        self.assertTrue(self.ise.apply_group_membership(plan, workers=4)['success'])
+        plan = self.ise.plan_group_membership(desired, prune=True)['response']
+        self.assertEqual((plan.add, plan.move, plan.delete, plan.unchanged), ([], [], [], 4))
+
+    def test_group_membership_skips_endpoints_not_named_by_mac(self):
+        self.fake.add('endpoint', 'printer01', mac='AA:CC:00:00:00:01', groupId=self.group_ids[0])
+
+        plan = self.ise.plan_group_membership([('AA:BB:00:00:00:00', 'Blacklist')], prune=True)['response']
+
+        self.assertEqual((len(plan.delete), plan.rejects), (83, ['printer01']))
+        self.assertNotIn('PRINTER01', plan.delete)
+
+        # A bad entry fails on its own instead of aborting the rest of the plan
+        plan = plan._replace(delete=['printer01', 'AA:BB:00:00:00:03'])
+        result = self.ise.apply_group_membership(plan)
+        self.assertFalse(result['response']['printer01']['success'])
+        self.assertTrue(result['response']['AA:BB:00:00:00:03']['success'])
+
+    def test_group_membership_from_export(self):
+        path = os.path.join(tempfile.mkdtemp(), 'profiled.csv.gz')
+        self.ise.export_endpoints_in_group('Profiled', path)
+
+        plan = self.ise.plan_group_membership(path)['response']
+
+        self.assertEqual((plan.add, plan.move, plan.delete, plan.unchanged), ([], [], [], 83))
+
+    def test_group_membership_csv_without_columns(self):
+        path = os.path.join(tempfile.mkdtemp(), 'cmdb.csv')
+        with open(path, 'w') as f:
+            f.write('MACAddress,Group\nAA:BB:00:00:00:00,Blacklist\n')
+
+        result = self.ise.plan_group_membership(path)
+
+        self.assertFalse(result['success'])
+        self.assertEqual(result['response'], '{0} has no IdentityGroup column'.format(path))
+
+    def test_group_membership_from_detail_export(self):
+        path = os.path.join(tempfile.mkdtemp(), 'profiled.ndjson')
+        self.ise.export_endpoints_in_group('Profiled', path, detail=True, workers=4)
+        self.ise.id_cache.invalidate()
+
+        plan = self.ise.plan_group_membership(path)['response']
+
+        self.assertEqual((plan.add, plan.move, plan.delete, plan.unchanged), ([], [], [], 83))
+
+        with open(path, 'a') as f:
+            f.write(json.dumps({'mac': 'AA:BB:CC:00:11:22'}) + '\n')
+        result = self.ise.plan_group_membership(path)
+        self.assertFalse(result['success'])
+        self.assertEqual(result['response'], 'Line 84 of {0} has neither a group nor a groupId'.format(path))
+
+    def test_export_resumes_from_checkpoint(self):
+        path = os.path.join(tempfile.mkdtemp(), 'blacklist.csv.gz')
+        self.ise.max_page_size = 20
+        get_page = self.ise._get_page
+        calls = []
+
+        def fail_on_page_4(url, page=None):
+            calls.append(page)
+            if page == 4 and len(calls) < 5:
+                raise ERSError('Connection reset', 503)
+            return get_page(url, page)
+
+        with patch.object(self.ise, '_get_page', side_effect=fail_on_page_4):
+            self.assertFalse(self.ise.export_endpoints_in_group('Blacklist', path)['success'])
+            self.assertTrue(os.path.exists(path + '.checkpoint'))
+
+            # Rows written before the failure shift back a page, nothing may be skipped or repeated
+            for oid in list(self.fake.resources['endpoint'])[:60]:
+                self.fake.remove('endpoint', oid)
+            result = self.ise.export_endpoints_in_group('Blacklist', path)
+
+        with gzip.open(path, 'rt') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(result['response'], 84)
+        self.assertEqual(lines[0], ','.join(ENDPOINT_CSV_FIELDS))
+        self.assertEqual(len(lines[1:]), len(set(lines[1:])))
+        self.assertEqual(len(lines), 85)
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+    def test_export_resumes_mixed_case_names(self):
+        # ISE sorts names case-insensitively, so 'host05' follows 'HOST04' although it compares greater in Python
+        group_id = self.fake.add('endpointgroup', 'Printers', description='')
+        names = {}
+        for i in range(50):
+            mac = 'CC:DD:EE:FF:00:{0:02X}'.format(i)
+            names[mac] = ('host{0:02d}' if i % 2 else 'HOST{0:02d}').format(i)
+            self.fake.add('endpoint', names[mac], mac=mac, groupId=group_id, description='', staticGroupAssignment=True)
+        path = os.path.join(tempfile.mkdtemp(), 'printers.csv')
+        self.ise.max_page_size = 10
+        get_page = self.ise._get_page
+        calls, failed = [], Event()
+
+        def fail_on_page_4(url, page=None):
+            calls.append(page)
+            if page == 4 and not failed.is_set():
+                failed.set()
+                raise ERSError('Connection reset', 503)
+            return get_page(url, page)
+
+        with patch.object(self.ise, '_get_page', side_effect=fail_on_page_4):
+            self.assertFalse(self.ise.export_endpoints_in_group('Printers', path)['success'])
+            del calls[:]
+            result = self.ise.export_endpoints_in_group('Printers', path)
+
+        with open(path) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(result['response'], 50)
+        self.assertEqual([r['MACAddress'] for r in rows], sorted(names.values(), key=str.upper))
+        # The page holding the resume point is fetched once and reused
+        self.assertEqual(calls, [3, 4, 5])
+
+    def test_bulk_add_devices(self):
+        for group in ('Device Type#All Device Types#Switch', 'Location#All Locations#Site1', 'IPSEC#Is IPSEC Device'):
+            self.fake.add('networkdevicegroup', group)
+        tmp = tempfile.mkdtemp()
+        inventory, report = os.path.join(tmp, 'site1.csv'), os.path.join(tmp, 'report.csv')
+        with open(inventory, 'w') as f:
+            f.write('name,ip_address,radius_key,snmp_ro,dev_group,dev_location,dev_type\n')
+            for name, ip in (('sw1', '10.0.0.1'), ('sw2', '10.0.0.2/32'), ('sw3', '10.0.1.0/24'), ('sw4', '10.0.0.256'),
+                             ('sw1', '10.0.0.5'), ('sw6', '10.0.0.1')):
+                f.write('{0},{1},key,public,IPSEC#Is IPSEC Device,Location#All Locations#Site1,'
+                        'Device Type#All Device Types#Switch\n'.format(name, ip))
+            f.write('sw7,10.0.0.7,key,public,IPSEC#Is IPSEC Device,Location#All Locations#Site2,'
+                    'Device Type#All Device Types#Switch\n')
+
+        result = self.ise.bulk_add_devices(inventory, report=report, workers=2)
+
+        self.assertEqual(sorted(name for name, i in result['response'].items() if i['success']), ['sw1', 'sw2', 'sw3'])
+        self.assertEqual(result['error'], '4 of 7 devices failed')
+        self.assertEqual(result['response']['sw7']['response'],
+                         'Unknown network device group Location#All Locations#Site2')
+        self.assertEqual(self.ise.get_device('sw3')['response']['NetworkDeviceIPList'],
+                         [{'ipaddress': '10.0.1.0', 'mask': 24}])
+        with open(report) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], ','.join(DEVICE_REPORT_FIELDS))
+        self.assertIn('sw4,10.0.0.256,False,Invalid IP address 10.0.0.256,invalid', lines)
+        self.assertEqual(len(lines), 8)
+
+    @skipIf(yaml is None, 'PyYAML is not installed')
+    def test_bulk_add_devices_yaml(self):
+        self.fake.add('networkdevicegroup', 'Location#All Locations')
+        path = os.path.join(tempfile.mkdtemp(), 'site2.yaml')
+        with open(path, 'w') as f:
+            f.write('- {name: sw1, ip_address: 10.0.2.1, radius_key: key, snmp_ro: 123, dev_group: Location#All Locations,'
+                    ' dev_location: Location#All Locations, dev_type: Location#All Locations, snmp_v: ONE}\n'
+                    '- {name: sw2, ip_address: 10.0.2.2, radius_key: key}\n')
+
+        result = self.ise.bulk_add_devices(path, bulk=True, poll_interval=0.01)
+
+        self.assertTrue(result['response']['sw1']['success'])
+        self.assertEqual(result['response']['sw2']['response'],
+                         'Missing snmp_ro, dev_group, dev_location, dev_type')
+        self.assertEqual(self.ise.get_device('sw1')['response']['snmpsettings']['version'], 'ONE')
+
+    def test_bulk_add_devices_keeps_rejected_duplicates(self):
+        self.fake.add('networkdevicegroup', 'Location#All Locations')
+        row = {'name': 'sw1', 'ip_address': '10.0.3.1', 'radius_key': 'key', 'snmp_ro': 'public',
+               'dev_group': 'Location#All Locations', 'dev_location': 'Location#All Locations',
+               'dev_type': 'Location#All Locations'}
+
+        result = self.ise.bulk_add_devices([dict(row, ip_address='10.0.3.256'), row])
+
+        self.assertFalse(result['success'])
+        self.assertEqual(result['response']['sw1']['response'], 'Invalid IP address 10.0.3.256')
+        self.assertEqual(result['response']['sw1 (row 2)']['response'], 'Duplicate device sw1')
+        self.assertEqual(self.ise.get_device('sw1')['error'], 404)
+
+    def test_bulk_add_devices_duplicate_addresses(self):
+        self.fake.add('networkdevicegroup', 'Location#All Locations')
+        row = {'radius_key': 'key', 'snmp_ro': 'public', 'dev_group': 'Location#All Locations',
+               'dev_location': 'Location#All Locations', 'dev_type': 'Location#All Locations'}
+
+        # Hosts on the same subnet are different devices, one host written with two prefixes is not
+        result = self.ise.bulk_add_devices([dict(row, name='sw1', ip_address='10.0.4.1/24'),
+                                            dict(row, name='sw2', ip_address='10.0.4.2/24'),
+                                            dict(row, name='sw3', ip_address='10.0.4.3/32'),
+                                            dict(row, name='sw4', ip_address='10.0.4.3/24')])
+
+        self.assertEqual(result['error'], '1 of 4 devices failed')
+        self.assertTrue(result['response']['sw2']['success'])
+        self.assertEqual(result['response']['sw4']['response'], 'Duplicate IP address 10.0.4.3')
+
+    def test_listing_resolution_does_not_search_for_misses(self):
+        for i in range(120):
+            self.fake.add('internaluser', 'lab{0:03}'.format(i))
+        self.fake.requests = 0
+
+        result = self.ise.bulk_delete_users(['lab{0:03}'.format(i) for i in range(150)], workers=4)
+
+        self.assertEqual(result['error'], '30 of 150 users failed')
+        self.assertEqual(result['response']['lab149']['error'], 404)
+        # A one row page for the total, two listing pages and the deletes
+        self.assertEqual(self.fake.requests, 3 + 120)
+
+    def test_listing_resolution_reads_custom_named_endpoints(self):
+        self.fake.add('endpoint', 'printer01', mac='AA:CC:00:00:00:01', groupId=self.group_ids[0])
+        macs = ['AA:BB:00:00:{0:02X}:{1:02X}'.format(i >> 8, i & 0xFF) for i in range(240, 400)]
+        self.fake.requests = 0
+
+        resolved = self.ise._resolve_macs(macs + ['AA:CC:00:00:00:01'])
+
+        self.assertEqual(sum(1 for oid, _ in resolved.values() if oid is not None), 11)
+        self.assertEqual(resolved['AA:BB:00:00:01:8F'], (None, 404))
+        # A one row page for the total, three listing pages and the printer's detail
+        self.assertEqual(self.fake.requests, 1 + 3 + 1)
+
+    def test_bulk_add_and_delete_users(self):
+        guests = self.fake.add('identitygroup', 'Guests')
+        self.fake.add('identitygroup', 'Lab')
+        users = [{'user_id': 'guest{0:03}'.format(i), 'password': 'TeStInG11'} for i in range(40)]
+        users += [{'user_id': 'lab1', 'password': 'TeStInG11', 'group': ['Lab', 'Guests']},
+                  {'user_id': 'lab2', 'password': 'TeStInG11', 'group': 'Staff'},
+                  {'user_id': 'guest000', 'password': 'TeStInG11'}, {'user_id': 'lab3'}]
+        progress = []
+
+        result = self.ise.bulk_add_users(users, group='Guests', workers=4, progress=lambda *args: progress.append(args))
+
+        self.assertEqual(sum(1 for i in result['response'].values() if i['success']), 41)
+        self.assertEqual(result['response']['lab2']['response'], 'Staff not found')
+        self.assertEqual(result['response']['guest000 (row 43)']['response'], 'Duplicate user guest000')
+        self.assertEqual(result['response']['lab3']['response'], 'Missing user_id or password')
+        self.assertEqual(progress[-1], (41, 41, 0))
+        self.assertEqual(self.ise.get_user('guest001')['response']['identityGroups'], guests)
+        self.assertEqual(len(self.ise.get_user('lab1')['response']['identityGroups'].split(',')), 2)
+
+        progress = []
+        result = self.ise.bulk_delete_users(['guest{0:03}'.format(i) for i in range(41)], bulk=True, batch_size=10,
+                                            poll_interval=0.01, progress=lambda *args: progress.append(args))
+
+        self.assertEqual(result['error'], '1 of 41 users failed')
+        self.assertEqual(result['response']['guest040']['error'], 404)
+        self.assertEqual([i[0] for i in progress], [10, 20, 30, 40])
+        self.assertEqual(len(self.fake.resources['internaluser']), 1)
+
+    def test_batch(self):
+        progress = []
+        macs = ['AA:BB:CC:00:13:{0:02X}'.format(i) for i in range(30)]
+
+        with self.ise.batch(workers=2, progress=lambda *args: progress.append(args)) as batch:
+            indexes = [batch.submit('add_endpoint', mac, mac, self.group_ids[0]) for mac in macs]
+            batch.submit(self.ise.get_endpoint, 'bogus')
+            results = dict(batch.results())
+
+        self.assertTrue(all(results[i]['success'] for i in indexes))
+        self.assertFalse(results[30]['success'])
+        self.assertEqual(progress[-1], (31, 31, 1))
+
+    def test_batch_cancel(self):
+        with self.ise.batch(workers=2, max_workers=2) as batch:
+            for i in range(50):
+                batch.submit('get_endpoint_group', 'Blacklist')
+            results = batch.results()
+            next(results)
+            batch.cancel()
+            self.assertLessEqual(len(list(results)), 2)
+
+        self.assertEqual(batch.done, batch.total)
+
+    def test_pool_stats(self):
+        list(self.ise.iter_endpoints(workers=4))
+
+        stats = self.ise.pool_stats()[self.fake.url_base.rsplit('/', 1)[0]]
+        self.assertEqual(stats['requests'], 3)
+        self.assertLessEqual(stats['connections'], 2)
+        self.assertEqual(stats['maxsize'], 32)
+
+    def test_detail_cache_revalidates(self):
+        sw1 = self.fake.add('networkdevice', 'sw1', description='')
+        records = []
+        self.ise.add_hook(records.append)
+
+        first = self.ise.get_device('sw1')['response']
+        self.assertEqual(self.ise.get_device('sw1')['response'], first)
+        self.assertEqual([(i.status_code, i.bytes_received > 0) for i in records[-2:]], [(200, True), (304, False)])
+
+        self.fake.resources['networkdevice'][sw1]['description'] = 'core'
+        self.assertEqual(self.ise.get_device('sw1')['response']['description'], 'core')
+
+    def test_detail_cache_ttl_and_disk_tier(self):
+        path = os.path.join(tempfile.mkdtemp(), 'details.db')
+        ise = ERS('ise_node', 'ers_user', 'ers_pass', url_base=self.fake.url_base, detail_ttl=60,
+                  detail_cache_path=path)
+        self.assertTrue(ise.get_endpoint('AA:BB:00:00:00:01')['success'])
+        self.fake.requests = 0
+
+        self.assertTrue(ise.get_endpoint('AA:BB:00:00:00:01')['success'])
+        self.assertEqual(self.fake.requests, 0)
+
+        restarted = ERS('ise_node', 'ers_user', 'ers_pass', url_base=self.fake.url_base, detail_ttl=60,
+                        detail_cache_path=path)
+        restarted.id_cache.set('endpoint', 'AA:BB:00:00:00:01', ise.id_cache.get('endpoint', 'AA:BB:00:00:00:01'))
+        self.assertEqual(restarted.get_endpoint('AA:BB:00:00:00:01')['response']['groupId'], self.group_ids[1])
+        self.assertEqual(self.fake.requests, 0)
+
+        self.assertTrue(ise.delete_endpoint('AA:BB:00:00:00:01')['success'])
+        self.assertEqual(ise.get_endpoint('AA:BB:00:00:00:01')['error'], 404)
+
+    def test_shared_between_threads(self):
+        headers = dict(self.ise.ise.headers)
+        macs = ['AA:BB:00:00:00:{0:02X}'.format(i) for i in range(64)]
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(self.ise.get_endpoint, macs))
+
+        self.assertEqual([i['response']['mac'] for i in results], macs)
+        self.assertEqual(dict(self.ise.ise.headers), headers)
+
+    def test_coalesces_identical_gets(self):
+        self.fake.add('networkdevice', 'sw1', description='')
+        self.fake.latency = 0.2
+        self.fake.requests = 0
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(lambda _: self.ise.get_device('sw1'), range(16)))
+
+        self.assertTrue(all(i['response']['name'] == 'sw1' for i in results))
+        # One filter search and one detail GET, shared by all 16 callers
+        self.assertEqual(self.fake.requests, 2)
+
+    def test_endpoint_mirror(self):
+        self.fake.add('networkdevice', 'sw1')
+        mirror = EndpointMirror(self.ise)
+        self.assertTrue(mirror.is_stale(60))
+
+        self.assertEqual(mirror.sync(), {'endpoint_groups': 3, 'endpoints': 250, 'devices': 1})
+        self.assertFalse(mirror.is_stale(60))
+        self.assertEqual(mirror.get_endpoint_group_of('aa:bb:00:00:00:01'), 'Profiled')
+        self.assertEqual(len(mirror.get_endpoints_in_group('Blacklist')), 84)
+        self.assertIsNotNone(mirror.get_device_id('sw1'))
+
+        self.fake.add('endpoint', 'AA:BB:CC:00:11:24', mac='AA:BB:CC:00:11:24', groupId=self.group_ids[2])
+        self.assertEqual(mirror.refresh(), [self.group_ids[2]])
+        self.assertEqual(mirror.get_endpoint('AA:BB:CC:00:11:24')['group'], 'Workstation')
+
+
+    def test_endpoint_mirror_sync_resumes(self):
+        mirror = EndpointMirror(self.ise, workers=1)
+        self.ise.max_page_size = 20
+        get_page = self.ise._get_page
+
+        def fail_in_last_group(url, page=None):
+            if self.group_ids[2] in url and page == 3:
+                raise ERSError('Connection reset', 503)
+            return get_page(url, page)
+
+        with patch.object(self.ise, '_get_page', side_effect=fail_in_last_group):
+            self.assertRaises(ERSError, mirror.sync)
+        self.fake.requests = 0
+
+        self.assertEqual(mirror.sync(), {'endpoint_groups': 3, 'endpoints': 250, 'devices': 0})
+        # Pages 2 to 5 of the unfinished group, then the device listing the first run never reached
+        self.assertEqual(self.fake.requests, 5)
+        self.assertIsNone(mirror._state('sync_started'))
+
+    def test_endpoint_mirror_thread_survives_errors(self):
+        mirror = EndpointMirror(self.ise)
+        mirror.sync()
+        failed = Semaphore(0)
+
+        def refresh():
+            failed.release()
+            raise KeyError('groupId')
+
+        with patch.object(mirror, 'refresh', side_effect=refresh), self.assertLogs('cream', 'ERROR'):
+            mirror.start(interval=0.01, full_every=0)
+            # The thread carries on after the first failure
+            for _ in range(3):
+                self.assertTrue(failed.acquire(timeout=5))
+            mirror.stop()
+
+        self.assertGreaterEqual(mirror.freshness()['failures'], 2)
+        self.assertEqual(mirror.freshness()['error'], "KeyError: 'groupId'")
+        self.assertEqual(mirror.get_endpoint_group_of('aa:bb:00:00:00:01'), 'Profiled')
+
+class RequestGovernorTest(TestCase):
+
+    def test_rate_limit_spaces_requests(self):
+        governor = RequestGovernor(rate_limit=10)
+
+        with patch('cream.time.monotonic', return_value=100), patch('cream.time.sleep') as sleep:
+            for _ in range(3):
+                with governor:
+                    pass
+
+        self.assertEqual([round(c[0][0], 3) for c in sleep.call_args_list], [0.1, 0.2])
+
+
+class MultiNodeTest(TestCase):
+
+    def setUp(self):
+        self.primary = FakeERS()
+        self.secondary = FakeERS()
+        for fake in (self.primary, self.secondary):
+            fake.start()
+            fake.populate(250)
+        self.ise = ERS('ise_node', 'ers_user', 'ers_pass', url_base=self.primary.url_base,
+                       nodes=[self.secondary.url_base])
+
+    def tearDown(self):
+        self.primary.stop()
+        self.secondary.stop()
+
+    def test_reads_go_to_nodes_and_writes_to_primary(self):
+        self.primary.requests = self.secondary.requests = 0
+
+        self.assertEqual(len(list(self.ise.iter_endpoints())), 250)
+        self.assertTrue(self.ise.add_endpoint('test01', 'AA:BB:CC:00:11:22', 'group-id')['success'])
+
+        self.assertEqual((self.primary.requests, self.secondary.requests), (1, 3))
+
+    def test_failover_to_primary(self):
+        self.secondary.stop()
+
+        self.assertEqual(len(list(self.ise.iter_endpoints(workers=2))), 250)
+        self.assertFalse(self.ise.nodes.stats()[self.secondary.url_base]['healthy'])
+        self.assertFalse(self.ise.check_nodes()[self.secondary.url_base]['healthy'])
+
+
+    def test_throttled_nodes_keep_their_reads(self):
+        self.secondary.error_rate, self.secondary.error_status = 1, 429
+        self.primary.requests = 0
+
+        # A fixed backoff, long enough that the node is still throttled when it is checked
+        with patch.object(self.ise, '_retry_delay', return_value=0.2):
+            self.assertEqual(self.ise.get_endpoint_groups()['error'], 429)
+        self.assertEqual(self.primary.requests, 0)
+        self.assertTrue(self.ise.nodes.stats()[self.secondary.url_base]['throttled'])
+
+        self.secondary.error_rate = 0
+        self.assertTrue(self.ise.get_endpoint_groups()['success'])
+        self.assertEqual(self.primary.requests, 0)
+
+    def test_health_probes_are_instrumented(self):
+        records = []
+        self.ise.add_hook(records.append)
+
+        self.assertTrue(self.ise.check_nodes()[self.secondary.url_base]['healthy'])
+        self.assertEqual([(i.url.startswith(self.secondary.url_base), i.status_code) for i in records], [(True, 200)])
+
+class BatchTest(TestCase):
+
+    def test_adapts_pool_size(self):
+        batch = Batch(ERS('ise_node', 'ers_user', 'ers_pass'), workers=8, max_workers=10)
+        for _ in range(8):
+            batch._adapt(0.1, False)
+        self.assertEqual(batch.limit, 9)
+
+        for _ in range(9):
+            batch._adapt(0.1, True)
+        self.assertEqual(batch.limit, 4)
+
+        for _ in range(4):
+            batch._adapt(1.0, False)
+        self.assertEqual(batch.limit, 2)
+        batch.close()
+
+
+class NodePoolTest(TestCase):
+
+    def test_pick(self):
+        pool = NodePool(['https://a:9060/ers', 'https://b:9060/ers', 'https://c:9060/ers'], strategy='least_latency')
+        pool.succeeded('https://a:9060/ers', 0.2)
+        pool.succeeded('https://b:9060/ers', 0.1)
+        pool.succeeded('https://c:9060/ers', 0.3)
+        self.assertEqual(pool.pick(), 'https://b:9060/ers')
+
+        pool.failed('https://b:9060/ers')
+        self.assertEqual(pool.pick(), 'https://a:9060/ers')
+
+        pool.strategy = 'round_robin'
+        self.assertEqual({pool.pick() for _ in range(4)}, {'https://a:9060/ers', 'https://c:9060/ers'})
+
+    def test_route(self):
+        pool = NodePool(['https://b:9060/ers'])
+
+        self.assertEqual(pool.route('https://a:9060/ers/config/endpoint?page=2', 'https://b:9060/ers',
+                                    'https://a:9060/ers'), 'https://b:9060/ers/config/endpoint?page=2')
+        self.assertEqual(pool.route('https://x/monitor', 'https://b:9060/ers', 'https://a:9060/ers'),
+                         'https://x/monitor')
+
+
+class JSONDecoderTest(TestCase):
+    page = json.dumps({'SearchResult': {'total': 1, 'resources': [
+        {'id': 'id-1', 'name': 'sw1', 'description': '', 'link': {'rel': 'self', 'href': 'x'}}]}}).encode('utf-8')
+
+    def test_backends_agree(self):
+        backends = [b for b in JSONDecoder.backends if b == 'json' or {'msgspec': msgspec, 'orjson': orjson}[b]]
+        pages = [JSONDecoder(b).decode_page(self.page)['SearchResult']['resources'][0] for b in backends]
+
+        for page in pages:
+            self.assertEqual((page['name'], page['id']), ('sw1', 'id-1'))
+        self.assertEqual(JSONDecoder('json').decode(b'{"a": [1]}'), {'a': [1]})
+
+    @skipIf(msgspec is None, 'msgspec is not installed')
+    def test_msgspec_page_keeps_listing_fields_only(self):
+        row = JSONDecoder('msgspec').decode_page(self.page)['SearchResult']['resources'][0]
+
+        self.assertNotIn('link', row)
+
+    def test_null_description_and_string_total(self):
+        page = json.dumps({'SearchResult': {'total': '2', 'resources': [
+            {'id': 'id-1', 'name': 'sw1', 'description': None}, {'id': 'id-2', 'name': 'sw2'}]}}).encode('utf-8')
+        backends = [b for b in JSONDecoder.backends if b == 'json' or {'msgspec': msgspec, 'orjson': orjson}[b]]
+
+        for backend in backends:
+            json_res = JSONDecoder(backend).decode_page(page)['SearchResult']
+            self.assertEqual(int(json_res['total']), 2)
+            self.assertIsNone(json_res['resources'][0]['description'])
+
+    @skipIf(msgspec is None, 'msgspec is not installed')
+    def test_msgspec_page_falls_back_to_full_decode(self):
+        page = json.dumps({'SearchResult': {'total': 1, 'resources': [{'id': 'id-1', 'name': None}]}}).encode('utf-8')
+
+        self.assertIsNone(JSONDecoder('msgspec').decode_page(page)['SearchResult']['resources'][0]['name'])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            JSONDecoder('yaml')
+
+
+class ResourceListTest(TestCase):
+
+    def setUp(self):
+        self.rows = [('AA:BB:CC:00:11:{0:02X}'.format(i), str(uuid.uuid4())) for i in range(10)]
+        self.compact = ResourceList()
+        for name, oid in self.rows:
+            self.compact.append(name, oid)
+
+    def test_rows_and_slices(self):
+        self.assertEqual(self.compact, self.rows)
+        self.assertEqual(self.compact[-1], self.rows[-1])
+        self.assertEqual(self.compact[2:8][1:3], self.rows[2:8][1:3])
+        self.assertEqual(self.compact[::3], self.rows[::3])
+        self.assertEqual(self.compact[5:][0:100].ids, [oid for _, oid in self.rows[5:]])
+        self.assertEqual(len(self.compact[8:2]), 0)
+        self.assertIs(self.compact[2:8]._names, self.compact._names)
+
+    def test_non_uuid_ids(self):
+        self.compact.append('AA:BB:CC:00:11:FF', 'not-a-uuid')
+
+        self.assertEqual(self.compact, self.rows + [('AA:BB:CC:00:11:FF', 'not-a-uuid')])
+
+
+class ResolutionCacheTest(TestCase):
+
+    def test_lru_eviction(self):
+        cache = ResolutionCache(max_size=2)
+        cache.set('endpointgroup', 'a', '1')
+        cache.set('endpointgroup', 'b', '2')
+        cache.get('endpointgroup', 'a')
+        cache.set('endpointgroup', 'c', '3')
+
+        self.assertEqual(cache.get('endpointgroup', 'a'), '1')
+        self.assertIsNone(cache.get('endpointgroup', 'b'))
+
+    def test_ttl_expiry(self):
+        cache = ResolutionCache(ttl=10)
+        with patch('cream.time.monotonic', return_value=100):
+            cache.set('networkdevice', 'sw1', 'id-sw1')
+        with patch('cream.time.monotonic', return_value=111):
+            self.assertIsNone(cache.get('networkdevice', 'sw1'))
+
+
+class DetailCacheTest(TestCase):
+
+    def test_disk_tier_size_cap(self):
+        path = os.path.join(tempfile.mkdtemp(), 'details.db')
+        cache = DetailCache(path=path, max_size=0, max_disk_size=100)
+        for i in range(250):
+            cache.set('endpoint', str(i), '"etag"', b'{}')
+        cache.set('endpoint', '249', '"etag2"', b'{}')
+
+        rows = cache.db.execute('SELECT count(*) FROM details').fetchone()[0]
+        self.assertLessEqual(rows, 100)
+        self.assertEqual(cache.get('endpoint', '249')[0], '"etag2"')
+        self.assertIsNone(cache.get('endpoint', '0'))
+
+        cache.invalidate('endpoint', '249')
+        self.assertEqual(DetailCache(path=path, max_disk_size=100)._disk_rows, rows - 1)
+
+
+@skipIf(aiohttp is None, 'aiohttp is not installed')
+class AsyncErsTest(TestCase):
+
+    def setUp(self):
+        self.ise = AsyncERS('ise_node', 'ers_user', 'ers_pass')
+
+    def run_async(self, coro):
+        return asyncio.new_event_loop().run_until_complete(coro)
+
+    def test_get_endpoint_group_id(self):
+        async def request(method, url, data=None, page=False):
+            return 200, {'SearchResult': {'total': 1, 'resources': [{'name': 'Blacklist', 'id': 'group-id'}]}}
+
+        with patch.object(self.ise, '_request', side_effect=request):
+            result = self.run_async(self.ise.get_endpoint_group_id('Blacklist'))
+
+        self.assertEqual(result, {'success': True, 'response': 'group-id', 'error': ''})
+
+    def test_against_fake_server(self):
+        async def run():
+            async with AsyncERS('ise_node', 'ers_user', 'ers_pass', url_base=fake.url_base) as ise:
+                added = await ise.add_endpoint('test02', 'AA:BB:CC:00:11:24', group_ids[0])
+                found = await ise.get_endpoint('AA:BB:CC:00:11:24')
+                macs = [mac async for mac in ise.iter_endpoints_in_group(group_ids[0], workers=3)]
+                return added, found, macs
+
+        with FakeERS() as fake:
+            group_ids = fake.populate(300)
+            added, found, macs = self.run_async(run())
+
+        self.assertTrue(added['success'])
+        self.assertEqual(found['response']['groupId'], group_ids[0])
+        self.assertEqual(len(macs), 101)
+
+    def test_coalesces_identical_gets(self):
+        async def run():
+            async with AsyncERS('ise_node', 'ers_user', 'ers_pass', url_base=fake.url_base) as ise:
+                return await asyncio.gather(*[ise.get_endpoint_group_id('Blacklist') for _ in range(10)])
+
+        with FakeERS(latency=0.1) as fake:
+            group_ids = fake.populate(3)
+            results = self.run_async(run())
+
+        self.assertEqual(set(i['response'] for i in results), {group_ids[0]})
+        self.assertEqual(fake.requests, 1)
+
+    def test_coalesced_results_are_not_shared(self):
+        async def run():
+            async with AsyncERS('ise_node', 'ers_user', 'ers_pass', url_base=fake.url_base) as ise:
+                return await asyncio.gather(*[ise.get_endpoint_group('Blacklist') for _ in range(2)])
+
+        with FakeERS(latency=0.1) as fake:
+            fake.populate(3)
+            results = self.run_async(run())
+
+        self.assertEqual(fake.requests, 2)
+        results[0]['response']['description'] = 'changed'
+        self.assertEqual(results[1]['response']['description'], '')
+
+    def test_hooks(self):
+        records = []
+
+        async def run():
+            async with AsyncERS('ise_node', 'ers_user', 'ers_pass', url_base=fake.url_base,
+                                hooks=[records.append]) as ise:
+                macs = [mac async for mac in ise.iter_endpoints_in_group(group_ids[0], page_size=25)]
+                await ise.get_endpoint('AA:BB:00:00:00:00')
+                return macs
+
+        with FakeERS() as fake:
+            group_ids = fake.populate(150)
+            self.assertEqual(len(self.run_async(run())), 50)
+
+        self.assertEqual([(i.resource, i.status_code, i.page) for i in records],
+                         [('endpoint', 200, 1), ('endpoint', 200, 2), ('endpoint', 200, None),
+                          ('endpoint', 200, None)])
+        self.assertTrue(all(i.bytes_received > 0 for i in records))
+
+    def test_pool_wait_is_not_timed(self):
+        async def run():
+            async with AsyncERS('ise_node', 'ers_user', 'ers_pass', url_base=fake.url_base, timeout=0.5,
+                                limit=2) as ise:
+                return await asyncio.gather(*[ise.get_endpoint(mac) for mac in macs])
+
+        with FakeERS(latency=0.05) as fake:
+            fake.populate(40)
+            macs = [r['mac'] for r in fake.resources['endpoint'].values()]
+            results = self.run_async(run())
+
+        self.assertTrue(all(i['success'] for i in results))
+
+    def test_html_error_page(self):
+        async def run():
+            async with AsyncERS('ise_node', 'ers_user', 'ers_pass', url_base=fake.url_base) as ise:
+                return await ise.get_endpoint_groups()
+
+        with FakeERS(error_rate=1, error_status=502, error_body=b'<html>Bad Gateway</html>') as fake:
+            result = self.run_async(run())
+
+        self.assertEqual(result, {'success': False, 'response': 'Bad Gateway', 'error': 502})
+
+    def test_iter_endpoints_in_group(self):
+        async def request(method, url, data=None, page=False):
+            page = int(url.split('page=')[1]) if 'page=' in url else 1
+            return 200, search_result(['ep-{0}'.format(page)], 3, next_href='unused').json()
+
+        async def collect():
+            return [mac async for mac in self.ise.iter_endpoints_in_group('group-id', page_size=1, workers=2)]
+
+        with patch.object(self.ise, '_request', side_effect=request):
+            self.assertEqual(self.run_async(collect()), ['ep-1', 'ep-2', 'ep-3'])
 
 if __name__ == '__main__':
     unittest.main()
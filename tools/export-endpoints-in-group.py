@@ -0,0 +1,24 @@
+# export-endpoints-in-group.py [endpoint-group-name] [output-file]
+# -------------------------------------------------
+# Will export all endpoints in an endpoint identity group to a file in the ISE endpoint import template layout.
+# Use a .ndjson file name for JSON lines, add .gz to compress.
+#-------------------------------------------------
+# Example: ./export-endpoints-in-group.py Blacklist blacklist.csv.gz
+
+import sys
+sys.path.append(r'C:\scripts\ise-python')
+
+from ise.cream import ERS
+
+ise = ERS(ise_node='[ise-ip]', ers_user='[ers-admin]', ers_pass='[ers-password]', verify=False, disable_warnings=True)
+
+group_name = sys.argv[1]
+path       = sys.argv[2]
+
+res = ise.export_endpoints_in_group(group_name, path, workers=8)
+
+if res['success']:
+	print('Exported {0} endpoints from {1} to {2}'.format(res['response'], group_name, path))
+else:
+	print('Export failed: {0} ({1})'.format(res['response'], res['error']))
+	sys.exit(1)
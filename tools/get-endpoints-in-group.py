@@ -14,23 +14,12 @@ ise = ERS(ise_node='[ise-ip]', ers_user='[ers-admin]', ers_pass='[ers-password]'
 group_name = sys.argv[1]
 group_id   = ise.get_endpoint_group_id(group_name)['response']
 
-done = 0
-page = 1
+total = 0
 
 print("Group: {0}, ID: {1}".format( group_name, group_id) )
 
-while done != 1:
+for mac in ise.iter_endpoints_in_group(group_id=group_id):
+	print(mac)
+	total = total + 1
 
-	res = ise.list_endpoints_in_group(group_id=group_id, page=page)
-
-
-	for x in res['response']:
-		print(x)
-
-	if res['next']:
-		#print('more coming')
-		page = page + 1
-	else:
-		done = 1
-
-print('Total endpoints: {0}. Pages: {1}'.format( res['total'], page))
+print('Total endpoints: {0}'.format(total))
@@ -0,0 +1,31 @@
+# onboard-devices.py [inventory-file] [report-file] [--bulk]
+# -------------------------------------------------
+# Will add every network device in a csv or YAML inventory (add_device arguments as columns or keys) and write
+# a csv report with the outcome of each device. Rows with a bad IP address or an unknown device group are
+# reported without being sent. With --bulk the devices go through the ERS bulk request API.
+#-------------------------------------------------
+# Example: ./onboard-devices.py site21.csv site21-report.csv
+
+import sys
+sys.path.append(r'C:\scripts\ise-python')
+
+from ise.cream import ERS
+
+ise = ERS(ise_node='[ise-ip]', ers_user='[ers-admin]', ers_pass='[ers-password]', verify=False, disable_warnings=True)
+
+inventory = sys.argv[1]
+report    = sys.argv[2]
+bulk      = '--bulk' in sys.argv[3:]
+
+res = ise.bulk_add_devices(inventory, report=report, bulk=bulk, workers=8)
+
+if isinstance(res['response'], str):
+	print('Onboarding failed: {0} ({1})'.format(res['response'], res['error']))
+	sys.exit(1)
+
+for name, outcome in res['response'].items():
+	if not outcome['success']:
+		print('{0} failed: {1}'.format(name, outcome['response']))
+print('{0} of {1} devices added, see {2}'.format(sum(1 for i in res['response'].values() if i['success']), len(res['response']), report))
+if not res['success']:
+	sys.exit(1)
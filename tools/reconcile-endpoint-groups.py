@@ -0,0 +1,43 @@
+# reconcile-endpoint-groups.py [desired-file] [--prune] [--apply]
+# -------------------------------------------------
+# Will compare endpoint identity group membership in ISE with a desired state file (ISE endpoint import
+# template csv, or ndjson with mac and group, optionally .gz) and print the adds and moves needed. With
+# --prune, endpoints in the managed groups that the file does not list are deleted, endpoint and all, so only
+# pass it with a complete desired state. With --apply the changes are made.
+#-------------------------------------------------
+# Example: ./reconcile-endpoint-groups.py cmdb.csv --apply
+
+import sys
+sys.path.append(r'C:\scripts\ise-python')
+
+from ise.cream import ERS
+
+ise = ERS(ise_node='[ise-ip]', ers_user='[ers-admin]', ers_pass='[ers-password]', verify=False, disable_warnings=True)
+
+path  = sys.argv[1]
+prune = '--prune' in sys.argv[2:]
+apply = '--apply' in sys.argv[2:]
+
+res = ise.plan_group_membership(path, prune=prune, workers=8)
+if not res['success']:
+	print('Planning failed: {0} ({1})'.format(res['response'], res['error']))
+	sys.exit(1)
+
+plan = res['response']
+for mac, group in plan.add:
+	print('add    {0} {1}'.format(mac, group))
+for mac, group in plan.move:
+	print('move   {0} {1}'.format(mac, group))
+for mac in plan.delete:
+	print('delete {0}'.format(mac))
+for mac in plan.rejects:
+	print('invalid MAC {0}'.format(mac))
+print('{0} to add, {1} to move, {2} to delete, {3} unchanged'.format(len(plan.add), len(plan.move), len(plan.delete), plan.unchanged))
+
+if apply:
+	res = ise.apply_group_membership(plan, workers=8)
+	for mac, outcome in res['response'].items():
+		if not outcome['success']:
+			print('{0} failed: {1}'.format(mac, outcome['response']))
+	if not res['success']:
+		sys.exit(1)